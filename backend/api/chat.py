@@ -1,13 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
 from models.chat import ChatRequest, ChatResponse, PocketChatRequest, PocketChatResponse
 from services.memu_service import MemUService
 from core.dependencies import get_memu_service, get_db, require_api_key
-from services.pocket_coo_service import PocketCOOService, build_prompt_memories
+from core import admission, circuit_breaker, deadline, idempotency, metrics
+from core.circuit_breaker import Endpoint
+from core.ttl_cache import TTLCache
+from core.profiling import run_in_threadpool
+from services import memory_extraction, model_router
+from services.model_router import LARGE, SMALL, RouteDecision, small_max_tokens
+from services.pocket_coo_service import PocketCOOService, applied_memu_hashes, build_prompt_memories, slim_episode
 from sqlalchemy.orm import Session
-import openai
+import hashlib
 import os
-from typing import Any, Dict, List, Optional
-import httpx
+import time
+import unicodedata
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 
 def _env_api_key(name: str) -> Optional[str]:
@@ -27,11 +35,72 @@ def _env_api_key(name: str) -> Optional[str]:
     return stripped
 
 
-def _openai_chat_completion_with_fallback(
+# 同じ指示（「いつもの感じで」「了解」など）への応答を使い回す。LLM_CACHE_SIZE=0 で無効
+# キーは system prompt 全体なので、ヒットが見込めるのは /api/chat/message（system prompt は検索した記憶だけ）。
+# /api/chat の system prompt には毎ターン変わる「最近のやり取り」が入るため、ほぼ同じ state への再送でしか当たらない
+# （記憶が違えば応答も変わるべきなので、プレフィックスだけをキーにすることはしない）
+_response_cache: TTLCache[Tuple[str, float, str]] = TTLCache(
+    maxsize=int(os.getenv("LLM_CACHE_SIZE") or "1024"),
+    ttl=float(os.getenv("LLM_CACHE_TTL") or "300"),
+)
+metrics.BUFFER_SIZE.set_function(lambda: len(_response_cache), buffer="llm_response_cache")
+
+
+def _normalize_message(message: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", message or "").lower().split())
+
+
+def _response_cache_key(provider: str, endpoints: List[Endpoint], temperature: float, system_prompt: str, user_message: str) -> Tuple[Any, ...]:
+    # 候補の並び（エンドポイント名・モデル・max_tokens）ごと、system prompt はハッシュで持つ。
+    # max_tokens を入れないと small の短い応答が large のターンに返ってしまう
+    chain = tuple(
+        (e.name, e.call.keywords.get("model"), e.call.keywords.get("max_tokens")) for e in endpoints if isinstance(e.call, partial)
+    )
+    system_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+    return (provider, chain, round(float(temperature), 3), system_hash, _normalize_message(user_message))
+
+
+def _no_cache(cache_control: Optional[str]) -> bool:
+    directives = {d.strip().lower() for d in (cache_control or "").split(",")}
+    return bool(directives & {"no-cache", "no-store"})
+
+
+def _llm_timeout() -> float:
+    return deadline.timeout(float(os.getenv("LLM_TIMEOUT_SECONDS") or "30"))
+
+
+def _llm_reserve() -> float:
+    """LLM 呼び出しのために残しておく秒数。これを割り込む任意の段階は飛ばす"""
+    return float(os.getenv("CHAT_LLM_RESERVE_SECONDS") or "8")
+
+
+# LLM の後の任意の段階に必要な残り時間（その後の保存の分を含む）
+_POST_LLM_OPTIONAL_SECONDS = 2.0
+
+
+def _openai_chat_completion(
     *,
+    api_key: str,
+    base_url: Optional[str],
+    model: str,
     messages: List[Dict[str, Any]],
     temperature: float,
+    max_tokens: Optional[int] = None,
 ) -> str:
+    import openai  # import が重いので実際に呼ぶ時まで遅らせる
+
+    client_kwargs: Dict[str, Any] = {"api_key": api_key, "timeout": _llm_timeout(), "max_retries": 0}
+    if base_url:
+        client_kwargs["base_url"] = base_url
+    client = openai.OpenAI(**client_kwargs)
+    create_kwargs: Dict[str, Any] = {"model": model, "messages": messages, "temperature": temperature}
+    if max_tokens:
+        create_kwargs["max_tokens"] = max_tokens
+    completion = client.chat.completions.create(**create_kwargs)
+    return completion.choices[0].message.content
+
+
+def _openai_endpoints(*, messages: List[Dict[str, Any]], temperature: float, tier: str = LARGE) -> List[Endpoint]:
     primary_api_key = _env_api_key("OPENAI_API_KEY")
     primary_base_url = os.getenv("OPENAI_BASE_URL")
     primary_model = os.getenv("OPENAI_MODEL") or "gpt-4o-mini"
@@ -40,39 +109,73 @@ def _openai_chat_completion_with_fallback(
     backup_base_url = os.getenv("OPENAI_BASE_URL_BACKUP")
     backup_model = os.getenv("OPENAI_MODEL_BACKUP") or primary_model
 
-    last_error: Optional[Exception] = None
-    for api_key, base_url, model in [
-        (primary_api_key, primary_base_url, primary_model),
-        (backup_api_key, backup_base_url, backup_model),
+    max_tokens: Optional[int] = None
+    if tier == SMALL and os.getenv("OPENAI_MODEL_SMALL"):
+        primary_model = backup_model = os.getenv("OPENAI_MODEL_SMALL")
+        max_tokens = small_max_tokens()
+
+    endpoints: List[Endpoint] = []
+    for name, api_key, base_url, model in [
+        ("openai_primary", primary_api_key, primary_base_url, primary_model),
+        ("openai_backup", backup_api_key, backup_base_url, backup_model),
     ]:
         if not api_key:
             continue
-        try:
-            client_kwargs: Dict[str, Any] = {"api_key": api_key}
-            if base_url:
-                client_kwargs["base_url"] = base_url
-            client = openai.OpenAI(**client_kwargs)
-            completion = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
+        endpoints.append(
+            Endpoint(
+                name,
+                partial(
+                    _openai_chat_completion,
+                    api_key=api_key,
+                    base_url=base_url,
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                ),
             )
-            return completion.choices[0].message.content
-        except Exception as e:
-            last_error = e
-            continue
-
-    if last_error:
-        raise last_error
-    raise RuntimeError("OPENAI_API_KEY is not set")
+        )
+    return endpoints
 
 
-def _anthropic_message_with_fallback(
+def _anthropic_message(
     *,
+    api_key: str,
+    base_url: str,
+    model: str,
     system: str,
     user_message: str,
     temperature: float,
+    max_tokens: int,
 ) -> str:
+    import httpx
+
+    url = f"{base_url.rstrip('/')}/v1/messages"
+    headers = {
+        "x-api-key": api_key,
+        "anthropic-version": os.getenv("ANTHROPIC_VERSION") or "2023-06-01",
+        "content-type": "application/json",
+    }
+    payload = {
+        "model": model,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "system": system,
+        "messages": [{"role": "user", "content": user_message}],
+    }
+    with httpx.Client(timeout=_llm_timeout()) as client:
+        res = client.post(url, headers=headers, json=payload)
+        res.raise_for_status()
+        data = res.json()
+    parts = data.get("content") or []
+    texts: List[str] = []
+    for part in parts:
+        if isinstance(part, dict) and part.get("type") == "text":
+            texts.append(part.get("text") or "")
+    return "".join(texts).strip() or ""
+
+
+def _anthropic_endpoints(*, system: str, user_message: str, temperature: float, tier: str = LARGE) -> List[Endpoint]:
     primary_api_key = _env_api_key("ANTHROPIC_API_KEY")
     primary_base_url = os.getenv("ANTHROPIC_BASE_URL") or "https://api.anthropic.com"
     primary_model = os.getenv("ANTHROPIC_MODEL") or "claude-3-5-sonnet-latest"
@@ -81,54 +184,50 @@ def _anthropic_message_with_fallback(
     backup_base_url = os.getenv("ANTHROPIC_BASE_URL_BACKUP") or primary_base_url
     backup_model = os.getenv("ANTHROPIC_MODEL_BACKUP") or primary_model
 
-    anthropic_version = os.getenv("ANTHROPIC_VERSION") or "2023-06-01"
     max_tokens = int(os.getenv("ANTHROPIC_MAX_TOKENS") or "1024")
-
-    last_error: Optional[Exception] = None
-    for api_key, base_url, model in [
-        (primary_api_key, primary_base_url, primary_model),
-        (backup_api_key, backup_base_url, backup_model),
+    if tier == SMALL and os.getenv("ANTHROPIC_MODEL_SMALL"):
+        primary_model = backup_model = os.getenv("ANTHROPIC_MODEL_SMALL")
+        max_tokens = small_max_tokens()
+
+    endpoints: List[Endpoint] = []
+    for name, api_key, base_url, model in [
+        ("anthropic_primary", primary_api_key, primary_base_url, primary_model),
+        ("anthropic_backup", backup_api_key, backup_base_url, backup_model),
     ]:
         if not api_key:
             continue
-        try:
-            url = f"{base_url.rstrip('/')}/v1/messages"
-            headers = {
-                "x-api-key": api_key,
-                "anthropic-version": anthropic_version,
-                "content-type": "application/json",
-            }
-            payload = {
-                "model": model,
-                "max_tokens": max_tokens,
-                "temperature": temperature,
-                "system": system,
-                "messages": [{"role": "user", "content": user_message}],
-            }
-            with httpx.Client(timeout=30.0) as client:
-                res = client.post(url, headers=headers, json=payload)
-                res.raise_for_status()
-                data = res.json()
-            parts = data.get("content") or []
-            texts: List[str] = []
-            for part in parts:
-                if isinstance(part, dict) and part.get("type") == "text":
-                    texts.append(part.get("text") or "")
-            return "".join(texts).strip() or ""
-        except Exception as e:
-            last_error = e
-            continue
+        endpoints.append(
+            Endpoint(
+                name,
+                partial(
+                    _anthropic_message,
+                    api_key=api_key,
+                    base_url=base_url,
+                    model=model,
+                    system=system,
+                    user_message=user_message,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                ),
+            )
+        )
+    return endpoints
 
-    if last_error:
-        raise last_error
-    raise RuntimeError("ANTHROPIC_API_KEY is not set")
 
+def _record_source(route: Optional[RouteDecision], source: str, cache: str) -> None:
+    metrics.LLM_RESPONSES.inc(source=source, cache=cache)
+    if route is not None:
+        route.features["source"] = source
 
+
+@metrics.timed_stage("chat_response_text")
 def _chat_response_text(
     *,
     system_prompt: str,
     user_message: str,
     temperature: float,
+    use_cache: bool = True,
+    route: Optional[RouteDecision] = None,
 ) -> str:
     provider = (os.getenv("CHAT_LLM_PROVIDER") or "").strip().lower()
     if not provider:
@@ -139,34 +238,101 @@ def _chat_response_text(
         else:
             provider = "none"
 
+    tier = route.tier if route is not None else LARGE
+    openai_messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_message},
+    ]
+    # 候補を順に試す（Anthropic primary → backup → OpenAI primary → backup）。
+    # ブレーカーが開いている候補は飛ばし、LLM_HEDGE=1 なら遅い候補に次の候補をヘッジする
     if provider == "anthropic":
-        try:
-            return _anthropic_message_with_fallback(
-                system=system_prompt,
-                user_message=user_message,
-                temperature=temperature,
-            )
-        except Exception:
-            if _env_api_key("OPENAI_API_KEY") or _env_api_key("OPENAI_API_KEY_BACKUP"):
-                return _openai_chat_completion_with_fallback(
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_message},
-                    ],
-                    temperature=temperature,
-                )
-            raise
-
-    if provider == "openai":
-        return _openai_chat_completion_with_fallback(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message},
-            ],
+        endpoints = _anthropic_endpoints(system=system_prompt, user_message=user_message, temperature=temperature, tier=tier)
+        endpoints += _openai_endpoints(messages=openai_messages, temperature=temperature, tier=tier)
+        if not endpoints:
+            raise RuntimeError("ANTHROPIC_API_KEY is not set")
+    elif provider == "openai":
+        endpoints = _openai_endpoints(messages=openai_messages, temperature=temperature, tier=tier)
+        if not endpoints:
+            raise RuntimeError("OPENAI_API_KEY is not set")
+    else:
+        raise RuntimeError("No LLM provider configured")
+    if route is not None:
+        route.features["model"] = endpoints[0].call.keywords.get("model")
+        route.features["max_tokens"] = endpoints[0].call.keywords.get("max_tokens")
+
+    # source は実際に応答したエンドポイント（フォールバック・ヘッジ後のもの。キャッシュなら元の応答元）
+    if not use_cache or _response_cache.maxsize <= 0:
+        metrics.LLM_CACHE_REQUESTS.inc(result="bypass")
+        text, source = circuit_breaker.call_with_source(endpoints)
+        _record_source(route, source, "bypass")
+        return text
+    key = _response_cache_key(provider, endpoints, temperature, system_prompt, user_message)
+    cached = _response_cache.get(key)
+    if cached is not None:
+        text, elapsed, source = cached
+        metrics.LLM_CACHE_REQUESTS.inc(result="hit")
+        metrics.LLM_CACHE_SAVED_SECONDS.inc(elapsed)
+        _record_source(route, source, "hit")
+        return text
+    metrics.LLM_CACHE_REQUESTS.inc(result="miss")
+    start = time.perf_counter()
+    text, source = circuit_breaker.call_with_source(endpoints)
+    _record_source(route, source, "miss")
+    if text:
+        _response_cache.set(key, (text, time.perf_counter() - start, source))
+    return text
+
+
+def _routed_response_text(
+    *,
+    route: str,
+    user_id: str,
+    memory_used: Optional[List[Any]],
+    system_prompt: str,
+    user_message: str,
+    temperature: float,
+    use_cache: bool = True,
+) -> str:
+    """model_router でターンを分類してから _chat_response_text を呼び、判定を記録する"""
+    if not model_router.router_enabled():
+        return _chat_response_text(
+            system_prompt=system_prompt, user_message=user_message, temperature=temperature, use_cache=use_cache
+        )
+    decision = model_router.classify_turn(user_message, memory_used)
+    start = time.perf_counter()
+    ok = False
+    try:
+        text = _chat_response_text(
+            system_prompt=system_prompt,
+            user_message=user_message,
             temperature=temperature,
+            use_cache=use_cache,
+            route=decision,
         )
+        ok = True
+        return text
+    finally:
+        model_router.log_decision(
+            decision,
+            route=route,
+            user_id=user_id,
+            latency_ms=(time.perf_counter() - start) * 1000,
+            ok=ok,
+        )
+
+def _has_any_llm_key() -> bool:
+    return bool(
+        _env_api_key("ANTHROPIC_API_KEY")
+        or _env_api_key("ANTHROPIC_API_KEY_BACKUP")
+        or _env_api_key("OPENAI_API_KEY")
+        or _env_api_key("OPENAI_API_KEY_BACKUP")
+    )
+
 
-    raise RuntimeError("No LLM provider configured")
+def _admitted(fn: Callable[..., str], **kwargs: Any) -> str:
+    """同時実行数の上限内で LLM を呼ぶ。イベントループを塞がないようスレッドプールから呼ぶ"""
+    with admission.llm_slot():
+        return fn(**kwargs)
 
 router = APIRouter(dependencies=[Depends(require_api_key)])
 
@@ -174,21 +340,47 @@ router = APIRouter(dependencies=[Depends(require_api_key)])
 @router.post("", response_model=PocketChatResponse)
 async def pocket_chat(
     request: PocketChatRequest,
+    response: Response,
     db: Session = Depends(get_db),
     memu: MemUService = Depends(get_memu_service),
+    cache_control: Optional[str] = Header(default=None, alias="cache-control"),
+    idempotency_key: Optional[str] = Header(default=None, alias="idempotency-key"),
+    x_api_key: Optional[str] = Header(default=None, alias="x-api-key"),
+    x_request_timeout: Optional[str] = Header(default=None, alias="x-request-timeout"),
 ):
+    """Pocket COO のチャット
+
+    ``Cache-Control: no-cache`` で LLM 応答キャッシュを使わない。``Idempotency-Key`` 付きの再送は
+    LLM・エピソード追加・memU を再実行せず最初のレスポンスを返す（core/idempotency.py）。
+    過負荷時は 429 + Retry-After（core/admission.py）。``X-Request-Timeout``（秒）で全体の締め切りを指定でき、
+    間に合わない任意の段階は飛ばして ``degraded`` に載せる（core/deadline.py）。
+    """
+    with deadline.scope(deadline.request_budget(x_request_timeout)):
+        return await idempotency.run_idempotent(
+            route="/api/chat",
+            user_id=request.user_id,
+            key=idempotency_key,
+            payload=request,
+            response=response,
+            fn=lambda: _pocket_chat(request, db, memu, cache_control, x_api_key),
+        )
+
+
+async def _pocket_chat(
+    request: PocketChatRequest,
+    db: Session,
+    memu: MemUService,
+    cache_control: Optional[str],
+    api_key: Optional[str],
+) -> PocketChatResponse:
     try:
+        has_any_llm_key = _has_any_llm_key()
+        if has_any_llm_key:
+            admission.check_rate_limits(request.user_id, api_key)
         service = PocketCOOService(db)
-        pre_state = service.get_state(request.user_id)
+        pre_state = await run_in_threadpool(service.get_state, request.user_id)
         identity_memory, project_memory, episode_memory, used = build_prompt_memories(pre_state)
 
-        has_any_llm_key = bool(
-            _env_api_key("ANTHROPIC_API_KEY")
-            or _env_api_key("ANTHROPIC_API_KEY_BACKUP")
-            or _env_api_key("OPENAI_API_KEY")
-            or _env_api_key("OPENAI_API_KEY_BACKUP")
-        )
-
         system_prompt = f"""あなたは「Pocket COO」、ユーザー専属の分身AIアシスタントです。
 
 ## あなたの役割
@@ -221,10 +413,16 @@ async def pocket_chat(
 
         style = (pre_state.get("identity") or {}).get("style") or {}
         if has_any_llm_key:
-            response_text = _chat_response_text(
+            response_text = await run_in_threadpool(
+                _admitted,
+                _routed_response_text,
+                route="/api/chat",
+                user_id=request.user_id,
+                memory_used=used,
                 system_prompt=system_prompt,
                 user_message=request.message,
                 temperature=0.7,
+                use_cache=not _no_cache(cache_control),
             )
         else:
             if style.get("format") == "bullet_points":
@@ -240,13 +438,21 @@ async def pocket_chat(
             else:
                 response_text = "了解。いつもの感じで進めます。（ANTHROPIC_API_KEY もしくは OPENAI_API_KEY を設定すると、より自然な応答に切り替わります）"
 
+        # memU の記憶による identity の補強は任意。締め切りが近ければ飛ばして保存を優先する
         memuu_items = []
-        try:
-            memuu_items = memu.retrieve_memories(query=request.message, user_id=request.user_id) or []
-        except Exception:
-            memuu_items = []
-
-        applied = service.apply_turn(
+        if deadline.allow_optional("identity_enrichment", need=_POST_LLM_OPTIONAL_SECONDS):
+            try:
+                memuu_items = await run_in_threadpool(
+                    memu.retrieve_memories,
+                    query=request.message,
+                    user_id=request.user_id,
+                    skip_hashes=applied_memu_hashes(pre_state),
+                ) or []
+            except Exception:
+                memuu_items = []
+
+        applied = await run_in_threadpool(
+            service.apply_turn,
             user_id=request.user_id,
             user_message=request.message,
             assistant_message=response_text,
@@ -254,43 +460,74 @@ async def pocket_chat(
             memuu_items=memuu_items,
         )
         state = applied["state"]
+        new_memory = dict(applied["new_memory"])
+        new_memory["episodes"] = [slim_episode(e) for e in new_memory.get("episodes") or []]
 
         return PocketChatResponse(
             response=response_text,
             memoryUsed=used,
-            newMemory=applied["new_memory"],
+            newMemory=new_memory,
             score=int(state.get("score") or 0),
             scoreDelta=int(applied.get("score_delta") or 0),
+            degraded=deadline.degraded(),
         )
+    except HTTPException:
+        raise
+    except deadline.DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/message", response_model=ChatResponse)
 async def send_message(
     request: ChatRequest,
-    memu: MemUService = Depends(get_memu_service)
+    response: Response,
+    memu: MemUService = Depends(get_memu_service),
+    cache_control: Optional[str] = Header(default=None, alias="cache-control"),
+    idempotency_key: Optional[str] = Header(default=None, alias="idempotency-key"),
+    x_api_key: Optional[str] = Header(default=None, alias="x-api-key"),
+    x_request_timeout: Optional[str] = Header(default=None, alias="x-request-timeout"),
 ):
     """チャットメッセージを送信
     
     Args:
         request: チャットリクエスト
         memu: memUサービス
+        cache_control: ``no-cache`` なら LLM 応答キャッシュを使わない
+        idempotency_key: 同じキーの再送には最初のレスポンスを返す
+        x_api_key: API キーごとのレート制限に使う
+        x_request_timeout: リクエスト全体の締め切り（秒）
         
     Returns:
         AIの応答と使用された記憶
     """
-    try:
-        has_any_llm_key = bool(
-            _env_api_key("ANTHROPIC_API_KEY")
-            or _env_api_key("ANTHROPIC_API_KEY_BACKUP")
-            or _env_api_key("OPENAI_API_KEY")
-            or _env_api_key("OPENAI_API_KEY_BACKUP")
+    with deadline.scope(deadline.request_budget(x_request_timeout)):
+        return await idempotency.run_idempotent(
+            route="/api/chat/message",
+            user_id=request.user_id,
+            key=idempotency_key,
+            payload=request,
+            response=response,
+            fn=lambda: _send_message(request, memu, cache_control, x_api_key),
         )
 
+
+async def _send_message(
+    request: ChatRequest,
+    memu: MemUService,
+    cache_control: Optional[str],
+    api_key: Optional[str],
+) -> ChatResponse:
+    try:
+        has_any_llm_key = _has_any_llm_key()
+        if has_any_llm_key:
+            admission.check_rate_limits(request.user_id, api_key)
+
         # 関連する記憶を検索
         memories_used = []
-        if request.use_memory:
-            memories_used = memu.search_memories(
+        if request.use_memory and deadline.allow_optional("mem0_search", need=_llm_reserve() + 1.0):
+            memories_used = await run_in_threadpool(
+                memu.search_memories,
                 query=request.message,
                 user_id=request.user_id,
                 limit=5
@@ -303,33 +540,72 @@ async def send_message(
             for mem in memories_used:
                 context += f"- {mem.get('memory', '')}\n"
 
+        # 返信と記憶抽出を 1 回の呼び出しで行うモード（services/memory_extraction.py）
+        inline = has_any_llm_key and memory_extraction.inline_extraction_enabled()
+        facts: Optional[List[str]] = None
         if has_any_llm_key:
-            response_text = _chat_response_text(
-                system_prompt=f"""あなたはPersonalOSのAIアシスタントです。
+            system_prompt = f"""あなたはPersonalOSのAIアシスタントです。
 ユーザーの記憶を活用して、個別化された応答を提供してください。
 
 {context}
 
 ユーザーの過去の記憶を考慮して、文脈に沿った応答をしてください。
-""",
-                user_message=request.message,
-                temperature=0.7,
-            )
+"""
+            if inline:
+                system_prompt += memory_extraction.INSTRUCTIONS
+                # JSON（返信 + facts）は small の max_tokens だと途中で切れやすいので振り分けない。
+                # キャッシュから同じ facts を返すと同じ事実を保存し直すので、応答キャッシュも使わない
+                response_text = await run_in_threadpool(
+                    _admitted,
+                    _chat_response_text,
+                    system_prompt=system_prompt,
+                    user_message=request.message,
+                    temperature=0.7,
+                    use_cache=False,
+                )
+            else:
+                response_text = await run_in_threadpool(
+                    _admitted,
+                    _routed_response_text,
+                    route="/api/chat/message",
+                    user_id=request.user_id,
+                    memory_used=[m.get("memory", "") for m in memories_used],
+                    system_prompt=system_prompt,
+                    user_message=request.message,
+                    temperature=0.7,
+                    use_cache=not _no_cache(cache_control),
+                )
+            if inline:
+                response_text, facts = memory_extraction.parse_reply_with_facts(response_text)
         else:
             response_text = f"（デモ応答）受け取りました: {request.message}\nANTHROPIC_API_KEY もしくは OPENAI_API_KEY を設定すると、より自然な応答を返します。"
 
         # 会話を記憶に保存
-        conversation = f"ユーザー: {request.message}\nアシスタント: {response_text}"
-        memu.add_memory(
-            content=conversation,
-            user_id=request.user_id,
-            metadata={
-                "type": "conversation",
-                "layer": "active",
-                "category": "chat"
-            }
-        )
-        memu.record_chat_turn_for_memuu(
+        if facts is not None:
+            await run_in_threadpool(
+                memu.add_facts,
+                facts,
+                user_id=request.user_id,
+                metadata={
+                    "type": "fact",
+                    "layer": "active",
+                    "category": "chat"
+                }
+            )
+        else:
+            conversation = f"ユーザー: {request.message}\nアシスタント: {response_text}"
+            await run_in_threadpool(
+                memu.add_memory,
+                content=conversation,
+                user_id=request.user_id,
+                metadata={
+                    "type": "conversation",
+                    "layer": "active",
+                    "category": "chat"
+                }
+            )
+        await run_in_threadpool(
+            memu.record_chat_turn_for_memuu,
             user_id=request.user_id,
             user_message=request.message,
             assistant_message=response_text,
@@ -338,8 +614,13 @@ async def send_message(
         return ChatResponse(
             response=response_text,
             memories_used=memories_used,
-            memory_count=len(memories_used)
+            memory_count=len(memories_used),
+            degraded=deadline.degraded(),
         )
 
+    except HTTPException:
+        raise
+    except deadline.DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
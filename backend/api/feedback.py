@@ -1,7 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
 from sqlalchemy.orm import Session
 
+from core import idempotency
 from core.dependencies import get_db, require_api_key
+from core.profiling import run_in_threadpool
 from models.feedback import FeedbackRequest, FeedbackResponse
 from services.pocket_coo_service import PocketCOOService
 
@@ -10,12 +14,29 @@ router = APIRouter(dependencies=[Depends(require_api_key)])
 
 
 @router.post("", response_model=FeedbackResponse)
-async def post_feedback(request: FeedbackRequest, db: Session = Depends(get_db)):
+async def post_feedback(
+    request: FeedbackRequest,
+    response: Response,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(default=None, alias="idempotency-key"),
+):
+    return await idempotency.run_idempotent(
+        route="/api/feedback",
+        user_id=request.user_id,
+        key=idempotency_key,
+        payload=request,
+        response=response,
+        fn=lambda: _post_feedback(request, db),
+    )
+
+
+async def _post_feedback(request: FeedbackRequest, db: Session) -> FeedbackResponse:
     try:
         if request.rating not in ("like", "dislike"):
             raise HTTPException(status_code=400, detail="rating must be like or dislike")
         service = PocketCOOService(db)
-        episode = service.record_feedback(
+        episode = await run_in_threadpool(
+            service.record_feedback,
             user_id=request.user_id,
             episode_id=request.episode_id,
             rating=request.rating,
@@ -1,12 +1,27 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+
+from core.dependencies import get_memu_service
+from services.memu_service import MemUService
 
 router = APIRouter()
 
 @router.get("")
-async def health_check():
-    """ヘルスチェックエンドポイント"""
+async def health_check(memu: MemUService = Depends(get_memu_service)):
+    """ヘルスチェックエンドポイント
+
+    プロセスが動いていれば常に 200。memory に mem0 の初期化状態（pending / initializing / ready / fallback）を含める。
+    """
     return {
         "status": "healthy",
         "service": "personalos-api",
-        "version": "0.1.0"
+        "version": "0.1.0",
+        "memory": memu.readiness(),
     }
+
+
+@router.get("/ready")
+async def readiness_check(memu: MemUService = Depends(get_memu_service)):
+    """mem0 の初期化が終わるまで 503（ready か fallback になったら 200）"""
+    readiness = memu.readiness()
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=readiness)
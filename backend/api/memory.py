@@ -1,19 +1,89 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
 from models.memory import MemoryCreate
 from services.memu_service import MemUService
+from core.etag import etag_matches, state_etag
+from core.serialization import FastJSONResponse, StateEncodingError, encode_user_state
 from core.dependencies import get_memu_service, get_db, require_api_key
-from typing import Dict
+from core.profiling import run_in_threadpool
+from typing import Dict, Optional
 from sqlalchemy.orm import Session
-from services.pocket_coo_service import PocketCOOService
+from services.pocket_coo_service import PocketCOOService, parse_fields
+from services.memory_aggregates import summarize
 
 router = APIRouter(dependencies=[Depends(require_api_key)])
 
 
 @router.get("")
-async def get_pocket_memory(userId: str, db: Session = Depends(get_db)):
+async def get_pocket_memory(
+    userId: str,
+    request: Request,
+    fields: Optional[str] = None,
+    limit: Optional[int] = Query(default=None, ge=1, le=1000),
+    before: Optional[str] = None,
+    includeEmbeddings: bool = False,
+    if_none_match: Optional[str] = Header(default=None, alias="if-none-match"),
+    db: Session = Depends(get_db),
+):
+    """Pocket COO の state を返す
+
+    fields でフィールドを絞り込み（例: ``identity,score,episodes.summary``）、
+    limit / before でエピソードを新しい順にページングする。embedding は includeEmbeddings=true の時だけ返す。
+    """
+    try:
+        projection = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        service = PocketCOOService(db)
+        version = await run_in_threadpool(service.get_state_version, userId)
+        if version is not None:
+            etag = state_etag(userId, version, request)
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+        compact, version = await run_in_threadpool(service.get_compact_state, userId, version)
+        view = compact.project(
+            fields=projection,
+            limit=limit,
+            before=before,
+            include_embeddings=includeEmbeddings,
+        )
+        return FastJSONResponse(
+            encode_user_state(view),
+            headers={"ETag": state_etag(userId, version, request), "Cache-Control": "no-cache"},
+        )
+    except StateEncodingError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/graph")
+async def get_memory_graph(
+    userId: str,
+    request: Request,
+    top: int = Query(default=20, ge=1, le=200),
+    maxNodes: Optional[int] = Query(default=None, ge=1, le=1000),
+    if_none_match: Optional[str] = Header(default=None, alias="if-none-match"),
+    db: Session = Depends(get_db),
+):
+    """トピック/タグの件数と、エピソード類似グラフ（上位k近傍）を返す
+
+    サーバー側で差分更新している集計を返すだけなので、全エピソードを取得する必要はない。
+    """
     try:
         service = PocketCOOService(db)
-        return service.get_state(userId)
+        version = await run_in_threadpool(service.get_state_version, userId)
+        if version is not None:
+            etag = state_etag(userId, version, request)
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+        aggregates = await run_in_threadpool(service.get_aggregates, userId)
+        version = await run_in_threadpool(service.get_state_version, userId) or 0
+        return FastJSONResponse(
+            {"userId": userId, **summarize(aggregates, top=top, max_nodes=maxNodes)},
+            headers={"ETag": state_etag(userId, version, request), "Cache-Control": "no-cache"},
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -32,7 +102,8 @@ async def create_memory(
         作成された記憶の情報
     """
     try:
-        result = memu.add_memory(
+        result = await run_in_threadpool(
+            memu.add_memory,
             content=memory.content,
             user_id=memory.user_id,
             metadata=memory.metadata
@@ -56,7 +127,7 @@ async def get_all_memories(
         全記憶のリスト
     """
     try:
-        memories = memu.get_all_memories(user_id=user_id)
+        memories = await run_in_threadpool(memu.get_all_memories, user_id=user_id)
         return {
             "memories": memories,
             "count": len(memories)
@@ -83,7 +154,8 @@ async def search_memories(
         検索結果のリスト
     """
     try:
-        results = memu.search_memories(
+        results = await run_in_threadpool(
+            memu.search_memories,
             query=query,
             user_id=user_id,
             limit=limit
@@ -110,7 +182,7 @@ async def delete_memory(
         削除成功したかどうか
     """
     try:
-        success = memu.delete_memory(memory_id=memory_id)
+        success = await run_in_threadpool(memu.delete_memory, memory_id=memory_id)
         return {"success": success}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
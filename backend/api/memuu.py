@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 
 from core.dependencies import require_api_key, get_memu_service
+from core.profiling import run_in_threadpool
 from services.memu_service import MemUService
 
 
@@ -10,7 +11,7 @@ router = APIRouter(dependencies=[Depends(require_api_key)])
 @router.get("/categories")
 async def get_memuu_categories(userId: str, memu: MemUService = Depends(get_memu_service)):
     try:
-        categories = memu.list_categories(userId)
+        categories = await run_in_threadpool(memu.list_categories, userId)
         if categories is None:
             raise HTTPException(status_code=503, detail="MemuU is not configured")
         return {"categories": categories}
@@ -0,0 +1,14 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from core.metrics import render_latest
+
+router = APIRouter()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get("", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus のテキスト形式でメトリクスを返す"""
+    return PlainTextResponse(render_latest(), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,20 +1,62 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
+from core.etag import etag_matches, state_etag
+from core.serialization import FastJSONResponse, StateEncodingError, encode_user_state
 from core.dependencies import get_db, require_api_key
-from models.user_state import UserState
-from services.pocket_coo_service import PocketCOOService
+from core.profiling import run_in_threadpool
+from models.user_state import UserState, UserStatePatchResponse
+from services.pocket_coo_service import PocketCOOService, parse_fields
+from services.state_export import NDJSONImporter, StateImportError, iter_export
+from services.state_patch import PatchError, PatchTestFailed
 
 
 router = APIRouter(dependencies=[Depends(require_api_key)])
 
+JSON_PATCH_MEDIA_TYPE = "application/json-patch+json"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
 
-@router.get("/{user_id}", response_model=UserState, response_model_by_alias=True)
-async def get_user_state(user_id: str, db: Session = Depends(get_db)):
+@router.get("/{user_id}")
+async def get_user_state(
+    user_id: str,
+    request: Request,
+    fields: Optional[str] = None,
+    limit: Optional[int] = Query(default=None, ge=1, le=1000),
+    before: Optional[str] = None,
+    includeEmbeddings: bool = False,
+    if_none_match: Optional[str] = Header(default=None, alias="if-none-match"),
+    db: Session = Depends(get_db),
+):
+    try:
+        projection = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
         service = PocketCOOService(db)
-        state = service.get_state(user_id)
-        return UserState.model_validate(state)
+        version = await run_in_threadpool(service.get_state_version, user_id)
+        if version is not None:
+            etag = state_etag(user_id, version, request)
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+        compact, version = await run_in_threadpool(service.get_compact_state, user_id, version)
+        view = compact.project(
+            fields=projection,
+            limit=limit,
+            before=before,
+            include_embeddings=includeEmbeddings,
+        )
+        return FastJSONResponse(
+            encode_user_state(view),
+            headers={"ETag": state_etag(user_id, version, request), "Cache-Control": "no-cache"},
+        )
+    except StateEncodingError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -24,7 +66,88 @@ async def put_user_state(user_id: str, body: UserState, db: Session = Depends(ge
     try:
         service = PocketCOOService(db)
         payload = body.model_dump(by_alias=True)
-        state = service.upsert_state(user_id=user_id, state=payload)
-        return UserState.model_validate(state)
+        state = await run_in_threadpool(service.upsert_state, user_id=user_id, state=payload)
+        return FastJSONResponse(encode_user_state(state))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.patch("/{user_id}", response_model=UserStatePatchResponse, response_model_by_alias=True)
+async def patch_user_state(user_id: str, request: Request, db: Session = Depends(get_db)):
+    """identity / projects / episodes を部分更新する
+
+    Content-Type が application/json-patch+json なら JSON Patch (RFC 6902)、
+    それ以外（application/merge-patch+json, application/json）は JSON Merge Patch (RFC 7386) として扱う。
+    """
+    try:
+        try:
+            patch = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="request body must be JSON")
+        content_type = (request.headers.get("content-type") or "").split(";")[0].strip().lower()
+        service = PocketCOOService(db)
+        state, result = await run_in_threadpool(
+            service.patch_state,
+            user_id=user_id,
+            patch=patch,
+            json_patch=content_type == JSON_PATCH_MEDIA_TYPE,
+        )
+        episodes = state.get("episodes") or []
+        return UserStatePatchResponse(
+            userId=user_id,
+            identity=state.get("identity") or {},
+            projects=state.get("projects") or [],
+            episodes=[e for e in episodes if e.get("id") in result.episode_ids],
+            episode_count=len(episodes),
+            score=int(state.get("score") or 0),
+        )
+    except HTTPException:
+        raise
+    except PatchTestFailed as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except PatchError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/{user_id}/export")
+async def export_user_state(user_id: str, db: Session = Depends(get_db)):
+    """identity / projects / episodes を NDJSON で流す（形式は services/state_export.py）"""
+    try:
+        state, version = await run_in_threadpool(PocketCOOService(db).get_state_with_version, user_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return StreamingResponse(
+        iter_export(state, version),
+        media_type=NDJSON_MEDIA_TYPE,
+        headers={"Content-Disposition": f'attachment; filename="{user_id}.ndjson"', "Cache-Control": "no-store"},
+    )
+
+
+@router.post("/{user_id}/import")
+async def import_user_state(
+    user_id: str,
+    request: Request,
+    mode: str = Query(default="replace", pattern="^(replace|merge)$"),
+    db: Session = Depends(get_db),
+):
+    """export の NDJSON を読み込む。本文は受け取りながら 1 行ずつ検証し、最後に 1 回で保存する"""
+    importer = NDJSONImporter(user_id)
+    try:
+        async for chunk in request.stream():
+            importer.feed(chunk)
+        imported = importer.finish()
+    except StateImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        state = await run_in_threadpool(PocketCOOService(db).import_state, user_id, imported, mode=mode)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "userId": user_id,
+        "mode": mode,
+        "projects": len(state.get("projects") or []),
+        "episodes": len(state.get("episodes") or []),
+        "score": int(state.get("score") or 0),
+    }
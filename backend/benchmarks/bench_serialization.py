@@ -0,0 +1,76 @@
+"""
+state のエンコード/デコードと API 応答検証のベンチマーク
+
+    cd backend && python -m benchmarks.bench_serialization --sizes 1000,10000
+
+利用可能な codec（json / orjson / msgspec）ごとに、state_json の decode・encode、
+プロンプト用の JSON 化、GET /api/user の応答検証（pydantic / msgspec）を計測します。
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.synthetic import synthetic_state
+from core import serialization
+from models.user_state import UserStateView
+from services.pocket_coo_service import build_prompt_memories, project_state
+
+
+def _state_with_episodes(total: int) -> Dict[str, Any]:
+    return synthetic_state("bench_serialization", episodes=total)
+
+
+def _timeit(fn: Callable[[], Any], repeat: int) -> float:
+    samples: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000.0
+
+
+def run(sizes: List[int], repeat: int) -> None:
+    codecs = [c for c in serialization.CODECS if serialization._available(c)]
+    print(f"codecs: {', '.join(codecs)}  (median of {repeat}, ms)")
+    for size in sizes:
+        state = _state_with_episodes(size)
+        view = project_state(state, include_embeddings=True)
+        serialization.set_codec("json")
+        raw = serialization.dumps(state)
+        print(f"\n## {size} episodes, state_json {len(raw.encode('utf-8')) / 1024 / 1024:.1f} MiB")
+        print(f"{'codec':<10}{'decode':>10}{'encode':>10}{'prompt':>10}")
+        for name in codecs:
+            serialization.set_codec(name)
+            decode = _timeit(lambda: serialization.loads(raw), repeat)
+            encode = _timeit(lambda: serialization.dumps(state), repeat)
+            prompt = _timeit(lambda: build_prompt_memories(state), repeat)
+            print(f"{name:<10}{decode:>10.2f}{encode:>10.2f}{prompt:>10.3f}")
+
+        pydantic_ms = _timeit(
+            lambda: UserStateView.model_validate(view).model_dump_json(by_alias=True, exclude_unset=True),
+            repeat,
+        )
+        print(f"response validation: pydantic {pydantic_ms:.2f}", end="")
+        if serialization.msgspec is not None:
+            msgspec_ms = _timeit(lambda: serialization.encode_user_state(view), repeat)
+            print(f" / msgspec {msgspec_ms:.2f}")
+        else:
+            print(" / msgspec (not installed)")
+    serialization.set_codec(None)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000", help="エピソード数（カンマ区切り）")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run([int(s) for s in args.sizes.split(",") if s.strip()], args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+PocketCOOService のホットパスのベンチマーク（時間・メモリ・ベースライン比較）
+
+    cd backend && python -m benchmarks.bench_service                      # 10,1000,10000 エピソード
+    cd backend && python -m benchmarks.bench_service --sizes 10,100000
+    cd backend && python -m benchmarks.bench_service --save-baseline       # baselines/service.json を更新
+    cd backend && python -m benchmarks.bench_service --compare             # ベースライン比で遅い・ベースラインが無いケースがあれば exit 1
+    cd backend && python -m benchmarks.bench_service --memory              # dict の state と CompactState の常駐メモリ
+
+state は benchmarks/synthetic.py の合成履歴（日英混在）で作り、DB は一時ディレクトリの SQLite を使います
+（DATABASE_URL や既存データには触れません）。各ケースは warmup 後に repeat 回の中央値と p95 を取り、
+別に 1 回だけ tracemalloc でピークメモリを測ります（tracemalloc 中は遅くなるため時間計測とは分ける）。
+ベースラインはマシン依存なので、比較は同じマシンで取り直したもの同士で行ってください。
+"""
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.synthetic import synthetic_state, synthetic_turn
+from core import serialization
+from db.schema import ensure_schema
+from services.compact_state import CompactState
+from services.pocket_coo_service import (
+    PocketCOOService,
+    _hash_embedding_int8,
+    _tokens_from_text,
+    build_prompt_memories,
+    seeded_demo_state,
+)
+
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "service.json"
+DEFAULT_SIZES = "10,1000,10000"
+
+# (name, エピソード数に依存するか)
+CASES: Tuple[Tuple[str, bool], ...] = (
+    ("tokens_from_text", False),
+    ("hash_embedding_int8", False),
+    ("seeded_demo_state", False),
+    ("build_prompt_memories", True),
+    ("get_state", True),
+    ("compact_state", True),
+    ("get_compact_page", True),
+    ("apply_turn", True),
+    ("record_feedback", True),
+)
+
+
+def _measure(fn: Callable[[], Any], repeat: int, warmup: int = 1) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    samples: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    samples.sort()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "median_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+        "peak_kib": round(peak / 1024.0, 1),
+    }
+
+
+class _Fixture:
+    """サイズごとの state と、それを書き込んだ一時 DB"""
+
+    def __init__(self, size: int, workdir: Path):
+        self.size = size
+        self.user_id = f"bench_{size}"
+        self.state = synthetic_state(self.user_id, episodes=size, seed=size % 97)
+        engine = create_engine(f"sqlite:///{workdir / f'bench_{size}.db'}", connect_args={"check_same_thread": False})
+        ensure_schema(engine)
+        self.db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+        self.service = PocketCOOService(self.db)
+        self.service.upsert_state(self.user_id, self.state)
+        self.rng = random.Random(size)
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def _case_fn(name: str, fixture: Optional[_Fixture], rng: random.Random) -> Callable[[], Any]:
+    if name == "tokens_from_text":
+        turns = [synthetic_turn(rng) for _ in range(64)]
+        texts = [f"{t['user_message']}\n{t['assistant_message']}" for t in turns]
+        return lambda: [_tokens_from_text(t) for t in texts]
+    if name == "hash_embedding_int8":
+        tokens = [_tokens_from_text(synthetic_turn(rng)["user_message"]) for _ in range(64)]
+        return lambda: [_hash_embedding_int8(t) for t in tokens]
+    if name == "seeded_demo_state":
+        return lambda: seeded_demo_state("demo_bench")
+    assert fixture is not None
+    if name == "build_prompt_memories":
+        return lambda: build_prompt_memories(fixture.state)
+    if name == "get_state":
+        return lambda: fixture.service.get_state(fixture.user_id)
+    if name == "compact_state":
+        return lambda: CompactState.from_state(fixture.state)
+    if name == "get_compact_page":
+        # キャッシュに載った後の GET /api/user?limit=20 相当
+        return lambda: fixture.service.get_compact_state(fixture.user_id)[0].project(limit=20)
+    if name == "apply_turn":
+
+        def turn() -> Any:
+            t = synthetic_turn(fixture.rng)
+            return fixture.service.apply_turn(fixture.user_id, t["user_message"], t["assistant_message"], t["memory_used"], None)
+
+        return turn
+    if name == "record_feedback":
+        ids = [e["id"] for e in fixture.state["episodes"]]
+        return lambda: fixture.service.record_feedback(fixture.user_id, fixture.rng.choice(ids), "like")
+    raise ValueError(f"unknown case {name}")
+
+
+def _repeat_for(size: int, repeat: int) -> int:
+    # 10 万件は 1 回が秒単位になるので回数を減らす
+    return max(3, repeat // 4) if size >= 100_000 else repeat
+
+
+def run(sizes: List[int], repeat: int, only: Optional[List[str]] = None) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+    rng = random.Random(0)
+    cases = [c for c in CASES if not only or c[0] in only]
+    with tempfile.TemporaryDirectory(prefix="pocketcoo-bench-") as tmp:
+        for name, per_size in cases:
+            if per_size:
+                continue
+            results[name] = _measure(_case_fn(name, None, rng), repeat)
+            _print_row(name, results[name])
+        for size in sizes:
+            if not any(per_size for _, per_size in cases):
+                break
+            fixture = _Fixture(size, Path(tmp))
+            try:
+                for name, per_size in cases:
+                    if not per_size:
+                        continue
+                    key = f"{name}[{size}]"
+                    results[key] = _measure(_case_fn(name, fixture, rng), _repeat_for(size, repeat))
+                    _print_row(key, results[key])
+            finally:
+                fixture.close()
+    return results
+
+
+def owned_bytes(obj: Any, seen: Optional[set] = None) -> int:
+    """obj から辿れるオブジェクトの sys.getsizeof の合計（共有されたオブジェクトは 1 回だけ数える）
+
+    dict / list / tuple / __slots__ のオブジェクトを辿る。tracemalloc の current と違い、
+    それまでに確保されたもの（intern 済みの文字列など）に左右されない。
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(owned_bytes(k, seen) + owned_bytes(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(owned_bytes(v, seen) for v in obj)
+    else:
+        for cls in type(obj).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                if hasattr(obj, name):
+                    size += owned_bytes(getattr(obj, name), seen)
+        if hasattr(obj, "__dict__"):
+            size += owned_bytes(vars(obj), seen)
+    return size
+
+
+def retained_memory(sizes: List[int]) -> Dict[str, Dict[str, float]]:
+    """デコードした dict の state と CompactState を 1 つ持ち続けた時のメモリ（owned_bytes）"""
+    results: Dict[str, Dict[str, float]] = {}
+    print(f"{'episodes':<12}{'dict KiB':>14}{'compact KiB':>14}{'ratio':>8}")
+    for size in sizes:
+        state = serialization.loads(serialization.dumps_bytes(synthetic_state(f"bench_{size}", episodes=size, seed=size % 97)))
+        as_dict = owned_bytes(state)
+        as_compact = owned_bytes(CompactState.from_state(state))
+        results[f"state_memory[{size}]"] = {"dict_kib": round(as_dict / 1024.0, 1), "compact_kib": round(as_compact / 1024.0, 1)}
+        print(f"{size:<12}{as_dict / 1024.0:>14.1f}{as_compact / 1024.0:>14.1f}{as_dict / max(as_compact, 1):>8.2f}")
+    return results
+
+
+def _print_row(key: str, r: Dict[str, float]) -> None:
+    print(f"{key:<34}{r['median_ms']:>12.3f}{r['p95_ms']:>12.3f}{r['peak_kib']:>14.1f}", flush=True)
+
+
+def save_baseline(results: Dict[str, Dict[str, float]], path: Path = BASELINE_PATH) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = {
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor()},
+        "results": results,
+    }
+    path.write_text(json.dumps(payload, ensure_ascii=False, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+
+
+def compare(results: Dict[str, Dict[str, float]], threshold: float, path: Path = BASELINE_PATH) -> List[str]:
+    """median_ms がベースラインの threshold 倍を超えたケースと、ベースラインが無いケースを返す
+
+    ベースラインに無いケースを黙って飛ばすと、新しいケースが比較されないまま通ってしまうので失敗扱いにする
+    （--save-baseline で取り直す）。
+    """
+    if not path.exists():
+        print(f"no baseline at {path}")
+        return sorted(results)
+    baseline = json.loads(path.read_text(encoding="utf-8")).get("results") or {}
+    regressions: List[str] = []
+    print(f"\n{'case':<34}{'baseline':>12}{'now':>12}{'ratio':>8}")
+    for key, r in results.items():
+        base = baseline.get(key)
+        if not base or not base.get("median_ms"):
+            print(f"{key:<34}{'-':>12}{r['median_ms']:>12.3f}{'-':>8}  NO BASELINE")
+            regressions.append(key)
+            continue
+        ratio = r["median_ms"] / base["median_ms"]
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print(f"{key:<34}{base['median_ms']:>12.3f}{r['median_ms']:>12.3f}{ratio:>8.2f}{flag}")
+        if flag:
+            regressions.append(key)
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="エピソード数（カンマ区切り、10〜100000）")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--only", default="", help="実行するケース名（カンマ区切り）")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--threshold", type=float, default=1.25, help="この倍率を超えたら regression")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    parser.add_argument("--memory", action="store_true", help="常駐メモリの比較だけ行う")
+    parser.add_argument("--json", dest="json_out", default="", help="結果を JSON で書き出す")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    only = [s.strip() for s in args.only.split(",") if s.strip()] or None
+    if args.memory:
+        retained_memory(sizes)
+        return
+    print(f"{'case':<34}{'median ms':>12}{'p95 ms':>12}{'peak KiB':>14}")
+    results = run(sizes, args.repeat, only)
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(results, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+    if args.save_baseline:
+        save_baseline(results, Path(args.baseline))
+        print(f"\nbaseline written to {args.baseline}")
+    if args.compare and compare(results, args.threshold, Path(args.baseline)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+ベンチマーク用の合成履歴ジェネレーター
+
+日本語・英語・混在のチャットターンを seed 固定で作ります。エピソードは本番と同じ
+_build_turn_episode（トークナイズ・トピック・タグ・int8 埋め込み）で作るので、
+state の形とサイズ感は実ユーザーに近くなります。
+
+    from benchmarks.synthetic import synthetic_state
+    state = synthetic_state("bench_user", episodes=10_000)
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+import random
+
+from services.pocket_coo_service import _build_turn_episode, calculate_score, default_user_memory
+
+
+_JP_REQUESTS = [
+    "競合の価格帯を調べて比較表にまとめて",
+    "来週の経営会議用に論点を箇条書きで整理して",
+    "採用計画のたたき台を作って。エンジニア3名、PM1名",
+    "解約理由のアンケート結果から改善案を3つ",
+    "オンボーディングのファネルで一番落ちている所はどこ？",
+    "SLO を決めたい。可用性とレイテンシの目標値の案を",
+    "投資家向けアップデートの下書き、数字多めで",
+    "新機能のPRDの叩き台。目的・非目標・指標まで",
+]
+_EN_REQUESTS = [
+    "Draft a pricing experiment plan for the US market",
+    "Summarize this week's support tickets by theme",
+    "What should the north star metric be for the team plan?",
+    "Write a short incident postmortem template",
+    "Compare build vs buy for the analytics pipeline",
+    "Outline a GTM plan for the EU launch with milestones",
+]
+_MIXED_REQUESTS = [
+    "Q3 の OKR を draft して。KPI は MRR と NRR",
+    "PMF survey の結果をまとめて、次の action を提案して",
+    "API のレイテンシ p95 が悪化してる。原因の仮説と計測プラン",
+    "Board meeting 用の one-pager を日本語で",
+]
+_ASSISTANT_OPENERS = [
+    "結論から言うと、",
+    "了解です。全体像→深掘りの順で整理します。",
+    "Here's a quick breakdown:",
+    "ポイントは3つです。",
+    "Short answer: yes, with two caveats.",
+]
+_ASSISTANT_BODIES = [
+    "まず現状の数字を確認し、仮説を2つに絞ってから小さく検証するのが早いです。",
+    "選択肢A/Bを比較すると、初期コストはAが低く、運用負荷はBが低いです。推奨はAです。",
+    "Start with the highest-volume segment, measure weekly, and kill the experiment if lift < 2%.",
+    "リスクは依存チームのリソースです。来週までにオーナーを決めて計測を入れましょう。",
+    "The main driver is onboarding drop-off at step 3; fix the empty state first.",
+    "次アクション: 1) データ抽出 2) 仮説の優先順位付け 3) 関係者レビュー",
+]
+_SUFFIXES = ["", "", "。急ぎで", "（今日中）", " please keep it short", "。表形式で", " — with numbers"]
+_MEMORY_KEYS = ["preferences.format", "preferences.detail_level", "preferences.communication"]
+
+
+def _message(rng: random.Random, jp_ratio: float) -> str:
+    roll = rng.random()
+    if roll < jp_ratio:
+        pool = _JP_REQUESTS
+    elif roll < jp_ratio + (1.0 - jp_ratio) / 2:
+        pool = _EN_REQUESTS
+    else:
+        pool = _MIXED_REQUESTS
+    return rng.choice(pool) + rng.choice(_SUFFIXES)
+
+
+def synthetic_turn(rng: random.Random, jp_ratio: float = 0.6) -> Dict[str, Any]:
+    """1 ターン分の (user_message, assistant_message, memory_used)"""
+    user_message = _message(rng, jp_ratio)
+    assistant = rng.choice(_ASSISTANT_OPENERS) + " " + " ".join(rng.sample(_ASSISTANT_BODIES, k=rng.randint(1, 3)))
+    memory_used = [k for k in _MEMORY_KEYS if rng.random() < 0.3]
+    return {"user_message": user_message, "assistant_message": assistant, "memory_used": memory_used}
+
+
+def synthetic_episodes(
+    total: int,
+    seed: int = 0,
+    jp_ratio: float = 0.6,
+    feedback_ratio: float = 0.15,
+    start: Optional[datetime] = None,
+) -> List[Dict[str, Any]]:
+    """total 件のエピソード（古い順）。id と日時は seed から決まる"""
+    rng = random.Random(seed)
+    start = start or datetime(2025, 1, 1)
+    out: List[Dict[str, Any]] = []
+    for i in range(total):
+        turn = synthetic_turn(rng, jp_ratio)
+        episode = _build_turn_episode(turn["user_message"], turn["assistant_message"], turn["memory_used"])
+        when = (start + timedelta(minutes=37 * i)).isoformat() + "Z"
+        episode["id"] = f"ep_syn_{seed:02d}_{i:06d}"
+        episode["date"] = when
+        episode["embedding_at"] = when
+        if rng.random() < feedback_ratio:
+            episode["feedback"] = {
+                "rating": rng.choice(["like", "like", "dislike"]),
+                "comment": None,
+                "updated_at": when,
+                "identity_updates": [],
+            }
+        out.append(episode)
+    return out
+
+
+def synthetic_state(user_id: str, episodes: int, seed: int = 0, jp_ratio: float = 0.6) -> Dict[str, Any]:
+    """identity / projects もそれらしく埋めた state"""
+    state = default_user_memory(user_id)
+    identity = state["identity"]
+    identity["style"] = {"format": "bullet_points", "detail_level": "data_driven", "communication": "casual"}
+    identity["preferences"] = [
+        {"key": "フォーマット", "value": "箇条書き", "confidence": 0.9},
+        {"key": "重視", "value": "数字・データ", "confidence": 0.85},
+        {"key": "文体", "value": "カジュアル", "confidence": 0.8},
+    ]
+    state["projects"] = [
+        {"id": f"proj_syn_{i:03d}", "name": name, "status": "in_progress"}
+        for i, name in enumerate(["Pricing", "Onboarding", "Reliability", "EU Launch"])
+    ]
+    state["episodes"] = synthetic_episodes(episodes, seed=seed, jp_ratio=jp_ratio)
+    state["score"] = calculate_score(state)
+    return state
@@ -0,0 +1,170 @@
+"""
+LLM を呼ぶエンドポイントの流量制御（レート制限と同時実行数の上限）
+
+1 ユーザーのバーストや負荷試験でプロバイダーのレート制限を使い切り、全員のレイテンシが
+伸びるのを防ぐため、過負荷時は早めに 429 + Retry-After で断ります。
+
+- トークンバケット: userId ごと（RATE_LIMIT_USER_PER_MIN、既定 30/分、
+  RATE_LIMIT_USER_BURST、既定 10）と X-API-Key ごと（RATE_LIMIT_KEY_PER_MIN、既定 300/分、
+  RATE_LIMIT_KEY_BURST、既定 60）。0 で無効
+- 同時実行数: プロセス全体で LLM_MAX_CONCURRENCY（既定 8）件まで。空きが無ければ
+  LLM_QUEUE_SIZE（既定 16）件まで LLM_QUEUE_TIMEOUT 秒（既定 2）待ち、それを超えたら 429
+
+    check_rate_limits(user_id, api_key)   # 超えていれば HTTPException(429)
+    with llm_slot():                      # ブロッキング。スレッドから呼ぶ
+        text = call_llm()
+"""
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+import hashlib
+import math
+import os
+import threading
+import time
+
+from fastapi import HTTPException
+
+from core import metrics
+from core.ttl_cache import TTLCache
+
+
+ADMISSION_REJECTIONS = metrics.REGISTRY.counter(
+    "pocketcoo_admission_rejections_total",
+    "Requests rejected with 429 before calling the LLM, by reason (user, api_key, overload).",
+)
+LLM_IN_FLIGHT = metrics.REGISTRY.gauge(
+    "pocketcoo_llm_in_flight",
+    "LLM calls currently running (state=running) or waiting for a slot (state=queued).",
+)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+def too_many_requests(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, burst: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> Tuple[bool, float]:
+        """(取れたか, 次の 1 トークンまでの秒数) を返す"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True, 0.0
+            return False, (1.0 - self.tokens) / self.rate
+
+
+class _Buckets:
+    """キーごとのバケット。しばらく使われないキーは捨てる（満タンに戻っているので作り直しと同じ）"""
+
+    def __init__(self, rate_env: str, burst_env: str, default_rate: float, default_burst: float):
+        self.rate_env = rate_env
+        self.burst_env = burst_env
+        self.default_rate = default_rate
+        self.default_burst = default_burst
+        self._buckets: TTLCache[TokenBucket] = TTLCache(maxsize=100_000, ttl=600)
+        self._lock = threading.Lock()
+
+    def take(self, key: str) -> Tuple[bool, float]:
+        per_minute = _env_float(self.rate_env, self.default_rate)
+        if per_minute <= 0:
+            return True, 0.0
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(per_minute, _env_float(self.burst_env, self.default_burst))
+            self._buckets.set(key, bucket)
+        return bucket.take()
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+
+_user_buckets = _Buckets("RATE_LIMIT_USER_PER_MIN", "RATE_LIMIT_USER_BURST", 30, 10)
+_key_buckets = _Buckets("RATE_LIMIT_KEY_PER_MIN", "RATE_LIMIT_KEY_BURST", 300, 60)
+
+
+def check_rate_limits(user_id: str, api_key: Optional[str]) -> None:
+    ok, retry_after = _user_buckets.take(user_id)
+    if not ok:
+        ADMISSION_REJECTIONS.inc(reason="user")
+        raise too_many_requests("Too many requests for this user", retry_after)
+    if api_key:
+        ok, retry_after = _key_buckets.take(hashlib.sha256(api_key.encode("utf-8")).hexdigest())
+        if not ok:
+            ADMISSION_REJECTIONS.inc(reason="api_key")
+            raise too_many_requests("Too many requests for this API key", retry_after)
+
+
+class ConcurrencyLimiter:
+    def __init__(self) -> None:
+        self.running = 0
+        self.queued = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> bool:
+        limit = max(1, int(_env_float("LLM_MAX_CONCURRENCY", 8)))
+        with self._cond:
+            if self.running < limit and self.queued == 0:
+                self.running += 1
+                return True
+            if self.queued >= int(_env_float("LLM_QUEUE_SIZE", 16)):
+                return False
+            self.queued += 1
+            try:
+                deadline = time.monotonic() + _env_float("LLM_QUEUE_TIMEOUT", 2.0)
+                while self.running >= limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._cond.wait(remaining):
+                        if self.running >= limit:
+                            return False
+                self.running += 1
+                return True
+            finally:
+                self.queued -= 1
+
+    def release(self) -> None:
+        with self._cond:
+            self.running -= 1
+            self._cond.notify()
+
+
+_limiter = ConcurrencyLimiter()
+LLM_IN_FLIGHT.set_function(lambda: _limiter.running, state="running")
+LLM_IN_FLIGHT.set_function(lambda: _limiter.queued, state="queued")
+
+
+@contextmanager
+def llm_slot() -> Iterator[None]:
+    if not _limiter.acquire():
+        ADMISSION_REJECTIONS.inc(reason="overload")
+        raise too_many_requests("LLM capacity is saturated, retry shortly", _env_float("LLM_QUEUE_TIMEOUT", 2.0))
+    try:
+        yield
+    finally:
+        _limiter.release()
+
+
+def reset() -> None:
+    """テスト用: レート制限のバケットを消す"""
+    _user_buckets.clear()
+    _key_buckets.clear()
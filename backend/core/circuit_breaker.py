@@ -0,0 +1,290 @@
+"""
+LLM プロバイダー呼び出しのサーキットブレーカーとヘッジリクエスト
+
+プロバイダー障害中に、毎リクエストが各エンドポイントのタイムアウト（30 秒）を順番に待ち切る
+のを避けるためのものです。
+
+- エンドポイント（anthropic_primary など）ごとにブレーカーを持ち、連続 LLM_BREAKER_FAILURES 回
+  （既定 3）失敗したら LLM_BREAKER_COOLDOWN 秒（既定 30）は呼ばずに次へ進む。
+  クールダウン後は 1 リクエストだけ試し（half-open）、成功すれば閉じる
+- LLM_HEDGE=1 の場合、先頭のエンドポイントが「直近の成功レイテンシの p95」を過ぎても
+  返らなければ次のエンドポイントにも同じリクエストを投げ、先に返った方を使う。
+  サンプルが LLM_HEDGE_MIN_SAMPLES 件未満の間は LLM_HEDGE_DELAY 秒（既定 3）を使う。
+  ヘッジはコストが増えるので既定では無効
+
+    endpoints = [Endpoint("anthropic_primary", lambda: ...), Endpoint("anthropic_backup", lambda: ...)]
+    text = call_with_fallback(endpoints)
+    text, source = call_with_source(endpoints)   # source は実際に応答したエンドポイント名
+"""
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+import contextvars
+import os
+import threading
+import time
+
+from core import deadline, metrics
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATE_VALUE = {CLOSED: 0.0, OPEN: 1.0, HALF_OPEN: 2.0}
+
+CIRCUIT_STATE = metrics.REGISTRY.gauge(
+    "pocketcoo_llm_circuit_state",
+    "LLM endpoint circuit breaker state (0=closed, 1=open, 2=half-open).",
+)
+CIRCUIT_SKIPS = metrics.REGISTRY.counter(
+    "pocketcoo_llm_circuit_skips_total",
+    "LLM calls skipped because the endpoint's circuit was open.",
+)
+HEDGED_REQUESTS = metrics.REGISTRY.counter(
+    "pocketcoo_llm_hedged_requests_total",
+    "Hedged LLM requests fired at a backup endpoint, by which side answered first.",
+)
+
+
+class CircuitOpenError(RuntimeError):
+    """すべてのエンドポイントのブレーカーが開いていて呼べなかった"""
+
+
+class _HedgeFailed(Exception):
+    """ヘッジした 2 つとも失敗した"""
+
+    def __init__(self, error: BaseException):
+        super().__init__(str(error))
+        self.error = error
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+def hedging_enabled() -> bool:
+    return (os.getenv("LLM_HEDGE") or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclass
+class Endpoint:
+    name: str
+    call: Callable[[], str]
+
+
+class CircuitBreaker:
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.set(0.0, endpoint=name)
+
+    def _set(self, state: str) -> None:
+        self.state = state
+        CIRCUIT_STATE.set(_STATE_VALUE[state], endpoint=self.name)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= _env_float("LLM_BREAKER_COOLDOWN", 30.0):
+                self._set(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._trial_in_flight = False
+            if self.state != CLOSED:
+                self._set(CLOSED)
+
+    def release_trial(self) -> None:
+        """成否を判定しないまま half-open の試行枠を返す"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= int(_env_float("LLM_BREAKER_FAILURES", 3)):
+                self.opened_at = time.monotonic()
+                self._set(OPEN)
+
+
+class LatencyTracker:
+    """直近の成功レイテンシ（秒）"""
+
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def p95(self) -> Optional[float]:
+        with self._lock:
+            ordered = sorted(self._samples)
+        if len(ordered) < int(_env_float("LLM_HEDGE_MIN_SAMPLES", 20)):
+            return None
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_latencies: Dict[str, LatencyTracker] = {}
+_registry_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def breaker(name: str) -> CircuitBreaker:
+    with _registry_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def latency(name: str) -> LatencyTracker:
+    with _registry_lock:
+        if name not in _latencies:
+            _latencies[name] = LatencyTracker()
+        return _latencies[name]
+
+
+def reset() -> None:
+    """テスト用: ブレーカーとレイテンシの記録を消す"""
+    with _registry_lock:
+        _breakers.clear()
+        _latencies.clear()
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    with _registry_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=int(_env_float("LLM_HEDGE_WORKERS", 16)), thread_name_prefix="llm-hedge")
+        return _executor
+
+
+def _invoke(endpoint: Endpoint) -> str:
+    """呼び出して結果をブレーカーとレイテンシに記録する"""
+    start = time.perf_counter()
+    try:
+        result = endpoint.call()
+    except Exception:
+        # リクエストの締め切りで切り詰めたタイムアウトによる失敗はエンドポイントのせいにしない
+        if deadline.expired():
+            breaker(endpoint.name).release_trial()
+        else:
+            breaker(endpoint.name).record_failure()
+        raise
+    breaker(endpoint.name).record_success()
+    latency(endpoint.name).add(time.perf_counter() - start)
+    return result
+
+
+def hedge_delay(name: str) -> float:
+    p95 = latency(name).p95()
+    return p95 if p95 is not None else _env_float("LLM_HEDGE_DELAY", 3.0)
+
+
+def _submit(pool: ThreadPoolExecutor, endpoint: Endpoint) -> Future:
+    # ワーカースレッドでもリクエストの締め切り（contextvars）が効くよう、呼び出し元のコンテキストで動かす
+    return pool.submit(contextvars.copy_context().run, _invoke, endpoint)
+
+
+def _budget(seconds: Optional[float]) -> Optional[float]:
+    """待ち時間をリクエストの残り時間で頭打ちにする"""
+    remaining = deadline.remaining()
+    if remaining is None:
+        return seconds
+    remaining = max(0.0, remaining)
+    return remaining if seconds is None else min(seconds, remaining)
+
+
+def _result(future: Future) -> str:
+    try:
+        return future.result(timeout=_budget(None))
+    except FutureTimeoutError:
+        raise deadline.DeadlineExceeded("request deadline exceeded during llm")
+
+
+def _hedged(first: Endpoint, second: Endpoint) -> Tuple[str, str]:
+    """first を投げ、hedge_delay を過ぎたら second も投げて先に成功した方を返す
+
+    second を投げる前に first が失敗したら first の例外を、両方失敗したら _HedgeFailed を送出する。
+    待ちはリクエストの締め切りまでで、過ぎたら DeadlineExceeded を送出する（呼び出し自体は止められない）。
+    """
+    pool = _pool()
+    primary = _submit(pool, first)
+    done, _ = wait([primary], timeout=_budget(hedge_delay(first.name)))
+    if done:
+        return primary.result(), first.name
+    if deadline.expired():
+        raise deadline.DeadlineExceeded("request deadline exceeded during llm")
+    if not breaker(second.name).allow():
+        CIRCUIT_SKIPS.inc(endpoint=second.name)
+        return _result(primary), first.name
+    hedge = _submit(pool, second)
+    pending: List[Future] = [primary, hedge]
+    last_error: Optional[BaseException] = None
+    while pending:
+        done, _ = wait(pending, timeout=_budget(None), return_when=FIRST_COMPLETED)
+        if not done:
+            raise deadline.DeadlineExceeded("request deadline exceeded during llm")
+        for future in done:
+            pending.remove(future)
+            if future.exception() is None:
+                # 負けた方は止められないので、結果はブレーカー・レイテンシの記録にだけ使われる
+                HEDGED_REQUESTS.inc(endpoint=second.name, winner="hedge" if future is hedge else "primary")
+                return future.result(), (second if future is hedge else first).name
+            last_error = future.exception()
+    assert last_error is not None
+    raise _HedgeFailed(last_error)
+
+
+def call_with_fallback(endpoints: List[Endpoint]) -> str:
+    """endpoints を順に試す。ブレーカーが開いているものは飛ばし、LLM_HEDGE=1 なら次の候補にヘッジする"""
+    return call_with_source(endpoints)[0]
+
+
+def call_with_source(endpoints: List[Endpoint]) -> Tuple[str, str]:
+    """call_with_fallback と同じだが、応答と一緒に応答したエンドポイント名を返す（ヘッジで勝った方を含む）"""
+    last_error: Optional[BaseException] = None
+    previous: Optional[str] = None
+    available = list(endpoints)
+    while available:
+        endpoint = available.pop(0)
+        deadline.check("llm")
+        if not breaker(endpoint.name).allow():
+            CIRCUIT_SKIPS.inc(endpoint=endpoint.name)
+            continue
+        if previous is not None:
+            metrics.LLM_FALLBACKS.inc(source=previous, target=endpoint.name)
+        previous = endpoint.name
+        try:
+            if hedging_enabled() and available:
+                return _hedged(endpoint, available[0])
+            return _invoke(endpoint), endpoint.name
+        except _HedgeFailed as e:
+            # ヘッジ先も失敗済みなので、その次の候補から
+            previous = available.pop(0).name
+            last_error = e.error
+        except Exception as e:
+            last_error = e
+    if last_error is not None:
+        if deadline.expired():
+            raise deadline.DeadlineExceeded("request deadline exceeded during llm") from last_error
+        raise last_error
+    raise CircuitOpenError("all LLM endpoints are unavailable (circuit open): " + ", ".join(e.name for e in endpoints))
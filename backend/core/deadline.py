@@ -0,0 +1,132 @@
+"""
+リクエスト単位の締め切り（deadline）
+
+チャット 1 ターンは state 読み込み・memU 検索・mem0 検索・LLM・保存を直列に行い、それぞれが
+固定のタイムアウト（memU 10 秒、LLM 30 秒）を持っています。全体の予算を ContextVar で
+持ち回り、各段階のタイムアウトを残り時間で切り詰め、任意の段階は残りが少なければ飛ばします。
+
+- 予算は ``X-Request-Timeout``（秒）ヘッダー、無ければ CHAT_DEADLINE_SECONDS（既定 25）。
+  上限は CHAT_DEADLINE_MAX_SECONDS（既定 60）
+- run_in_threadpool は contextvars を引き継ぐので、スレッドで動く LLM 呼び出しからも見える
+- 飛ばした段階は degraded() で返し、レスポンスの ``degraded`` に載せる
+
+    with deadline.scope(deadline.request_budget(header)):
+        if deadline.allow_optional("mem0_search", need=10.0):
+            ...
+        timeout = deadline.timeout(30.0)
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional
+import os
+import time
+
+from core import metrics
+
+
+DEGRADED_STAGES = metrics.REGISTRY.counter(
+    "pocketcoo_degraded_stages_total",
+    "Optional request stages skipped because the request deadline was close.",
+)
+
+# 残り時間がこれ未満なら I/O を始めても間に合わないとみなす
+MIN_TIMEOUT = 0.05
+
+
+class DeadlineExceeded(TimeoutError):
+    """リクエストの締め切りを過ぎた"""
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.degraded: List[str] = []
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() < MIN_TIMEOUT
+
+
+_current: ContextVar[Optional[Deadline]] = ContextVar("pocketcoo_deadline", default=None)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+def request_budget(header: Optional[str]) -> float:
+    """ヘッダーの値（秒）を予算にする。読めなければサーバーの既定値"""
+    default = _env_float("CHAT_DEADLINE_SECONDS", 25.0)
+    try:
+        seconds = float(header) if header else default
+    except ValueError:
+        seconds = default
+    if seconds <= 0:
+        seconds = default
+    return min(seconds, _env_float("CHAT_DEADLINE_MAX_SECONDS", 60.0))
+
+
+@contextmanager
+def scope(seconds: float) -> Iterator[Deadline]:
+    deadline = Deadline(seconds)
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def current() -> Optional[Deadline]:
+    return _current.get()
+
+
+def remaining() -> Optional[float]:
+    deadline = _current.get()
+    return None if deadline is None else deadline.remaining()
+
+
+def timeout(default: float) -> float:
+    """default と残り時間の短い方。締め切りが無ければ default"""
+    deadline = _current.get()
+    if deadline is None:
+        return default
+    return max(MIN_TIMEOUT, min(default, deadline.remaining()))
+
+
+def expired() -> bool:
+    deadline = _current.get()
+    return deadline is not None and deadline.expired()
+
+
+def check(stage: str) -> None:
+    """必須の段階の前に呼ぶ。締め切りを過ぎていれば DeadlineExceeded"""
+    if expired():
+        raise DeadlineExceeded(f"request deadline exceeded before {stage}")
+
+
+def allow_optional(stage: str, need: float) -> bool:
+    """残り need 秒以上あれば True。無ければ stage を degraded に記録して False"""
+    deadline = _current.get()
+    if deadline is None or deadline.remaining() >= need:
+        return True
+    mark_degraded(stage)
+    return False
+
+
+def mark_degraded(stage: str) -> None:
+    """任意の段階を途中で打ち切った時に、allow_optional で飛ばした時と同じく degraded に記録する"""
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.degraded.append(stage)
+    DEGRADED_STAGES.inc(stage=stage)
+
+
+def degraded() -> List[str]:
+    deadline = _current.get()
+    return list(deadline.degraded) if deadline is not None else []
@@ -1,5 +1,6 @@
 from services.memu_service import memu_service
-from db.session import SessionLocal
+from db.schema import ensure_schema_once
+from db.session import SessionLocal, engine
 from services.pocket_coo_service import PocketCOOService
 from fastapi import Depends, Header, HTTPException
 from sqlalchemy.orm import Session
@@ -11,6 +12,7 @@ def get_memu_service():
 
 
 def get_db():
+    ensure_schema_once(engine)
     db = SessionLocal()
     try:
         yield db
@@ -0,0 +1,31 @@
+"""
+user state 用の ETag / 条件付き GET
+
+ETag は user_states.version と表現（パス + クエリ）から作るため、state_json を
+デコードしなくても行のメタデータだけで If-None-Match を判定できます。
+"""
+import hashlib
+from typing import Optional
+
+from fastapi import Request
+
+
+def state_etag(user_id: str, version: int, request: Request) -> str:
+    """強い ETag を返す。同じ version でも fields= などが違えば別の表現として扱う"""
+    variant = "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+    digest = hashlib.blake2b(
+        f"{user_id}\n{request.url.path}\n{variant}".encode("utf-8"),
+        digest_size=6,
+    ).hexdigest()
+    return f'"v{int(version)}-{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match の判定（RFC 9110 の弱い比較）"""
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    if "*" in candidates:
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(c.removeprefix("W/") == opaque for c in candidates if c)
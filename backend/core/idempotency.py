@@ -0,0 +1,105 @@
+"""
+Idempotency-Key による POST の再送対策
+
+モバイルの再送で LLM 呼び出し・エピソード追加・memU への保存が二重に走らないよう、
+``Idempotency-Key`` ヘッダー付きのリクエストは (ルート, userId, キー) ごとに 1 回だけ実行します。
+
+- 実行中に同じキーが来たら、その結果を待って同じレスポンスを返す（single-flight）
+- 完了後 IDEMPOTENCY_TTL 秒（既定 86400）以内に来たら保存済みのレスポンスを返す
+  （``Idempotent-Replayed: true`` を付ける）
+- 同じキーで本文が違う場合は 422、IDEMPOTENCY_WAIT 秒（既定 60）待っても終わらなければ 409
+- 失敗したリクエストは保存しないので、同じキーで再試行できる
+
+保存先はプロセス内のメモリです（IDEMPOTENCY_MAX_KEYS、既定 10000 件）。複数プロセスで
+動かす場合、別プロセスに届いた再送は重複を検出できません。
+"""
+from typing import Any, Awaitable, Callable, Hashable, Optional, Tuple, TypeVar
+import hashlib
+import json
+import os
+import time
+
+from fastapi import HTTPException, Response
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+from core import metrics
+from core.singleflight import SingleFlight
+from core.ttl_cache import TTLCache
+
+
+T = TypeVar("T")
+
+MAX_KEY_LENGTH = 255
+
+IDEMPOTENT_REQUESTS = metrics.REGISTRY.counter(
+    "pocketcoo_idempotent_requests_total",
+    "Requests carrying an Idempotency-Key, by outcome (first, replayed, joined, conflict).",
+)
+
+_completed: TTLCache[Tuple[str, Any]] = TTLCache(
+    maxsize=int(os.getenv("IDEMPOTENCY_MAX_KEYS") or "10000"),
+    ttl=float(os.getenv("IDEMPOTENCY_TTL") or "86400"),
+)
+_in_flight: SingleFlight[Any] = SingleFlight()
+metrics.BUFFER_SIZE.set_function(lambda: len(_completed), buffer="idempotency")
+
+
+def fingerprint(payload: BaseModel) -> str:
+    body = json.dumps(payload.model_dump(mode="json"), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+def reset() -> None:
+    """テスト用: 保存済みのレスポンスを消す"""
+    _completed.clear()
+
+
+async def run_idempotent(
+    *,
+    route: str,
+    user_id: str,
+    key: Optional[str],
+    payload: BaseModel,
+    response: Response,
+    fn: Callable[[], Awaitable[T]],
+) -> T:
+    """key が無ければ fn をそのまま実行する"""
+    if key is None:
+        return await fn()
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+
+    scope: Hashable = (route, user_id, key)
+    digest = fingerprint(payload)
+    deadline = time.monotonic() + float(os.getenv("IDEMPOTENCY_WAIT") or "60")
+    waited = False
+    while True:
+        stored = _completed.get(scope)
+        if stored is not None:
+            stored_digest, result = stored
+            if stored_digest != digest:
+                IDEMPOTENT_REQUESTS.inc(route=route, result="conflict")
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request body")
+            IDEMPOTENT_REQUESTS.inc(route=route, result="joined" if waited else "replayed")
+            response.headers["Idempotent-Replayed"] = "true"
+            return result
+        call, leader = _in_flight.acquire(scope)
+        if leader:
+            break
+        # 実行中の同じキーを待つ。leader が失敗していたら次のループで自分が実行する
+        waited = True
+        if not await run_in_threadpool(call.wait, max(0.0, deadline - time.monotonic())):
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+
+    try:
+        result = await fn()
+    except BaseException as e:
+        _in_flight.finish(scope, call, error=e)
+        raise
+    # 先に保存してから in-flight を外す（その間に来た再送が再実行しないように）
+    _completed.set(scope, (digest, result))
+    _in_flight.finish(scope, call, result=result)
+    IDEMPOTENT_REQUESTS.inc(route=route, result="first")
+    return result
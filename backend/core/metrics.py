@@ -0,0 +1,273 @@
+"""
+Prometheus 形式のメトリクス（外部ライブラリ・外部サービス不要）
+
+GET /metrics でテキスト形式（version 0.0.4）を返します。
+
+    from core import metrics
+
+    with metrics.stage("get_state"):
+        ...
+    metrics.LLM_FALLBACKS.inc(source="anthropic", target="openai")
+"""
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import math
+import threading
+import time
+
+
+# 秒。DB/トークナイズの ms 未満から LLM の数十秒までを覆う
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+
+    def samples(self) -> List[str]:  # pragma: no cover - サブクラスで実装
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: object) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: object) -> float:
+        return self._values.get(_label_key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """set() で値を持つか、callback で scrape 時に値を計算する"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: Dict[LabelKey, float] = {}
+        self._callbacks: Dict[LabelKey, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels: object) -> None:
+        with self._lock:
+            self._values[_label_key(labels)] = float(value)
+
+    def set_function(self, fn: Callable[[], float], **labels: object) -> None:
+        with self._lock:
+            self._callbacks[_label_key(labels)] = fn
+
+    def value(self, **labels: object) -> float:
+        key = _label_key(labels)
+        if key in self._callbacks:
+            return float(self._callbacks[key]())
+        return self._values.get(key, 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+            callbacks = dict(self._callbacks)
+        for key, fn in callbacks.items():
+            try:
+                values[key] = float(fn())
+            except Exception:
+                continue
+        return [f"{self.name}{_format_labels(k)} {_format_value(v)}" for k, v in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        # label -> [bucket counts..., sum, count]
+        self._series: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels: object) -> int:
+        series = self._series.get(_label_key(labels))
+        return int(series[-1]) if series else 0
+
+    @contextmanager
+    def time(self, **labels: object) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        lines: List[str] = []
+        for key, series in items:
+            for bound, n in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', _format_value(bound)))} {_format_value(n)}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {repr(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {_format_value(series[-1])}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self.register(Counter(name, documentation))  # type: ignore[return-value]
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self.register(Gauge(name, documentation))  # type: ignore[return-value]
+
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, buckets))  # type: ignore[return-value]
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = [self._metrics[k] for k in sorted(self._metrics)]
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "pocketcoo_stage_duration_seconds",
+    "Time spent in each backend stage (state load/save, memU, LLM, tokenization, embedding), once per request.",
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "pocketcoo_http_request_duration_seconds",
+    "HTTP request latency by route template.",
+)
+LLM_FALLBACKS = REGISTRY.counter(
+    "pocketcoo_llm_provider_fallbacks_total",
+    "Times an LLM call fell through from one provider/endpoint to the next.",
+)
+LLM_CACHE_REQUESTS = REGISTRY.counter(
+    "pocketcoo_llm_cache_requests_total",
+    "LLM response cache lookups by result (hit, miss, bypass).",
+)
+LLM_RESPONSES = REGISTRY.counter(
+    "pocketcoo_llm_responses_total",
+    "LLM responses by the endpoint that produced them (source) and cache result (hit, miss, bypass).",
+)
+LLM_CACHE_SAVED_SECONDS = REGISTRY.counter(
+    "pocketcoo_llm_cache_saved_seconds_total",
+    "LLM latency avoided by cache hits (latency of the original call).",
+)
+MEMU_ERRORS = REGISTRY.counter(
+    "pocketcoo_memu_errors_total",
+    "memU / mem0 operations that raised.",
+)
+MEM0_FALLBACK_OPERATIONS = REGISTRY.counter(
+    "pocketcoo_mem0_fallback_operations_total",
+    "Memory operations served by the in-process fallback store instead of mem0.",
+)
+FACTS_DEDUPED = REGISTRY.counter(
+    "pocketcoo_facts_deduped_total",
+    "Extracted facts not stored because the user already has the same or a near-identical memory.",
+)
+MEM0_FALLBACK_MODE = REGISTRY.gauge(
+    "pocketcoo_mem0_fallback_mode",
+    "1 when mem0 could not be initialised and the in-process fallback store is used.",
+)
+BUFFER_SIZE = REGISTRY.gauge(
+    "pocketcoo_buffer_items",
+    "Items held in in-memory buffers and caches.",
+)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """処理段階の所要時間を pocketcoo_stage_duration_seconds に記録する"""
+    with STAGE_SECONDS.time(stage=name):
+        yield
+
+
+def timed_stage(name: str) -> Callable:
+    """stage() のデコレータ版
+
+    リクエスト単位の段階（get_state, apply_turn など）に付ける。トークナイズのような 1 リクエストで
+    何十回も呼ばれる小さな関数には付けず、呼び出し側で stage() を 1 回だけ使う。
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with STAGE_SECONDS.time(stage=name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def render_latest() -> str:
+    return REGISTRY.render()
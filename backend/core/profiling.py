@@ -0,0 +1,275 @@
+"""
+リクエスト単位のオプトイン・プロファイリング
+
+特定ユーザーのチャットだけが遅い、といった本番の状況をそのまま計測するための
+ミドルウェアです。次のどちらかに当てはまるリクエストだけをプロファイルします。
+
+- ヘッダー ``X-Profile: <PROFILE_ADMIN_KEY>`` が付いている（管理者のみ）
+- ``PROFILE_SAMPLE_RATE``（0.0〜1.0、既定 0）の確率で抽選に当たった
+
+結果は ``PROFILE_DIR``（既定 ./data/profiles）に書き出します。
+
+- ``PROFILE_MODE=sampler``（既定）: スタックサンプラーで ``.folded``（flamegraph.pl / speedscope
+  で読める collapsed stack 形式）
+- ``PROFILE_MODE=cprofile``: cProfile で ``.pstats``（snakeviz / flameprof などで変換）
+
+どちらも同じ名前の ``.json`` に、パス・所要時間・ユーザーID・エピソード数・state サイズを添えます。
+ユーザーID などはサービス側が ``annotate()`` で付けます（プロファイル中でなければ何もしない）。
+
+get_state / apply_turn / LLM 呼び出しはイベントループではなくスレッドプールで動くので、ルートは
+starlette ではなくこのモジュールの ``run_in_threadpool`` を使います。プロファイル中のリクエストなら、
+投げた先のワーカースレッドも計測に含めます（サンプラーはそのスレッドも覗き、cProfile はスレッドごとに
+有効にして最後にまとめる）。
+
+サンプラーはイベントループのスレッドも覗くため、同じワーカーで同時に処理中の
+他リクエストのスタックも混ざりえます。調査時は負荷の低いワーカーで使ってください。
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+from starlette.concurrency import run_in_threadpool as _run_in_threadpool
+
+
+PROFILE_HEADER = "x-profile"
+
+T = TypeVar("T")
+
+_annotations: ContextVar[Optional[Dict[str, Any]]] = ContextVar("profiling_annotations", default=None)
+_profiler: ContextVar[Optional[Any]] = ContextVar("profiling_profiler", default=None)
+
+
+def annotate(**values: Any) -> None:
+    """プロファイル中のリクエストにメタデータを付ける"""
+    current = _annotations.get()
+    if current is not None:
+        current.update({k: v for k, v in values.items() if v is not None})
+
+
+def is_profiling() -> bool:
+    return _annotations.get() is not None
+
+
+async def run_in_threadpool(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """starlette の run_in_threadpool と同じ。プロファイル中のリクエストならワーカースレッドも計測する"""
+    profiler = _profiler.get()
+    if profiler is None:
+        return await _run_in_threadpool(fn, *args, **kwargs)
+
+    def traced() -> T:
+        with profiler.thread():
+            return fn(*args, **kwargs)
+
+    return await _run_in_threadpool(traced)
+
+
+def _profile_dir() -> Path:
+    default = "/tmp/profiles" if os.getenv("VERCEL") else "./data/profiles"
+    return Path(os.getenv("PROFILE_DIR") or default)
+
+
+def _sample_rate() -> float:
+    try:
+        return max(0.0, min(1.0, float(os.getenv("PROFILE_SAMPLE_RATE") or "0")))
+    except ValueError:
+        return 0.0
+
+
+class _StackSampler:
+    """対象スレッドのスタックを一定間隔で取り、collapsed 形式で集計する
+
+    対象は start() したスレッド（イベントループ）と、thread() の中にいる間のワーカースレッド。
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.counts: Dict[str, int] = {}
+        self._threads: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                thread_ids = list(self._threads)
+            frames = sys._current_frames()
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if stack:
+                    key = ";".join(reversed(stack))
+                    self.counts[key] = self.counts.get(key, 0) + 1
+
+    @contextmanager
+    def thread(self) -> Iterator[None]:
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads[ident] = self._threads.get(ident, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._threads[ident] -= 1
+                if not self._threads[ident]:
+                    del self._threads[ident]
+
+    def start(self) -> None:
+        self._threads[threading.get_ident()] = 1
+        self._thread.start()
+
+    def stop(self) -> Dict[str, int]:
+        self._stop.set()
+        self._thread.join()
+        return self.counts
+
+
+class _ThreadedProfile:
+    """cProfile はスレッド単位なので、ワーカースレッドごとに Profile を作り、stop() で 1 つの Stats にまとめる"""
+
+    def __init__(self):
+        self.main = cProfile.Profile()
+        self._finished: List[cProfile.Profile] = []
+        self._active: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def thread(self) -> Iterator[None]:
+        ident = threading.get_ident()
+        with self._lock:
+            depth = self._active.get(ident, 0)
+            self._active[ident] = depth + 1
+        profile: Optional[cProfile.Profile] = None
+        if depth == 0:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # 別のプロファイラがこのスレッドで有効（3.12 以降は全体で 1 つ）
+                profile = None
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            with self._lock:
+                self._active[ident] -= 1
+                if not self._active[ident]:
+                    del self._active[ident]
+                if profile is not None:
+                    self._finished.append(profile)
+
+    def start(self) -> None:
+        self.main.enable()
+
+    def stop(self) -> pstats.Stats:
+        """終わったワーカーの分だけをまとめる（ヘッジで負けた呼び出しなど、まだ動いているものは含めない）"""
+        self.main.disable()
+        stats = pstats.Stats(self.main)
+        with self._lock:
+            finished = list(self._finished)
+        for profile in finished:
+            try:
+                stats.add(profile)
+            except TypeError:
+                # 何も記録されなかった Profile
+                pass
+        return stats
+
+
+class ProfilingMiddleware:
+    """ASGI ミドルウェア。対象リクエストをプロファイルしてファイルに書き出す"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def _wanted(self, scope) -> bool:
+        headers = dict(scope.get("headers") or [])
+        requested = headers.get(PROFILE_HEADER.encode("latin-1"))
+        admin_key = os.getenv("PROFILE_ADMIN_KEY")
+        if requested is not None and admin_key:
+            if hmac.compare_digest(requested.decode("latin-1"), admin_key):
+                return True
+        rate = _sample_rate()
+        return rate > 0 and random.random() < rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wanted(scope):
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+        profile_id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}_{random.getrandbits(24):06x}"
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message.setdefault("headers", []).append((b"x-profile-id", profile_id.encode("latin-1")))
+            await send(message)
+
+        annotations: Dict[str, Any] = {}
+        token = _annotations.set(annotations)
+        mode = (os.getenv("PROFILE_MODE") or "sampler").strip().lower()
+        profiler: Any
+        if mode == "cprofile":
+            profiler = _ThreadedProfile()
+        else:
+            profiler = _StackSampler(float(os.getenv("PROFILE_INTERVAL_MS") or "5") / 1000.0)
+        profiler_token = _profiler.set(profiler)
+        profiler.start()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _profiler.reset(profiler_token)
+            _annotations.reset(token)
+            try:
+                self._write(profile_id, scope, mode, profiler, elapsed, status["code"], annotations)
+            except Exception:
+                # プロファイルの書き出し失敗でリクエストを失敗させない
+                pass
+
+    def _write(self, profile_id, scope, mode, profiler, elapsed, status_code, annotations) -> None:
+        out_dir = _profile_dir()
+        out_dir.mkdir(parents=True, exist_ok=True)
+        user = re.sub(r"[^A-Za-z0-9_.-]+", "_", str(annotations.get("user_id") or "anonymous"))[:48]
+        stem = out_dir / f"{profile_id}_{user}"
+        samples = None
+        if mode == "cprofile":
+            profiler.stop().dump_stats(str(stem) + ".pstats")
+        else:
+            counts = profiler.stop()
+            samples = sum(counts.values())
+            with open(str(stem) + ".folded", "w", encoding="utf-8") as f:
+                for stack, n in sorted(counts.items()):
+                    f.write(f"{stack} {n}\n")
+        meta = {
+            "id": profile_id,
+            "mode": mode,
+            "method": scope.get("method"),
+            "path": scope.get("path"),
+            "query": (scope.get("query_string") or b"").decode("latin-1"),
+            "status": status_code,
+            "duration_ms": round(elapsed * 1000.0, 3),
+            "samples": samples,
+            **annotations,
+        }
+        with open(str(stem) + ".json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,174 @@
+"""
+JSON エンコード/デコードの共通窓口
+
+state_json の読み書き・プロンプト用の JSON 化・API 応答はすべてここを通します。
+msgspec / orjson が入っていれば使い、無ければ標準の json にフォールバックします。
+
+- JSON_CODEC=auto|msgspec|orjson|json（既定 auto: msgspec → orjson → json の順に選ぶ。
+  順序は benchmarks/bench_serialization.py の計測で decode/encode とも速かった順）
+- msgspec がある場合、GET /api/user の応答検証は pydantic ではなく msgspec の Struct で行う
+"""
+from typing import Any, Dict, List, Optional, Union
+import json
+import os
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 任意依存
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - 任意依存
+    msgspec = None
+
+
+CODECS = ("msgspec", "orjson", "json")
+
+
+def _available(name: str) -> bool:
+    if name == "orjson":
+        return orjson is not None
+    if name == "msgspec":
+        return msgspec is not None
+    return name == "json"
+
+
+def _resolve_codec(requested: Optional[str]) -> str:
+    name = (requested or "auto").strip().lower()
+    if name in CODECS and _available(name):
+        return name
+    for candidate in CODECS:
+        if _available(candidate):
+            return candidate
+    return "json"
+
+
+codec = _resolve_codec(os.getenv("JSON_CODEC"))
+
+if msgspec is not None:
+    _msgspec_encoder = msgspec.json.Encoder()
+    _msgspec_decoder = msgspec.json.Decoder()
+
+
+def set_codec(name: Optional[str]) -> str:
+    """実行時に codec を切り替える（ベンチマーク・テスト用）。実際に選ばれた名前を返す"""
+    global codec
+    codec = _resolve_codec(name)
+    return codec
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """UTF-8 の JSON バイト列（非 ASCII はエスケープしない）"""
+    if codec == "orjson":
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    if codec == "msgspec":
+        return _msgspec_encoder.encode(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(obj: Any) -> str:
+    return dumps_bytes(obj).decode("utf-8")
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    if codec == "orjson":
+        return orjson.loads(data)
+    if codec == "msgspec":
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        return _msgspec_decoder.decode(data)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data).decode("utf-8")
+    return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """dumps_bytes でレンダリングする JSONResponse（FastAPI の ORJSONResponse 相当）
+
+    ルートから直接返すと jsonable_encoder による再帰的な変換も省略できる。
+    """
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, (bytes, bytearray)):
+            return bytes(content)
+        return dumps_bytes(content)
+
+
+if msgspec is not None:
+    from msgspec import UNSET, UnsetType
+
+    # models/user_state.py の pydantic モデルと同じ形。UNSET のフィールドは出力しないので、
+    # pydantic の exclude_unset と同じく「元の dict に無いキー」は応答にも出ない。
+
+    class PreferenceStruct(msgspec.Struct):
+        key: str
+        value: str
+        confidence: Union[float, UnsetType] = UNSET
+
+    class IdentityStruct(msgspec.Struct):
+        style: Union[Dict[str, Any], UnsetType] = UNSET
+        preferences: Union[List[PreferenceStruct], UnsetType] = UNSET
+        updated_at: Union[Optional[str], UnsetType] = UNSET
+        profile: Union[Dict[str, Any], UnsetType] = UNSET
+
+    class ProjectStruct(msgspec.Struct):
+        id: str
+        name: str
+        status: Union[str, UnsetType] = UNSET
+        context: Union[str, UnsetType] = UNSET
+        stakeholders: Union[List[str], UnsetType] = UNSET
+        deadline: Union[Optional[str], UnsetType] = UNSET
+        decisions: Union[List[Dict[str, Any]], UnsetType] = UNSET
+
+    class EpisodeStruct(msgspec.Struct):
+        id: str
+        date: str
+        type: Union[str, UnsetType] = UNSET
+        user_message: Union[Optional[str], UnsetType] = UNSET
+        assistant_message: Union[Optional[str], UnsetType] = UNSET
+        memory_used: Union[List[str], UnsetType] = UNSET
+        summary: Union[Optional[str], UnsetType] = UNSET
+        learnings: Union[List[Dict[str, Any]], UnsetType] = UNSET
+        feedback: Union[Optional[Dict[str, Any]], UnsetType] = UNSET
+        tags: Union[List[str], UnsetType] = UNSET
+        topics: Union[List[str], UnsetType] = UNSET
+        embedding: Union[Optional[List[int]], UnsetType] = UNSET
+        embedding_dim: Union[Optional[int], UnsetType] = UNSET
+        embedding_model: Union[Optional[str], UnsetType] = UNSET
+        embedding_at: Union[Optional[str], UnsetType] = UNSET
+
+    class UserStateStruct(msgspec.Struct, rename={"user_id": "userId", "episode_count": "episodeCount", "next_cursor": "nextCursor"}):
+        user_id: str
+        identity: Union[IdentityStruct, UnsetType] = UNSET
+        projects: Union[List[ProjectStruct], UnsetType] = UNSET
+        episodes: Union[List[EpisodeStruct], UnsetType] = UNSET
+        score: Union[int, UnsetType] = UNSET
+        episode_count: Union[int, UnsetType] = UNSET
+        next_cursor: Union[Optional[str], UnsetType] = UNSET
+
+
+class StateEncodingError(RuntimeError):
+    """保存済みの state が UserStateView の形に合わない（サーバー側のデータ不整合なので 500 で返す）"""
+
+
+def encode_user_state(view: Dict[str, Any]) -> bytes:
+    """project_state の結果を UserStateView の形に検証して JSON 化する
+
+    msgspec があれば Struct で、無ければ pydantic で検証する（どちらも未知のキーは落とす）。
+    検証に失敗したら StateEncodingError。ValueError（fields / cursor の誤り = 400）とは区別する。
+    """
+    if msgspec is not None:
+        try:
+            return _msgspec_encoder.encode(msgspec.convert(view, UserStateStruct, strict=False))
+        except msgspec.ValidationError as e:
+            raise StateEncodingError(str(e)) from e
+    from pydantic import ValidationError
+    from models.user_state import UserStateView
+
+    try:
+        return UserStateView.model_validate(view).model_dump_json(by_alias=True, exclude_unset=True).encode("utf-8")
+    except ValidationError as e:
+        raise StateEncodingError(str(e)) from e
@@ -0,0 +1,90 @@
+"""
+同じキーの同時実行を 1 回にまとめる（single-flight）
+
+最初の呼び出し（leader）だけが fn を実行し、実行中に来た同じキーの呼び出しはその結果を待って
+同じ値（または同じ例外）を受け取ります。完了後に来た呼び出しは新しく実行されます。
+
+    flight = SingleFlight()
+    value = flight.do(("state", user_id), lambda: load(user_id))
+
+async のハンドラーからは acquire() / finish() を使い、待つ側は Call.wait をスレッドで待ちます。
+結果を共有用に変換したい場合（待っている呼び出しがいる時だけコピーを作るなど）は
+finish() の代わりに detach() で待ち数を確定してから resolve() します。
+"""
+from typing import Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+import threading
+
+
+T = TypeVar("T")
+
+
+class WaitTimeout(TimeoutError):
+    """待つ側が timeout までに leader の結果を受け取れなかった"""
+
+
+class Call(Generic[T]):
+    def __init__(self) -> None:
+        self._done = threading.Event()
+        self.result: Optional[T] = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def get(self) -> T:
+        if self.error is not None:
+            raise self.error
+        return self.result  # type: ignore[return-value]
+
+
+class SingleFlight(Generic[T]):
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, Call[T]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def acquire(self, key: Hashable) -> Tuple[Call[T], bool]:
+        """(call, leader) を返す。leader が True なら呼び出し側が実行して finish() する"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                return call, False
+            call = Call()
+            self._calls[key] = call
+            return call, True
+
+    def detach(self, key: Hashable, call: Call[T]) -> int:
+        """key から call を外し、待っている呼び出しの数を返す（以降は新しい呼び出しが leader になる）"""
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+            return call.waiters
+
+    @staticmethod
+    def resolve(call: Call[T], result: Optional[T] = None, error: Optional[BaseException] = None) -> None:
+        call.result = result
+        call.error = error
+        call._done.set()
+
+    def finish(self, key: Hashable, call: Call[T], result: Optional[T] = None, error: Optional[BaseException] = None) -> None:
+        self.detach(key, call)
+        self.resolve(call, result, error)
+
+    def do(self, key: Hashable, fn: Callable[[], T], timeout: Optional[float] = None) -> T:
+        """timeout は待つ側だけに効く（leader の実行は止めない）。過ぎたら WaitTimeout"""
+        call, leader = self.acquire(key)
+        if not leader:
+            if not call.wait(timeout):
+                raise WaitTimeout("timed out waiting for the in-flight call")
+            return call.get()
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result=result)
+        return result
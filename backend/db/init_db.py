@@ -10,7 +10,7 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from db.session import engine
-from db.base import Base
+from db.schema import ensure_schema
 
 
 def init_db():
@@ -19,8 +19,8 @@ def init_db():
     print(f"データベースURL: {engine.url}")
 
     try:
-        # すべてのテーブルを作成
-        Base.metadata.create_all(bind=engine)
+        # すべてのテーブルを作成し、追加された列を反映
+        ensure_schema(engine)
         print("✅ データベーステーブルが正常に作成されました")
     except Exception as e:
         print(f"❌ エラーが発生しました: {e}")
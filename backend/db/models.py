@@ -1,6 +1,7 @@
-from sqlalchemy import String, Text, DateTime
+from sqlalchemy import String, Text, DateTime, Integer, LargeBinary
 from sqlalchemy.orm import Mapped, mapped_column
 from datetime import datetime
+from typing import Optional
 from .base import Base
 
 
@@ -10,3 +11,20 @@ class UserState(Base):
     user_id: Mapped[str] = mapped_column(String(128), primary_key=True)
     state_json: Mapped[str] = mapped_column(Text(), nullable=False)
     updated_at: Mapped[datetime] = mapped_column(DateTime(), nullable=False, default=datetime.utcnow)
+    # 楽観的ロック用。書き込みごとに +1 され、compare-and-swap の比較対象になる
+    version: Mapped[int] = mapped_column(Integer(), nullable=False, default=0, server_default="0")
+    # state_format が "zstd:..." の行は state_blob に圧縮済み JSON を持つ（db/state_compression.py）。
+    # NULL / "json" の行は従来どおり state_json に平文を持つ
+    state_blob: Mapped[Optional[bytes]] = mapped_column(LargeBinary(), nullable=True)
+    state_format: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+
+
+class UserAggregate(Base):
+    """user_states から派生する集計キャッシュ。state_version が一致する間だけ有効"""
+
+    __tablename__ = "user_aggregates"
+
+    user_id: Mapped[str] = mapped_column(String(128), primary_key=True)
+    aggregates_json: Mapped[str] = mapped_column(Text(), nullable=False)
+    state_version: Mapped[int] = mapped_column(Integer(), nullable=False, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(), nullable=False, default=datetime.utcnow)
@@ -0,0 +1,61 @@
+"""
+スキーマの作成と軽量マイグレーション
+
+create_all は既存テーブルに列を追加しないため、後から追加した列は
+ここで ALTER TABLE して既存DB（SQLite / Postgres）を追従させます。
+"""
+from typing import Dict, Set, Tuple
+import threading
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from .base import Base
+from . import models  # noqa: F401  テーブル定義を Base.metadata に登録する
+
+
+# table -> 後から追加した列（型や既定値は models.py の定義から作る）
+_ADDED_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "user_states": ("version", "state_blob", "state_format"),
+}
+
+
+_ensured: Set[int] = set()
+_ensured_lock = threading.Lock()
+
+
+def _column_ddl(engine: Engine, table: str, name: str) -> str:
+    column = Base.metadata.tables[table].columns[name]
+    ddl = f"{name} {column.type.compile(dialect=engine.dialect)}"
+    if column.server_default is not None:
+        ddl += f" DEFAULT {column.server_default.arg}"
+    if not column.nullable:
+        ddl += " NOT NULL"
+    return ddl
+
+
+def ensure_schema(engine: Engine) -> None:
+    """テーブルを作成し、不足している列を追加する（冪等）"""
+    Base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+    for table, columns in _ADDED_COLUMNS.items():
+        if not inspector.has_table(table):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table)}
+        missing = [name for name in columns if name not in existing]
+        if not missing:
+            continue
+        with engine.begin() as conn:
+            for name in missing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {_column_ddl(engine, table, name)}"))
+
+
+def ensure_schema_once(engine: Engine) -> None:
+    """プロセス内で最初の 1 回だけ ensure_schema する（import 時ではなく最初の DB アクセス時に呼ぶ）"""
+    if id(engine) in _ensured:
+        return
+    with _ensured_lock:
+        if id(engine) in _ensured:
+            return
+        ensure_schema(engine)
+        _ensured.add(id(engine))
@@ -0,0 +1,136 @@
+"""
+user_id によるユーザー state の水平分割（シャーディング）
+
+SQLite は 1 ファイルに同時に 1 つしか書き込めないため、全ユーザーが 1 つの personalos.db を
+共有していると全チャットのコミットが直列になります。user_id をコンシステントハッシュで
+N 個の DB（SQLite ファイル、または Postgres のスキーマ）に振り分け、シャードごとに別の
+エンジン（接続プール・書き込みロック）を使います。
+
+- DATABASE_SHARD_URLS: カンマ区切りの DB URL。並び順がシャード名 s0, s1, ... になる
+  （Postgres のスキーマ分割は ``postgresql://.../db?options=-csearch_path%3Dshard0`` のように指定）
+- DATABASE_SHARDS=N: DATABASE_URL が SQLite の場合の省略形。personalos.db → personalos.s0.db ...
+- どちらも無ければシャーディングしない（従来どおり DATABASE_URL の 1 つだけ）
+
+シャードを増やす場合は末尾に追加すること（名前が変わらなければ移動は約 1/N のユーザーだけ）。
+移動は tools/rebalance_shards.py で行います。
+"""
+from bisect import bisect
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import hashlib
+import os
+import threading
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+
+from db.schema import ensure_schema_once
+from db.session import _ensure_sqlite_dir, get_database_url
+
+
+VNODES = 128
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """シャード名のコンシステントハッシュ（各シャード VNODES 個の仮想ノード）"""
+
+    def __init__(self, names: Sequence[str], vnodes: int = VNODES):
+        if not names:
+            raise ValueError("HashRing needs at least one shard")
+        points: List[Tuple[int, str]] = []
+        for name in names:
+            for i in range(vnodes):
+                points.append((_hash(f"{name}#{i}"), name))
+        points.sort()
+        self._keys = [p[0] for p in points]
+        self._names = [p[1] for p in points]
+
+    def node_for(self, key: str) -> str:
+        idx = bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._names[idx]
+
+
+def create_shard_engine(url: str) -> Engine:
+    _ensure_sqlite_dir(url)
+    return create_engine(url, connect_args={"check_same_thread": False} if url.startswith("sqlite") else {})
+
+
+class ShardSet:
+    def __init__(self, urls: Sequence[str]):
+        self.urls: Dict[str, str] = {f"s{i}": url for i, url in enumerate(urls)}
+        self.ring = HashRing(list(self.urls))
+        self._engines: Dict[str, Engine] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    def shard_for(self, user_id: str) -> str:
+        return self.ring.node_for(user_id)
+
+    def engine(self, name: str) -> Engine:
+        engine = self._engines.get(name)
+        if engine is None:
+            with self._lock:
+                engine = self._engines.get(name)
+                if engine is None:
+                    engine = create_shard_engine(self.urls[name])
+                    self._engines[name] = engine
+        ensure_schema_once(engine)
+        return engine
+
+    def engine_for(self, user_id: str) -> Engine:
+        return self.engine(self.shard_for(user_id))
+
+    def engines(self) -> Iterator[Tuple[str, Engine]]:
+        for name in self.urls:
+            yield name, self.engine(name)
+
+    def dispose(self) -> None:
+        for engine in self._engines.values():
+            engine.dispose()
+
+
+def shard_urls_from_env() -> List[str]:
+    explicit = [u.strip() for u in (os.getenv("DATABASE_SHARD_URLS") or "").split(",") if u.strip()]
+    if explicit:
+        return explicit
+    count = int(os.getenv("DATABASE_SHARDS") or "0")
+    if count <= 1:
+        return []
+    base = get_database_url()
+    if not base.startswith("sqlite:///") or base.endswith(":memory:"):
+        raise ValueError("DATABASE_SHARDS requires a file-based SQLite DATABASE_URL; use DATABASE_SHARD_URLS instead")
+    stem, ext = os.path.splitext(base)
+    return [f"{stem}.s{i}{ext or '.db'}" for i in range(count)]
+
+
+_shards: Optional[ShardSet] = None
+_shards_loaded = False
+_shards_lock = threading.Lock()
+
+
+def get_shards() -> Optional[ShardSet]:
+    """環境変数からシャード構成を作る（プロセスで 1 回）。シャーディングしないなら None"""
+    global _shards, _shards_loaded
+    if _shards_loaded:
+        return _shards
+    with _shards_lock:
+        if not _shards_loaded:
+            urls = shard_urls_from_env()
+            _shards = ShardSet(urls) if urls else None
+            _shards_loaded = True
+    return _shards
+
+
+def reset_shards() -> None:
+    """テスト用: 環境変数を読み直す"""
+    global _shards, _shards_loaded
+    with _shards_lock:
+        if _shards is not None:
+            _shards.dispose()
+        _shards = None
+        _shards_loaded = False
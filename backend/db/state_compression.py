@@ -0,0 +1,270 @@
+"""
+user_states の state を zstd で圧縮して保存する
+
+state JSON はどのエピソードも同じキーを持ち、デモ用エピソードは 8 種類のテンプレートの
+複製、さらに長い埋め込み配列を含むため非常によく縮みます。小さめの state でも効くよう、
+エピソード JSON で学習した辞書（db/zstd_dicts/*.dict）を使います。
+
+行の形式は state_format 列で判別します。
+
+- NULL / "json": 従来どおり state_json に平文（未移行の行。次の保存時に圧縮される）
+- "zstd":        state_blob に辞書なしの zstd
+- "zstd:<id>":   state_blob に辞書 <id>（zstd の dict_id）を使った zstd
+
+環境変数:
+- STATE_COMPRESSION=zstd|none（既定 zstd。zstandard が無ければ常に none）
+- STATE_ZSTD_LEVEL（既定 3）
+- STATE_ZSTD_DICT: 書き込みに使う辞書ファイル名（既定 state-v1.dict、"none" で辞書なし）
+
+辞書の作り直し・既存行の一括移行:
+
+    cd backend && python -m db.state_compression train --out db/zstd_dicts/state-v2.dict
+    cd backend && python -m db.state_compression migrate
+"""
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+import argparse
+import os
+import sys
+import threading
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - 任意依存
+    zstandard = None
+
+
+FORMAT_JSON = "json"
+FORMAT_ZSTD = "zstd"
+DICT_DIR = Path(__file__).resolve().parent / "zstd_dicts"
+DEFAULT_DICT = "state-v1.dict"
+
+_local = threading.local()
+
+
+class StateDecodeError(RuntimeError):
+    """圧縮形式の行を読めない（zstandard が無い・辞書が無い等）"""
+
+
+def _level() -> int:
+    return int(os.getenv("STATE_ZSTD_LEVEL") or "3")
+
+
+def compression_enabled() -> bool:
+    if zstandard is None:
+        return False
+    return (os.getenv("STATE_COMPRESSION") or FORMAT_ZSTD).strip().lower() == FORMAT_ZSTD
+
+
+@lru_cache(maxsize=None)
+def _dictionaries() -> Dict[int, "zstandard.ZstdCompressionDict"]:
+    """同梱されている辞書を dict_id ごとに読み込む。読み込み専用の古い辞書も含む"""
+    out: Dict[int, "zstandard.ZstdCompressionDict"] = {}
+    if zstandard is None or not DICT_DIR.is_dir():
+        return out
+    for path in sorted(DICT_DIR.glob("*.dict")):
+        d = zstandard.ZstdCompressionDict(path.read_bytes())
+        out[d.dict_id()] = d
+    return out
+
+
+@lru_cache(maxsize=None)
+def _write_dictionary(name: str) -> Optional["zstandard.ZstdCompressionDict"]:
+    if name.lower() == "none":
+        return None
+    path = DICT_DIR / name
+    if not path.exists():
+        return None
+    d = zstandard.ZstdCompressionDict(path.read_bytes())
+    # 読み込み側でも同じ id で引けるようにしておく
+    _dictionaries().setdefault(d.dict_id(), d)
+    return d
+
+
+def _compressor() -> Tuple["zstandard.ZstdCompressor", str]:
+    """スレッドごとに ZstdCompressor を使い回す（スレッドセーフではないため）"""
+    key = (os.getenv("STATE_ZSTD_DICT") or DEFAULT_DICT, _level())
+    cached = getattr(_local, "compressor", None)
+    if cached and cached[0] == key:
+        return cached[1], cached[2]
+    d = _write_dictionary(key[0])
+    if d is not None:
+        compressor = zstandard.ZstdCompressor(level=key[1], dict_data=d)
+        fmt = f"{FORMAT_ZSTD}:{d.dict_id()}"
+    else:
+        compressor = zstandard.ZstdCompressor(level=key[1])
+        fmt = FORMAT_ZSTD
+    _local.compressor = (key, compressor, fmt)
+    return compressor, fmt
+
+
+def _decompressor(dict_id: Optional[int]) -> "zstandard.ZstdDecompressor":
+    cache = getattr(_local, "decompressors", None)
+    if cache is None:
+        cache = _local.decompressors = {}
+    if dict_id not in cache:
+        if dict_id is None:
+            cache[dict_id] = zstandard.ZstdDecompressor()
+        else:
+            d = _dictionaries().get(dict_id)
+            if d is None:
+                raise StateDecodeError(f"zstd dictionary {dict_id} is not available in {DICT_DIR}")
+            cache[dict_id] = zstandard.ZstdDecompressor(dict_data=d)
+    return cache[dict_id]
+
+
+def encode_state(payload: bytes) -> Tuple[str, Optional[bytes], str]:
+    """JSON バイト列を (state_json, state_blob, state_format) に変換する"""
+    if not compression_enabled():
+        return payload.decode("utf-8"), None, FORMAT_JSON
+    compressor, fmt = _compressor()
+    return "", compressor.compress(payload), fmt
+
+
+def decode_state(
+    state_json: Optional[str],
+    state_blob: Optional[bytes],
+    state_format: Optional[str],
+) -> Union[str, bytes]:
+    """行の内容から JSON（str か bytes）を取り出す"""
+    if not state_format or state_format == FORMAT_JSON:
+        return state_json or ""
+    kind, _, dict_id = state_format.partition(":")
+    if kind != FORMAT_ZSTD:
+        raise StateDecodeError(f"unknown state_format '{state_format}'")
+    if zstandard is None:
+        raise StateDecodeError("zstandard is required to read compressed user states")
+    # 圧縮時にサイズをフレームに書いているので max_output_size は不要
+    return _decompressor(int(dict_id) if dict_id else None).decompress(bytes(state_blob or b""))
+
+
+def train_dictionary(samples: Iterable[bytes], size: int = 16384) -> bytes:
+    if zstandard is None:
+        raise RuntimeError("zstandard is not installed")
+    return zstandard.train_dictionary(size, list(samples)).as_bytes()
+
+
+def _synthetic_samples() -> List[bytes]:
+    """同梱辞書の学習用サンプル（デモエピソード + 合成チャットターン + identity/projects）"""
+    from core import serialization
+    from services.pocket_coo_service import _build_demo_episodes, _build_turn_episode, seeded_demo_state
+
+    samples = [serialization.dumps_bytes(e) for e in _build_demo_episodes(total=400)]
+    phrases = ["市場調査やっといて", "箇条書きで数字多め", "PRDの叩き台", "SLOと監視", "pricing test plan", "weekly sync notes"]
+    for i in range(400):
+        user = f"{phrases[i % len(phrases)]} #{i}"
+        assistant = f"了解。結論→理由→次アクションで整理します（{i}）"
+        samples.append(serialization.dumps_bytes(_build_turn_episode(user, assistant, ["preferences.format"])))
+    state = seeded_demo_state("demo_dictionary")
+    head = {k: v for k, v in state.items() if k != "episodes"}
+    samples.extend([serialization.dumps_bytes(head)] * 8)
+    return samples
+
+
+def _engines() -> List[Any]:
+    """対象のエンジン。シャーディングしていればシャードごと、していなければ既定のエンジンだけ"""
+    from db.session import engine
+    from db.sharding import get_shards
+
+    shards = get_shards()
+    if shards is None:
+        return [engine]
+    return [shard_engine for _, shard_engine in shards.engines()]
+
+
+def _db_samples(limit: int) -> List[bytes]:
+    """既存 DB（シャーディング時は全シャード）の limit ユーザー分のエピソードから学習サンプルを取る"""
+    from sqlalchemy import select
+
+    from core import serialization
+    from db.models import UserState
+    from db.session import SessionLocal
+
+    samples: List[bytes] = []
+    remaining = limit
+    for bind in _engines():
+        if remaining <= 0:
+            break
+        db = SessionLocal(bind=bind)
+        try:
+            rows = db.execute(
+                select(UserState.state_json, UserState.state_blob, UserState.state_format).limit(remaining)
+            ).all()
+        finally:
+            db.close()
+        remaining -= len(rows)
+        for row in rows:
+            state = serialization.loads(decode_state(row.state_json, row.state_blob, row.state_format))
+            samples.extend(serialization.dumps_bytes(e) for e in (state.get("episodes") or [])[-200:])
+    return samples
+
+
+def migrate(batch_size: int = 200) -> int:
+    """平文の行を圧縮形式に書き換える（シャーディング時は全シャード）。version は変えない（内容は同じなので）"""
+    if not compression_enabled():
+        raise RuntimeError("compression is disabled (STATE_COMPRESSION / zstandard)")
+    return sum(_migrate_engine(bind, batch_size) for bind in _engines())
+
+
+def _migrate_engine(bind: Any, batch_size: int) -> int:
+    from sqlalchemy import or_, select, update
+
+    from db.models import UserState
+    from db.session import SessionLocal
+
+    migrated = 0
+    last_user_id = ""
+    db = SessionLocal(bind=bind)
+    try:
+        while True:
+            rows = db.execute(
+                select(UserState.user_id, UserState.state_json, UserState.version)
+                .where(UserState.user_id > last_user_id)
+                .where(or_(UserState.state_format.is_(None), UserState.state_format == FORMAT_JSON))
+                .order_by(UserState.user_id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                return migrated
+            for row in rows:
+                state_json, blob, fmt = encode_state(row.state_json.encode("utf-8"))
+                result = db.execute(
+                    update(UserState)
+                    .where(UserState.user_id == row.user_id, UserState.version == row.version)
+                    .values(state_json=state_json, state_blob=blob, state_format=fmt)
+                    .execution_options(synchronize_session=False)
+                )
+                migrated += result.rowcount
+            db.commit()
+            last_user_id = rows[-1].user_id
+    finally:
+        db.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="user_states の zstd 圧縮ツール")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_train = sub.add_parser("train", help="辞書を学習して保存する")
+    p_train.add_argument("--out", default=str(DICT_DIR / DEFAULT_DICT))
+    p_train.add_argument("--size", type=int, default=16384)
+    p_train.add_argument("--from-db", type=int, default=0, metavar="N", help="既存DB（全シャード）の N ユーザー分もサンプルに使う")
+    p_migrate = sub.add_parser("migrate", help="平文の行を圧縮形式に書き換える")
+    p_migrate.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    if args.command == "train":
+        samples = _synthetic_samples()
+        if args.from_db:
+            samples.extend(_db_samples(args.from_db))
+        data = train_dictionary(samples, size=args.size)
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_bytes(data)
+        print(f"wrote {args.out} ({len(data)} bytes, dict_id={zstandard.ZstdCompressionDict(data).dict_id()})")
+    elif args.command == "migrate":
+        print(f"migrated {migrate(batch_size=args.batch_size)} rows")
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    main()
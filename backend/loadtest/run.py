@@ -0,0 +1,299 @@
+"""
+/api/chat などのエンドツーエンド負荷試験
+
+スタブ（loadtest/stubs.py）を立ててバックエンド（uvicorn）を *_BASE_URL でそこに向け、
+chat / feedback / memory 読み取り / デモユーザーの混在トラフィックを並行で流します。
+終わるとエンドポイントごとのスループットと p50/p95/p99 を表示します。
+
+    cd backend && python -m loadtest.run --duration 30 --concurrency 32
+    cd backend && python -m loadtest.run --anthropic-latency lognormal:1200:0.6 --anthropic-error-rate 0.05
+    cd backend && python -m loadtest.run --mix chat=1 --requests 500 --json result.json
+
+既に動いているバックエンドに流す場合は --target を、スタブだけ立てる場合は --stubs-only を使います
+（--stubs-only はバックエンドに渡す環境変数を表示して待ち続けます）。
+DB は既定で一時ディレクトリの SQLite を使います（--database-url で変更）。
+"""
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from loadtest.stubs import LatencyProfile, StubBehavior, StubConfig, StubServer
+
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+DEFAULT_MIX = "chat=5,feedback=2,memory=3,memory_graph=1,user=1,demo=1"
+_MESSAGES = [
+    "箇条書きで、来週の優先タスクを整理して",
+    "Summarize the pricing experiment results in three bullets",
+    "新しいプロジェクト「EU Launch」を始めます。論点を出して",
+    "データ重視で、解約率の改善案を",
+    "Q3 の OKR を draft して",
+    "カジュアルでいいので、今日のやることを3つ",
+]
+
+
+@dataclass
+class EndpointStats:
+    latencies_ms: List[float] = field(default_factory=list)
+    statuses: Dict[int, int] = field(default_factory=dict)
+    errors: int = 0
+
+    def add(self, elapsed_ms: float, status: int) -> None:
+        self.latencies_ms.append(elapsed_ms)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status == 0 or status >= 400:
+            self.errors += 1
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # nearest-rank
+    rank = max(0, min(len(ordered) - 1, math.ceil(q / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class TrafficDriver:
+    """重み付きで操作を選び、並行ワーカーで流す"""
+
+    def __init__(self, base_url: str, mix: Dict[str, float], users: int, api_key: Optional[str], seed: int = 0):
+        self.base_url = base_url.rstrip("/")
+        self.ops = list(mix)
+        self.weights = [mix[k] for k in self.ops]
+        self.users = [f"lt_user_{i:04d}" for i in range(users)]
+        self.demo_users = [f"demo_lt_{i:02d}" for i in range(max(1, users // 10))]
+        self.headers = {"x-api-key": api_key} if api_key else {}
+        self.rng = random.Random(seed)
+        # ユーザーごとの直近エピソード（feedback の対象）
+        self.episodes: Dict[str, List[str]] = {}
+        self.stats: Dict[str, EndpointStats] = {}
+
+    def _record(self, name: str, elapsed_ms: float, status: int) -> None:
+        self.stats.setdefault(name, EndpointStats()).add(elapsed_ms, status)
+
+    async def _call(self, client: httpx.AsyncClient, name: str, method: str, path: str, **kwargs: Any) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            res = await client.request(method, self.base_url + path, headers=self.headers, **kwargs)
+        except httpx.HTTPError:
+            self._record(name, (time.perf_counter() - start) * 1000.0, 0)
+            return None
+        self._record(name, (time.perf_counter() - start) * 1000.0, res.status_code)
+        return res
+
+    async def _chat(self, client: httpx.AsyncClient, user_id: str, name: str = "POST /api/chat") -> None:
+        res = await self._call(client, name, "POST", "/api/chat", json={"userId": user_id, "message": self.rng.choice(_MESSAGES)})
+        if res is not None and res.status_code == 200:
+            for e in (res.json().get("newMemory") or {}).get("episodes") or []:
+                self.episodes.setdefault(user_id, []).append(e.get("id"))
+                del self.episodes[user_id][:-20]
+
+    async def one(self, client: httpx.AsyncClient) -> None:
+        op = self.rng.choices(self.ops, weights=self.weights)[0]
+        user_id = self.rng.choice(self.users)
+        if op == "chat":
+            await self._chat(client, user_id)
+        elif op == "feedback":
+            known = self.episodes.get(user_id)
+            if not known:
+                await self._chat(client, user_id)
+                return
+            payload = {"userId": user_id, "episodeId": self.rng.choice(known), "rating": self.rng.choice(["like", "dislike"])}
+            await self._call(client, "POST /api/feedback", "POST", "/api/feedback", json=payload)
+        elif op == "memory":
+            params = {"userId": user_id, "fields": "identity,score,episodes.summary", "limit": 20}
+            await self._call(client, "GET /api/memory", "GET", "/api/memory", params=params)
+        elif op == "memory_graph":
+            await self._call(client, "GET /api/memory/graph", "GET", "/api/memory/graph", params={"userId": user_id})
+        elif op == "user":
+            await self._call(client, "GET /api/user/{id}", "GET", f"/api/user/{user_id}", params={"limit": 20})
+        elif op == "demo":
+            demo = self.rng.choice(self.demo_users)
+            if self.rng.random() < 0.5:
+                await self._call(client, "GET /api/memory (demo)", "GET", "/api/memory", params={"userId": demo, "limit": 50})
+            else:
+                await self._chat(client, demo, name="POST /api/chat (demo)")
+        else:
+            raise ValueError(f"unknown operation '{op}'")
+
+    async def run(self, concurrency: int, duration: Optional[float], total: Optional[int]) -> float:
+        deadline = time.perf_counter() + duration if duration else None
+        remaining = [total] if total else None
+
+        async def worker(client: httpx.AsyncClient) -> None:
+            while True:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return
+                if remaining is not None:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                await self.one(client)
+
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(timeout=120.0, limits=limits) as client:
+            start = time.perf_counter()
+            await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+            return time.perf_counter() - start
+
+
+def report(stats: Dict[str, EndpointStats], elapsed: float) -> Dict[str, Any]:
+    rows: Dict[str, Any] = {}
+    total = sum(len(s.latencies_ms) for s in stats.values())
+    print(f"\n{total} requests in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f} req/s)\n")
+    print(f"{'endpoint':<26}{'count':>7}{'err':>6}{'req/s':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses")
+    for name in sorted(stats):
+        s = stats[name]
+        row = {
+            "count": len(s.latencies_ms),
+            "errors": s.errors,
+            "rps": round(len(s.latencies_ms) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(s.latencies_ms, 50), 2),
+            "p95_ms": round(percentile(s.latencies_ms, 95), 2),
+            "p99_ms": round(percentile(s.latencies_ms, 99), 2),
+            "statuses": {str(k): v for k, v in sorted(s.statuses.items())},
+        }
+        rows[name] = row
+        statuses = " ".join(f"{k}:{v}" for k, v in row["statuses"].items())
+        print(
+            f"{name:<26}{row['count']:>7}{row['errors']:>6}{row['rps']:>8.1f}"
+            f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}  {statuses}"
+        )
+    return {"elapsed_s": round(elapsed, 3), "total": total, "endpoints": rows}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_backend(env: Dict[str, str], port: int, workers: int) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    if workers > 1:
+        cmd += ["--workers", str(workers)]
+    return subprocess.Popen(cmd, cwd=str(BACKEND_DIR), env={**os.environ, **env})
+
+
+def wait_ready(base_url: str, proc: Optional[subprocess.Popen], timeout: float = 60.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"backend exited with code {proc.returncode}")
+        try:
+            if httpx.get(f"{base_url}/api/health", timeout=2.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"backend at {base_url} did not become ready in {timeout:.0f}s")
+
+
+def _parse_mix(spec: str) -> Dict[str, float]:
+    mix: Dict[str, float] = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def _stub_config(args: argparse.Namespace) -> StubConfig:
+    return StubConfig(
+        anthropic=StubBehavior(LatencyProfile.parse(args.anthropic_latency), args.anthropic_error_rate, 529),
+        openai=StubBehavior(LatencyProfile.parse(args.openai_latency), args.openai_error_rate, 500),
+        memu=StubBehavior(LatencyProfile.parse(args.memu_latency), args.memu_error_rate, 500),
+        seed=args.seed,
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=20.0, help="秒（--requests 指定時は無視）")
+    parser.add_argument("--requests", type=int, default=0, help="総リクエスト数")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="操作の重み（chat,feedback,memory,memory_graph,user,demo）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--anthropic-latency", default="lognormal:800:0.5")
+    parser.add_argument("--anthropic-error-rate", type=float, default=0.0)
+    parser.add_argument("--openai-latency", default="lognormal:600:0.5")
+    parser.add_argument("--openai-error-rate", type=float, default=0.0)
+    parser.add_argument("--memu-latency", default="uniform:20:80")
+    parser.add_argument("--memu-error-rate", type=float, default=0.0)
+    parser.add_argument("--target", default="", help="既に動いているバックエンドの URL（スタブ・uvicorn を立てない）")
+    parser.add_argument("--stubs-only", action="store_true")
+    parser.add_argument("--stub-port", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn のワーカー数")
+    parser.add_argument("--database-url", default="")
+    parser.add_argument("--api-key", default=os.getenv("API_KEY") or "")
+    parser.add_argument("--json", dest="json_out", default="")
+    args = parser.parse_args(argv)
+
+    mix = _parse_mix(args.mix)
+    stub: Optional[StubServer] = None
+    backend: Optional[subprocess.Popen] = None
+    tmp = tempfile.TemporaryDirectory(prefix="pocketcoo-loadtest-")
+    try:
+        if args.target:
+            base_url = args.target
+        else:
+            stub = StubServer(_stub_config(args), port=args.stub_port).start()
+            env = stub.backend_env()
+            if args.stubs_only:
+                print(f"stubs listening on {stub.url}")
+                for k, v in env.items():
+                    print(f"export {k}={v}")
+                while True:
+                    time.sleep(3600)
+            env["DATABASE_URL"] = args.database_url or f"sqlite:///{Path(tmp.name) / 'loadtest.db'}"
+            if args.api_key:
+                env["API_KEY"] = args.api_key
+            port = _free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            backend = start_backend(env, port, args.workers)
+        wait_ready(base_url, backend)
+
+        driver = TrafficDriver(base_url, mix, args.users, args.api_key or None, seed=args.seed)
+        total = args.requests or None
+        print(f"driving {base_url}: concurrency={args.concurrency} " + (f"requests={total}" if total else f"duration={args.duration}s"))
+        elapsed = asyncio.run(driver.run(args.concurrency, None if total else args.duration, total))
+        result = report(driver.stats, elapsed)
+        if stub is not None:
+            result["stub_calls"] = {f"{svc} {status}": n for (svc, status), n in sorted(stub.config.counts.items())}
+            print("\nstub calls: " + ", ".join(f"{k}={v}" for k, v in result["stub_calls"].items()))
+        if args.json_out:
+            Path(args.json_out).write_text(json.dumps(result, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if backend is not None:
+            backend.terminate()
+            try:
+                backend.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                backend.kill()
+        if stub is not None:
+            stub.stop()
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+負荷試験用のスタブサーバー（Anthropic / OpenAI / memU の代わり）
+
+本物のプロバイダーのクォータを使わずに /api/chat を叩けるよう、同じ形の応答を返す
+HTTP サーバーを標準ライブラリだけで立てます。遅延の分布とエラー率はエンドポイントごとに設定できます。
+
+- POST /v1/messages                     Anthropic Messages API
+- POST /v1/chat/completions             OpenAI Chat Completions（OPENAI_BASE_URL は ``<stub>/v1``）
+- POST /v1/embeddings                   OpenAI Embeddings（mem0 が Qdrant に繋がった場合用）
+- POST /api/v3/memory/{retrieve,memorize,categories}   memU
+
+遅延の指定（ms）:
+
+- ``fixed:50``            常に 50ms
+- ``uniform:20:80``       20〜80ms の一様分布
+- ``lognormal:800:0.5``   中央値 800ms・σ=0.5 の対数正規分布（LLM の裾の重さに近い）
+"""
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+import json
+import math
+import random
+import threading
+import time
+import uuid
+
+
+@dataclass
+class LatencyProfile:
+    kind: str = "fixed"
+    a: float = 0.0
+    b: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyProfile":
+        parts = (spec or "fixed:0").split(":")
+        kind = parts[0].strip().lower()
+        values = [float(p) for p in parts[1:]]
+        if kind == "fixed" and len(values) == 1:
+            return cls(kind, values[0])
+        if kind in ("uniform", "lognormal") and len(values) == 2:
+            return cls(kind, values[0], values[1])
+        raise ValueError(f"invalid latency spec '{spec}' (fixed:MS | uniform:MIN:MAX | lognormal:MEDIAN:SIGMA)")
+
+    def sample_ms(self, rng: random.Random) -> float:
+        if self.kind == "uniform":
+            return rng.uniform(self.a, self.b)
+        if self.kind == "lognormal":
+            return rng.lognormvariate(math.log(max(self.a, 0.001)), self.b)
+        return self.a
+
+
+@dataclass
+class StubBehavior:
+    latency: LatencyProfile = field(default_factory=LatencyProfile)
+    error_rate: float = 0.0
+    # エラー時のステータス（LLM は 529/500、memU は 500 あたりが現実的）
+    error_status: int = 500
+
+
+class StubConfig:
+    """サービスごとの振る舞い。実行中に書き換えてもよい"""
+
+    def __init__(
+        self,
+        anthropic: Optional[StubBehavior] = None,
+        openai: Optional[StubBehavior] = None,
+        memu: Optional[StubBehavior] = None,
+        seed: Optional[int] = None,
+    ):
+        self.behaviors = {
+            "anthropic": anthropic or StubBehavior(LatencyProfile("lognormal", 800, 0.5), error_status=529),
+            "openai": openai or StubBehavior(LatencyProfile("lognormal", 600, 0.5)),
+            "memu": memu or StubBehavior(LatencyProfile("uniform", 20, 80)),
+        }
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts: Dict[Tuple[str, int], int] = {}
+
+    def decide(self, service: str) -> Tuple[float, bool]:
+        behavior = self.behaviors[service]
+        with self._lock:
+            delay = behavior.latency.sample_ms(self._rng) / 1000.0
+            failed = self._rng.random() < behavior.error_rate
+        return delay, failed
+
+    def record(self, service: str, status: int) -> None:
+        with self._lock:
+            self.counts[(service, status)] = self.counts.get((service, status), 0) + 1
+
+
+_REPLIES = [
+    "了解。結論→理由→次アクションで整理します。\n- 現状: 数字を確認\n- 仮説: 2つに絞る\n- 次: 小さく検証",
+    "Here's the plan: 1) measure the baseline 2) ship the smallest change 3) review in a week.",
+    "ポイントは3つです。優先度・依存関係・計測方法を先に決めましょう。",
+]
+
+
+def _anthropic_body(payload: Dict[str, Any], rng: random.Random) -> Dict[str, Any]:
+    text = rng.choice(_REPLIES)
+    return {
+        "id": f"msg_stub_{uuid.uuid4().hex[:16]}",
+        "type": "message",
+        "role": "assistant",
+        "model": payload.get("model") or "stub",
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "usage": {"input_tokens": len(str(payload.get("system") or "")) // 4, "output_tokens": len(text) // 4},
+    }
+
+
+def _openai_body(payload: Dict[str, Any], rng: random.Random) -> Dict[str, Any]:
+    text = rng.choice(_REPLIES)
+    return {
+        "id": f"chatcmpl-stub{uuid.uuid4().hex[:16]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model") or "stub",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 100, "completion_tokens": len(text) // 4, "total_tokens": 100 + len(text) // 4},
+    }
+
+
+def _openai_embeddings_body(payload: Dict[str, Any]) -> Dict[str, Any]:
+    inputs = payload.get("input")
+    if not isinstance(inputs, list):
+        inputs = [inputs]
+    dim = int(payload.get("dimensions") or 1536)
+    data = []
+    for i, text in enumerate(inputs):
+        r = random.Random(str(text))
+        data.append({"object": "embedding", "index": i, "embedding": [r.uniform(-1, 1) for _ in range(dim)]})
+    return {"object": "list", "data": data, "model": payload.get("model") or "stub", "usage": {"prompt_tokens": 0, "total_tokens": 0}}
+
+
+def _memu_body(path: str, payload: Dict[str, Any], rng: random.Random) -> Dict[str, Any]:
+    if path.endswith("/retrieve"):
+        items = [
+            {"content": "ユーザーは箇条書きを好む", "memory_type": "preference"},
+            {"content": "Prefers data-driven answers", "memory_type": "preference"},
+        ]
+        return {"items": items[: rng.randint(0, len(items))]}
+    if path.endswith("/memorize"):
+        return {"task_id": f"task_stub_{uuid.uuid4().hex[:12]}"}
+    if path.endswith("/categories"):
+        return {"categories": [{"name": "preferences", "count": 2}]}
+    return {}
+
+
+def _route(path: str) -> Optional[str]:
+    if path == "/v1/messages":
+        return "anthropic"
+    if path in ("/v1/chat/completions", "/v1/embeddings"):
+        return "openai"
+    if path.startswith("/api/v3/memory/"):
+        return "memu"
+    return None
+
+
+def _make_handler(config: StubConfig):
+    rng = random.Random()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format: str, *args: Any) -> None:  # noqa: A002 - 基底クラスの引数名
+            return
+
+        def _send(self, status: int, body: Dict[str, Any]) -> None:
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self) -> None:  # noqa: N802 - http.server の規約
+            path = self.path.split("?", 1)[0]
+            length = int(self.headers.get("content-length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            service = _route(path)
+            if service is None:
+                config.record("unknown", 404)
+                self._send(404, {"error": f"no stub for {path}"})
+                return
+            try:
+                payload = json.loads(raw or b"{}")
+            except ValueError:
+                payload = {}
+            delay, failed = config.decide(service)
+            time.sleep(delay)
+            if failed:
+                status = config.behaviors[service].error_status
+                config.record(service, status)
+                self._send(status, {"type": "error", "error": {"type": "stub_error", "message": "injected failure"}})
+                return
+            if service == "anthropic":
+                body = _anthropic_body(payload, rng)
+            elif path == "/v1/embeddings":
+                body = _openai_embeddings_body(payload)
+            elif service == "openai":
+                body = _openai_body(payload, rng)
+            else:
+                body = _memu_body(path, payload, rng)
+            config.record(service, 200)
+            self._send(200, body)
+
+    return Handler
+
+
+class StubServer:
+    """バックグラウンドスレッドで動くスタブ。3 サービスを 1 ポートでまとめて受ける"""
+
+    def __init__(self, config: Optional[StubConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or StubConfig()
+        self.httpd = ThreadingHTTPServer((host, port), _make_handler(self.config))
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="loadtest-stub", daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def backend_env(self) -> Dict[str, str]:
+        """バックエンドをこのスタブに向ける環境変数（既存の *_BASE_URL をそのまま使う）
+
+        .env に *_BACKUP があるとエラー注入やヘッジで本物のプロバイダーに流れるため、
+        バックアップ側もすべてスタブに向ける。
+        """
+        return {
+            "CHAT_LLM_PROVIDER": "anthropic",
+            "ANTHROPIC_API_KEY": "sk-ant-loadtest",
+            "ANTHROPIC_BASE_URL": self.url,
+            "ANTHROPIC_API_KEY_BACKUP": "sk-ant-loadtest-backup",
+            "ANTHROPIC_BASE_URL_BACKUP": self.url,
+            "OPENAI_API_KEY": "sk-loadtest",
+            "OPENAI_BASE_URL": f"{self.url}/v1",
+            "OPENAI_API_KEY_BACKUP": "sk-loadtest-backup",
+            "OPENAI_BASE_URL_BACKUP": f"{self.url}/v1",
+            "MEMUU_API_KEY": "memu-loadtest",
+            "MEMUU_BASE_URL": self.url,
+        }
+
+    def start(self) -> "StubServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
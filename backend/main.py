@@ -1,9 +1,12 @@
-from fastapi import FastAPI
+import time
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from api import health, chat, memory, feedback, user, memuu
-from db.base import Base
-from db.session import engine
-import db.models
+from api import health, chat, memory, feedback, user, memuu, metrics
+from core.metrics import HTTP_REQUEST_SECONDS
+from core.profiling import ProfilingMiddleware
+from core.serialization import FastJSONResponse
+from core.dependencies import get_memu_service
 import os
 from pathlib import Path
 from dotenv import dotenv_values
@@ -41,10 +44,14 @@ _load_project_env()
 app = FastAPI(
     title="PersonalOS API",
     description="AI Memory Companion Backend",
-    version="0.1.0"
+    version="0.1.0",
+    default_response_class=FastJSONResponse,
 )
 
-Base.metadata.create_all(bind=engine)
+# テーブル作成は最初の DB アクセス時（core.dependencies.get_db）に行う。
+# mem0 の初期化はバックグラウンドで始め、import とリクエストをブロックしない（MEM0_WARMUP=0 で初回利用時まで遅延）
+if (os.getenv("MEM0_WARMUP") or "1").strip().lower() not in ("0", "false", "no"):
+    get_memu_service().start_warmup()
 
 # CORS設定
 cors_origins = os.getenv("CORS_ORIGINS", "http://localhost:3000,http://localhost:3001")
@@ -57,6 +64,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# X-Profile ヘッダー（PROFILE_ADMIN_KEY）か PROFILE_SAMPLE_RATE で選ばれたリクエストだけプロファイルする
+app.add_middleware(ProfilingMiddleware)
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status,
+        )
+
 # ルーター登録
 app.include_router(health.router, prefix="/api/health", tags=["health"])
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
@@ -64,6 +91,7 @@ app.include_router(memory.router, prefix="/api/memory", tags=["memory"])
 app.include_router(feedback.router, prefix="/api/feedback", tags=["feedback"])
 app.include_router(user.router, prefix="/api/user", tags=["user"])
 app.include_router(memuu.router, prefix="/api/memuu", tags=["memuu"])
+app.include_router(metrics.router, prefix="/metrics", tags=["metrics"])
 
 @app.get("/")
 async def root():
@@ -19,6 +19,7 @@ class ChatResponse(BaseModel):
     response: str
     memories_used: List[Dict]
     memory_count: int
+    degraded: List[str] = Field(default_factory=list)  # 締め切りが近くて飛ばした段階
 
 
 class PocketChatRequest(BaseModel):
@@ -33,3 +34,4 @@ class PocketChatResponse(BaseModel):
     newMemory: Dict[str, Any]
     score: int
     scoreDelta: int
+    degraded: List[str] = Field(default_factory=list)
@@ -13,6 +13,7 @@ class UserIdentity(BaseModel):
     style: Dict[str, Any] = Field(default_factory=dict)
     preferences: List[UserIdentityPreference] = Field(default_factory=list)
     updated_at: Optional[str] = None
+    profile: Dict[str, Any] = Field(default_factory=dict)
 
 
 class UserProject(BaseModel):
@@ -51,3 +52,30 @@ class UserState(BaseModel):
     projects: List[UserProject] = Field(default_factory=list)
     episodes: List[UserEpisode] = Field(default_factory=list)
     score: int = 0
+
+
+class UserStateView(BaseModel):
+    """GET 用。fields= で絞り込まれたフィールドは返さない（exclude_unset で出力する）"""
+
+    model_config = ConfigDict(populate_by_name=True, ser_json_by_alias=True)
+
+    user_id: str = Field(alias="userId", validation_alias="userId", serialization_alias="userId")
+    identity: Optional[UserIdentity] = None
+    projects: Optional[List[UserProject]] = None
+    episodes: Optional[List[UserEpisode]] = None
+    score: Optional[int] = None
+    episode_count: Optional[int] = Field(default=None, alias="episodeCount", serialization_alias="episodeCount")
+    next_cursor: Optional[str] = Field(default=None, alias="nextCursor", serialization_alias="nextCursor")
+
+
+class UserStatePatchResponse(BaseModel):
+    """PATCH の応答。全エピソードは返さず、変更したものだけを返す"""
+
+    model_config = ConfigDict(populate_by_name=True)
+
+    user_id: str = Field(alias="userId", validation_alias="userId", serialization_alias="userId")
+    identity: UserIdentity = Field(default_factory=UserIdentity)
+    projects: List[UserProject] = Field(default_factory=list)
+    episodes: List[UserEpisode] = Field(default_factory=list)
+    episode_count: int = Field(default=0, serialization_alias="episodeCount")
+    score: int = 0
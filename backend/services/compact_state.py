@@ -0,0 +1,235 @@
+"""
+読み取り用のコンパクトな state 表現
+
+デコードした state はエピソードごとに 15 キーの dict を持ち、埋め込みは 96 個の int の
+リストになるため、1 万エピソードのユーザーを 1 人メモリに置くだけで数十 MB になります。
+CompactState はこれを
+
+- エピソード: __slots__ の EpisodeRecord（キーごとの dict を持たない）
+- tags / topics / type / embedding_model / memory_used: sys.intern した文字列のタプル
+- 埋め込み: ユーザーごとに 1 本の array('b')（行 = エピソード、int8 のまま連続して持つ）
+- identity / projects / その他のキー: エンコード済みのバイト列（取り出すたびに新しいコピー）
+
+で持ちます。API の境界では to_state / project で従来と同じ JSON の形に戻します。
+書き込みは従来どおり dict の state に対して行い、CompactState は読み取り専用です。
+"""
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import sys
+
+from core import serialization
+
+
+_MISSING: Any = object()
+
+# エピソードのキー（embedding は行番号で持つので含めない）。to_state はこの順で dict を作る
+EPISODE_FIELDS = (
+    "id",
+    "date",
+    "type",
+    "user_message",
+    "assistant_message",
+    "memory_used",
+    "summary",
+    "learnings",
+    "feedback",
+    "tags",
+    "topics",
+    "embedding_dim",
+    "embedding_model",
+    "embedding_at",
+)
+_INTERNED_STR = ("type", "embedding_model")
+_INTERNED_LIST = ("memory_used", "tags", "topics")
+_NESTED = ("learnings", "feedback")
+_SLOTTED = frozenset(EPISODE_FIELDS)
+_EPISODE_KEYS = EPISODE_FIELDS[:11] + ("embedding",) + EPISODE_FIELDS[11:]
+_KNOWN = _SLOTTED | {"embedding"}
+_STATE_SECTIONS = ("userId", "identity", "projects", "episodes", "score")
+
+
+def _intern_all(values: Any) -> Tuple[str, ...]:
+    if not values:
+        return ()
+    return tuple(sys.intern(v) if isinstance(v, str) else v for v in values)
+
+
+def _copy_json(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _copy_json(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_copy_json(v) for v in value]
+    return value
+
+
+class EpisodeRecord:
+    """1 エピソード分。無いキーは _MISSING、embedding は CompactState の行番号 row（無ければ -1）"""
+
+    __slots__ = EPISODE_FIELDS + ("row", "extra")
+
+    def __init__(self, episode: Dict[str, Any], row: int):
+        for key in EPISODE_FIELDS:
+            value = episode.get(key, _MISSING)
+            if value is not _MISSING:
+                if key in _INTERNED_STR and isinstance(value, str):
+                    value = sys.intern(value)
+                elif key in _INTERNED_LIST and isinstance(value, list):
+                    value = _intern_all(value)
+                elif key in _NESTED and value:
+                    value = _copy_json(value)
+            setattr(self, key, value)
+        self.row = row
+        extra = {k: _copy_json(v) for k, v in episode.items() if k not in _KNOWN}
+        if row < 0 and "embedding" in episode:
+            extra["embedding"] = _copy_json(episode["embedding"])
+        self.extra = extra or None
+
+
+class CompactState:
+    def __init__(self, user_id: Optional[str], dim: int):
+        self.user_id = user_id
+        self.dim = dim
+        self.score = 0
+        self.episodes: List[EpisodeRecord] = []
+        self.embeddings = array("b")
+        self._identity = b"{}"
+        self._projects = b"[]"
+        self._meta: Optional[bytes] = None
+        self._index: Dict[str, int] = {}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "CompactState":
+        episodes: List[Dict[str, Any]] = state.get("episodes") or []
+        dim = next((len(e["embedding"]) for e in episodes if e.get("embedding")), 0)
+        compact = cls(state.get("userId"), dim)
+        compact.score = int(state.get("score") or 0)
+        compact._identity = serialization.dumps_bytes(state.get("identity") or {})
+        compact._projects = serialization.dumps_bytes(state.get("projects") or [])
+        meta = {k: v for k, v in state.items() if k not in _STATE_SECTIONS}
+        compact._meta = serialization.dumps_bytes(meta) if meta else None
+        for episode in episodes:
+            compact.append(episode)
+        return compact
+
+    def append(self, episode: Dict[str, Any]) -> EpisodeRecord:
+        row = -1
+        vec = episode.get("embedding")
+        if isinstance(vec, list) and vec and len(vec) == self.dim:
+            try:
+                self.embeddings.extend(vec)
+                row = len(self.embeddings) // self.dim - 1
+            except (OverflowError, TypeError):
+                # int8 に収まらない・int でない（古いデータ）なら行にせず extra に残す
+                del self.embeddings[len(self.embeddings) - len(self.embeddings) % self.dim:]
+        record = EpisodeRecord(episode, row)
+        if isinstance(record.id, str):
+            self._index[sys.intern(record.id)] = len(self.episodes)
+        self.episodes.append(record)
+        return record
+
+    def __len__(self) -> int:
+        return len(self.episodes)
+
+    def packed_bytes(self) -> int:
+        """埋め込み行列とエンコード済みセクションのバイト数（エピソードの文字列は含まない）"""
+        return len(self.embeddings) + len(self._identity) + len(self._projects) + len(self._meta or b"")
+
+    def embedding(self, i: int) -> Optional[memoryview]:
+        """i 番目のエピソードの埋め込み（コピーしない int8 のビュー）"""
+        row = self.episodes[i].row
+        if row < 0:
+            return None
+        return memoryview(self.embeddings)[row * self.dim:(row + 1) * self.dim]
+
+    def index_of(self, episode_id: str) -> Optional[int]:
+        return self._index.get(episode_id)
+
+    def _value(self, record: EpisodeRecord, key: str) -> Any:
+        if key in _SLOTTED:
+            value = getattr(record, key)
+            if key in _INTERNED_LIST and isinstance(value, tuple):
+                return list(value)
+            return _copy_json(value) if key in _NESTED and value else value
+        if key == "embedding" and record.row >= 0:
+            return self.embeddings[record.row * self.dim:(record.row + 1) * self.dim].tolist()
+        if record.extra and key in record.extra:
+            return _copy_json(record.extra[key])
+        return _MISSING
+
+    def episode(self, i: int, keys: Optional[Sequence[str]] = None, include_embedding: bool = True) -> Dict[str, Any]:
+        """i 番目のエピソードを JSON の形（新しい dict）で返す。keys 指定時はそのキーだけ（slim_episode と同じ）"""
+        record = self.episodes[i]
+        if keys is None:
+            keys = _EPISODE_KEYS if include_embedding else EPISODE_FIELDS
+            if record.extra:
+                keys = keys + tuple(k for k in record.extra if include_embedding or k != "embedding")
+        out: Dict[str, Any] = {}
+        for key in keys:
+            value = self._value(record, key)
+            if value is not _MISSING:
+                out[key] = value
+        return out
+
+    def iter_episodes(self, include_embedding: bool = True) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self.episodes)):
+            yield self.episode(i, include_embedding=include_embedding)
+
+    def identity(self) -> Dict[str, Any]:
+        return serialization.loads(self._identity)
+
+    def projects(self) -> List[Dict[str, Any]]:
+        return serialization.loads(self._projects)
+
+    def meta(self) -> Dict[str, Any]:
+        return serialization.loads(self._meta) if self._meta is not None else {}
+
+    def to_state(self) -> Dict[str, Any]:
+        """従来の dict の state（呼び出し側が書き換えてよい新しいコピー）"""
+        return {
+            "userId": self.user_id,
+            "identity": self.identity(),
+            "projects": self.projects(),
+            "episodes": list(self.iter_episodes()),
+            "score": self.score,
+            **self.meta(),
+        }
+
+    def project(
+        self,
+        fields: Optional[Dict[str, Optional[List[str]]]] = None,
+        limit: Optional[int] = None,
+        before: Optional[str] = None,
+        include_embeddings: bool = False,
+    ) -> Dict[str, Any]:
+        """project_state と同じ結果を、返すページのエピソードだけ展開して作る"""
+        if fields is None:
+            wanted: Dict[str, Optional[List[str]]] = {"episodes": None}
+            out: Dict[str, Any] = {"userId": self.user_id, "identity": self.identity(), "projects": self.projects(), "score": self.score, **self.meta()}
+        else:
+            wanted = fields
+            out = {"userId": self.user_id}
+            if "identity" in wanted:
+                out["identity"] = self.identity()
+            if "projects" in wanted:
+                out["projects"] = self.projects()
+            if "score" in wanted:
+                out["score"] = self.score
+
+        if "episodes" in wanted:
+            total = len(self.episodes)
+            out["episodeCount"] = total
+            keys = wanted.get("episodes")
+            if limit is None and before is None:
+                indices: Sequence[int] = range(total)
+            else:
+                end = total
+                if before is not None:
+                    end = self.index_of(before)
+                    if end is None:
+                        raise ValueError(f"unknown cursor '{before}'")
+                start = 0 if limit is None else max(0, end - limit)
+                indices = range(end - 1, start - 1, -1)
+                cursor = self.episodes[start].id if start > 0 and indices else None
+                out["nextCursor"] = None if cursor is _MISSING else cursor
+            out["episodes"] = [self.episode(i, keys, include_embeddings) for i in indices]
+        return out
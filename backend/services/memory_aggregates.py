@@ -0,0 +1,193 @@
+"""
+ユーザーごとの集計（トピック/タグの件数）とエピソード類似グラフ
+
+space ページや MemoryMap が全エピソードを取得してブラウザで数え直さなくて済むよう、
+apply_turn のたびに差分で更新し、user_aggregates テーブルにキャッシュします。
+
+グラフは直近 GRAPH_MAX_NODES 件のエピソードを対象に、保存済みの埋め込み
+（int8 ハッシュ埋め込み）のコサイン類似度で上位 k 件の近傍を持ちます。
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import math
+import operator
+
+
+GRAPH_K = 5
+GRAPH_MAX_NODES = 300
+# これ未満の類似度は辺にしない（ハッシュ埋め込みのノイズ対策）
+GRAPH_MIN_SIMILARITY = 0.05
+_SUMMARY_CHARS = 80
+
+
+def _norm(vec: List[int]) -> float:
+    return math.sqrt(sum(v * v for v in vec)) or 1.0
+
+
+def _cosine(a: List[int], a_norm: float, b: List[int], b_norm: float) -> float:
+    return sum(map(operator.mul, a, b)) / (a_norm * b_norm)
+
+
+def _node_meta(episode: Dict[str, Any]) -> Dict[str, Any]:
+    summary = episode.get("summary") or ""
+    return {
+        "id": episode.get("id"),
+        "date": episode.get("date"),
+        "summary": summary[:_SUMMARY_CHARS],
+        "tags": list(episode.get("tags") or []),
+    }
+
+
+def _graph_episodes(episodes: List[Dict[str, Any]], model: Optional[str]) -> List[Dict[str, Any]]:
+    """グラフ対象（同じ埋め込みモデルを持つ直近のエピソード）"""
+    out = [e for e in episodes if e.get("embedding") and e.get("embedding_model") == model]
+    return out[-GRAPH_MAX_NODES:]
+
+
+def _top_k(
+    target: Dict[str, Any],
+    candidates: Iterable[Tuple[Dict[str, Any], float]],
+    k: int,
+) -> List[List[Any]]:
+    vec = target["embedding"]
+    vec_norm = _norm(vec)
+    scored: List[Tuple[float, str]] = []
+    for other, other_norm in candidates:
+        if other.get("id") == target.get("id"):
+            continue
+        sim = _cosine(vec, vec_norm, other["embedding"], other_norm)
+        if sim >= GRAPH_MIN_SIMILARITY:
+            scored.append((sim, other.get("id")))
+    scored.sort(key=lambda x: (-x[0], x[1]))
+    return [[ep_id, round(sim, 4)] for sim, ep_id in scored[:k]]
+
+
+def _count(counter: Dict[str, int], values: Iterable[Any]) -> None:
+    for v in values:
+        key = str(v or "").strip()
+        if key:
+            counter[key] = counter.get(key, 0) + 1
+
+
+def _latest_model(episodes: List[Dict[str, Any]]) -> Optional[str]:
+    for e in reversed(episodes):
+        if e.get("embedding_model"):
+            return e["embedding_model"]
+    return None
+
+
+def build_aggregates(state: Dict[str, Any], k: int = GRAPH_K) -> Dict[str, Any]:
+    """state 全体から集計とグラフを作り直す"""
+    episodes: List[Dict[str, Any]] = state.get("episodes") or []
+    topics: Dict[str, int] = {}
+    tags: Dict[str, int] = {}
+    for e in episodes:
+        _count(topics, e.get("topics") or [])
+        _count(tags, e.get("tags") or [])
+
+    model = _latest_model(episodes)
+    nodes = _graph_episodes(episodes, model)
+    with_norms = [(e, _norm(e["embedding"])) for e in nodes]
+    neighbors = {e.get("id"): _top_k(e, with_norms, k) for e in nodes}
+    return {
+        "episodeCount": len(episodes),
+        "topics": topics,
+        "tags": tags,
+        "graph": {
+            "k": k,
+            "model": model,
+            "nodes": [_node_meta(e) for e in nodes],
+            "neighbors": neighbors,
+        },
+    }
+
+
+def add_episode(aggregates: Dict[str, Any], state: Dict[str, Any], episode: Dict[str, Any]) -> Dict[str, Any]:
+    """追加された 1 エピソード分だけ集計とグラフを更新する
+
+    state は episode を追加した後のもの。埋め込みモデルが変わった場合は作り直す。
+    """
+    graph = aggregates.setdefault("graph", {})
+    k = int(graph.get("k") or GRAPH_K)
+    if episode.get("embedding_model") != graph.get("model") and episode.get("embedding"):
+        return build_aggregates(state, k=k)
+
+    aggregates["episodeCount"] = int(aggregates.get("episodeCount") or 0) + 1
+    _count(aggregates.setdefault("topics", {}), episode.get("topics") or [])
+    _count(aggregates.setdefault("tags", {}), episode.get("tags") or [])
+    if not episode.get("embedding"):
+        return aggregates
+
+    nodes: List[Dict[str, Any]] = graph.setdefault("nodes", [])
+    neighbors: Dict[str, List[List[Any]]] = graph.setdefault("neighbors", {})
+    nodes.append(_node_meta(episode))
+    evicted = {n["id"] for n in nodes[:-GRAPH_MAX_NODES]}
+    del nodes[:-GRAPH_MAX_NODES]
+    for ep_id in evicted:
+        neighbors.pop(ep_id, None)
+
+    node_ids = {n["id"] for n in nodes}
+    by_id = {e.get("id"): e for e in _graph_episodes(state.get("episodes") or [], graph.get("model"))}
+    if not node_ids.issubset(by_id):
+        # キャッシュと state がずれている（PATCH などで消された）場合は作り直す
+        return build_aggregates(state, k=k)
+    norms = {i: _norm(by_id[i]["embedding"]) for i in node_ids}
+    with_norms = [(by_id[i], norms[i]) for i in node_ids]
+
+    new_id = episode.get("id")
+    new_norm = _norm(episode["embedding"])
+    neighbors[new_id] = _top_k(episode, with_norms, k)
+
+    for node_id in node_ids:
+        if node_id == new_id:
+            continue
+        current = neighbors.get(node_id) or []
+        if any(n[0] in evicted for n in current):
+            neighbors[node_id] = _top_k(by_id[node_id], with_norms, k)
+            continue
+        other = by_id[node_id]
+        sim = _cosine(episode["embedding"], new_norm, other["embedding"], norms[node_id])
+        if sim < GRAPH_MIN_SIMILARITY:
+            continue
+        if len(current) < k or sim > current[-1][1]:
+            current.append([new_id, round(sim, 4)])
+            current.sort(key=lambda x: (-x[1], x[0]))
+            neighbors[node_id] = current[:k]
+    return aggregates
+
+
+def summarize(aggregates: Dict[str, Any], top: int = 20, max_nodes: Optional[int] = None) -> Dict[str, Any]:
+    """API 応答用の compact な形に変換する"""
+
+    def ranked(counter: Dict[str, int]) -> List[Dict[str, Any]]:
+        items = sorted(counter.items(), key=lambda kv: (-kv[1], kv[0]))[:top]
+        return [{"name": k, "count": v} for k, v in items]
+
+    graph = aggregates.get("graph") or {}
+    nodes = graph.get("nodes") or []
+    if max_nodes is not None:
+        nodes = nodes[-max_nodes:]
+    node_ids = {n["id"] for n in nodes}
+    neighbors = graph.get("neighbors") or {}
+    edges: List[Dict[str, Any]] = []
+    seen = set()
+    for source in node_ids:
+        for target, sim in neighbors.get(source) or []:
+            if target not in node_ids:
+                continue
+            key = (source, target) if source < target else (target, source)
+            if key in seen:
+                continue
+            seen.add(key)
+            edges.append({"source": key[0], "target": key[1], "similarity": sim})
+    edges.sort(key=lambda e: (-e["similarity"], e["source"], e["target"]))
+    return {
+        "episodeCount": int(aggregates.get("episodeCount") or 0),
+        "topics": ranked(aggregates.get("topics") or {}),
+        "tags": ranked(aggregates.get("tags") or {}),
+        "graph": {
+            "k": graph.get("k"),
+            "model": graph.get("model"),
+            "nodes": nodes,
+            "edges": edges,
+        },
+    }
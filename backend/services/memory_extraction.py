@@ -0,0 +1,56 @@
+"""
+返信と記憶抽出を 1 回の LLM 呼び出しで行う（CHAT_INLINE_EXTRACTION=1）
+
+通常の /api/chat/message は返信の LLM 呼び出しの後、memu.add_memory で mem0 が会話全文から
+事実を抽出する LLM 呼び出し・更新判定の LLM 呼び出し・埋め込みを直列に行います。
+このモードでは返信と一緒に「覚えておくべき事実」を JSON で返させ、事実はまとめて 1 回で
+埋め込んでベクトルストアへ直接書き込みます（MemUService.add_facts）。
+
+LLM が JSON を返さなかった場合は返信テキストをそのまま使い、従来どおり add_memory に回します。
+"""
+from typing import List, Optional, Tuple
+import json
+import os
+import re
+
+
+MAX_FACTS = 8
+MAX_FACT_CHARS = 200
+
+INSTRUCTIONS = """
+## 出力形式
+必ず次の JSON オブジェクトだけを返してください（前後に文章やコードフェンスを付けない）。
+{"reply": "ユーザーへの返信（マークダウン可）", "facts": ["今回の発言から分かった、今後も覚えておくべきユーザーの事実・好み・予定"]}
+- facts は 1 件 1 文、最大 8 件。新しい事実が無ければ空配列
+- 挨拶や一時的な依頼内容そのものは facts に入れない
+"""
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+
+
+def inline_extraction_enabled() -> bool:
+    return (os.getenv("CHAT_INLINE_EXTRACTION") or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def parse_reply_with_facts(text: str) -> Tuple[str, Optional[List[str]]]:
+    """(reply, facts) を返す。JSON として読めなければ (text, None)"""
+    raw = _FENCE.sub("", (text or "").strip())
+    start, end = raw.find("{"), raw.rfind("}")
+    if start < 0 or end <= start:
+        return text, None
+    try:
+        data = json.loads(raw[start : end + 1])
+    except ValueError:
+        return text, None
+    if not isinstance(data, dict) or not isinstance(data.get("reply"), str):
+        return text, None
+    facts: List[str] = []
+    seen = set()
+    for fact in data.get("facts") or []:
+        if not isinstance(fact, str):
+            continue
+        fact = " ".join(fact.split())[:MAX_FACT_CHARS]
+        if fact and fact not in seen:
+            seen.add(fact)
+            facts.append(fact)
+    return data["reply"].strip(), facts[:MAX_FACTS]
@@ -1,9 +1,49 @@
-from mem0 import Memory
-from typing import List, Dict, Optional
+from typing import Any, Collection, List, Dict, Optional, Tuple
+import hashlib
 import os
+import threading
+import time
 from datetime import datetime
 import uuid
-import httpx
+
+from core import deadline, metrics
+from core.singleflight import SingleFlight, WaitTimeout
+
+
+# mem0 の初期化状態（/api/health/ready で公開する）
+MEM0_PENDING = "pending"
+MEM0_INITIALIZING = "initializing"
+MEM0_READY = "ready"
+MEM0_FALLBACK = "fallback"
+
+
+def _httpx():
+    # httpx / mem0 / openai は import が重いので、コールドスタートでは読み込まない
+    import httpx
+
+    return httpx
+
+
+def __getattr__(name: str) -> Any:
+    # 既存コード・テストの ``memu_service.httpx`` 参照用
+    if name == "httpx":
+        return _httpx()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _init_wait() -> float:
+    """初期化中の mem0 をリクエストが待つ最大秒数。超えたらその操作はフォールバックで処理する"""
+    return float(os.getenv("MEM0_INIT_WAIT") or "10")
+
+
+def content_hash(text: str) -> str:
+    """memU の記憶の内容ハッシュ（前後の空白は無視）。適用済みかどうかの判定に使う"""
+    return hashlib.blake2b(text.strip().encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _fact_dedupe_similarity() -> float:
+    """既存の記憶とのコサイン類似度がこれ以上なら add_facts で同じ事実とみなして保存しない"""
+    return float(os.getenv("FACT_DEDUPE_SIMILARITY") or "0.95")
 
 
 def _env_api_key(name: str) -> Optional[str]:
@@ -32,10 +72,23 @@ class MemUService:
     """
 
     def __init__(self):
-        """memUを初期化"""
-        self._fallback_enabled = False
+        """memUを初期化
+
+        mem0（Qdrant・OpenAI 埋め込み）には接続しません。start_warmup() でバックグラウンド初期化を
+        始めるか、最初に mem0 が必要になった操作で初期化されます。
+        """
+        self.memory = None
+        self._mem0_state = MEM0_PENDING
+        self._mem0_error: Optional[str] = None
+        self._mem0_init_seconds: Optional[float] = None
+        self._mem0_lock = threading.Lock()
+        self._mem0_done = threading.Event()
         self._fallback_store: Dict[str, List[Dict]] = {}
+        # 初期化待ちでフォールバックに書いた記憶 (種類, user_id, item)。mem0 が READY になったら書き直す
+        self._replay: List[Tuple[str, str, Dict]] = []
+        self._replay_lock = threading.Lock()
         self._conversation_buffer: Dict[str, List[Dict]] = {}
+        self._retrievals: SingleFlight[List[Dict]] = SingleFlight()
 
         self._memuu_api_key = None
         self._memuu_base_url = "https://api.memu.so"
@@ -87,11 +140,89 @@ class MemUService:
             "version": "v1.1"
         }
 
+    @property
+    def _fallback_enabled(self) -> bool:
+        return self._mem0_state == MEM0_FALLBACK
+
+    def start_warmup(self) -> None:
+        """mem0 の初期化をバックグラウンドスレッドで始める（二重には起動しない）"""
+        with self._mem0_lock:
+            if self._mem0_state != MEM0_PENDING:
+                return
+            self._mem0_state = MEM0_INITIALIZING
+        threading.Thread(target=self._init_memory, name="mem0-warmup", daemon=True).start()
+
+    def _init_memory(self) -> None:
+        start = time.perf_counter()
         try:
-            self.memory = Memory.from_config(self.config)
-        except Exception:
-            self._fallback_enabled = True
-            self.memory = None
+            if not self.config["llm"]["config"]["api_key"]:
+                # キーが無ければ mem0 は使えないので、import も接続もせずにフォールバックへ
+                raise RuntimeError("OPENAI_API_KEY is not set")
+            from mem0 import Memory
+
+            memory = Memory.from_config(self.config)
+        except Exception as e:
+            self._mem0_error = f"{type(e).__name__}: {e}"[:300]
+            self._mem0_state = MEM0_FALLBACK
+        else:
+            self.memory = memory
+            with self._replay_lock:
+                self._mem0_state = MEM0_READY
+                pending, self._replay = self._replay, []
+        finally:
+            self._mem0_init_seconds = round(time.perf_counter() - start, 3)
+            self._mem0_done.set()
+        if self._mem0_state == MEM0_READY:
+            self._replay_into_mem0(pending)
+        else:
+            # 本当にフォールバックになった場合は、フォールバックの記憶がそのまま正になる
+            with self._replay_lock:
+                self._replay = []
+
+    def _store_fallback(self, kind: str, user_id: str, items: List[Dict]) -> None:
+        """フォールバックに書く。初期化待ちのタイムアウトで書いたものは mem0 の準備ができたら書き直す"""
+        self._fallback_store.setdefault(user_id, []).extend(items)
+        if self._mem0_state == MEM0_FALLBACK:
+            return
+        with self._replay_lock:
+            ready = self._mem0_state == MEM0_READY
+            if not ready:
+                self._replay.extend((kind, user_id, item) for item in items)
+        if ready:
+            # 書いている間に初期化が終わった
+            self._replay_into_mem0([(kind, user_id, item) for item in items])
+
+    def _replay_into_mem0(self, pending: List[Tuple[str, str, Dict]]) -> None:
+        for kind, user_id, item in pending:
+            store = self._fallback_store.get(user_id) or []
+            if not any(m is item for m in store):
+                continue  # 初期化待ちの間に削除された
+            try:
+                if kind == "facts":
+                    self.add_facts([item["memory"]], user_id=user_id, metadata=item.get("metadata"))
+                else:
+                    self.add_memory(item["memory"], user_id=user_id, metadata=item.get("metadata"))
+            except Exception:
+                metrics.MEMU_ERRORS.inc(operation="mem0_replay")
+                continue
+            self._fallback_store[user_id] = [m for m in store if m is not item]
+
+    def _mem0(self) -> Optional[Any]:
+        """使える mem0 の Memory を返す。初期化中なら MEM0_INIT_WAIT 秒（締め切りが近ければその残り）まで待ち、だめなら None"""
+        if self._mem0_state == MEM0_READY:
+            return self.memory
+        self.start_warmup()
+        self._mem0_done.wait(deadline.timeout(_init_wait()))
+        return self.memory if self._mem0_state == MEM0_READY else None
+
+    def readiness(self) -> Dict[str, Any]:
+        state = self._mem0_state
+        return {
+            "ready": state in (MEM0_READY, MEM0_FALLBACK),
+            "mem0": state,
+            "mem0_error": self._mem0_error,
+            "mem0_init_seconds": self._mem0_init_seconds,
+        }
 
     def _current_memuu_api_key(self) -> Optional[str]:
         return os.getenv("MEMUU_API_KEY") or os.getenv("MEMU_API_KEY") or self._memuu_api_key
@@ -119,17 +250,25 @@ class MemUService:
 
     def _memuu_post(self, path: str, payload: Dict) -> Dict:
         url = f"{self._current_memuu_base_url()}{path}"
-        with httpx.Client(timeout=10.0) as client:
-            res = client.post(url, headers=self._memuu_headers(), json=payload)
-            res.raise_for_status()
-            return res.json()
+        try:
+            with _httpx().Client(timeout=deadline.timeout(10.0)) as client:
+                res = client.post(url, headers=self._memuu_headers(), json=payload)
+                res.raise_for_status()
+                return res.json()
+        except Exception:
+            metrics.MEMU_ERRORS.inc(operation=path)
+            raise
 
     def _memuu_get(self, path: str) -> Dict:
         url = f"{self._current_memuu_base_url()}{path}"
-        with httpx.Client(timeout=10.0) as client:
-            res = client.get(url, headers=self._memuu_headers())
-            res.raise_for_status()
-            return res.json()
+        try:
+            with _httpx().Client(timeout=deadline.timeout(10.0)) as client:
+                res = client.get(url, headers=self._memuu_headers())
+                res.raise_for_status()
+                return res.json()
+        except Exception:
+            metrics.MEMU_ERRORS.inc(operation=path)
+            raise
 
     def memorize_conversation(
         self,
@@ -155,23 +294,51 @@ class MemUService:
         result = self._memuu_post("/api/v3/memory/memorize", payload)
         return result.get("task_id")
 
-    def retrieve_memories(self, query: str, user_id: str) -> Optional[List[Dict]]:
+    @metrics.timed_stage("retrieve_memories")
+    def retrieve_memories(
+        self,
+        query: str,
+        user_id: str,
+        skip_hashes: Optional[Collection[str]] = None,
+    ) -> Optional[List[Dict]]:
+        """memU の記憶を検索する。各 item に content_hash を付ける
+
+        skip_hashes を渡すと、その内容ハッシュの記憶（適用済みで変わっていないもの）は返さない
+        （変わったものだけ受け取る軽量モード）。memU 側に差分取得は無いのでここで絞る。
+        """
         if not self._memuu_enabled():
             return None
-        payload = {"user_id": user_id, "agent_id": self._current_memuu_agent_id(), "query": query}
-        result = self._memuu_post("/api/v3/memory/retrieve", payload)
-        items = result.get("items") or []
+        agent_id = self._current_memuu_agent_id()
+        payload = {"user_id": user_id, "agent_id": agent_id, "query": query}
+        # 同じ (agent, user, query) の同時呼び出しは 1 回の memU 呼び出しを共有する。
+        # items は読むだけで、返す dict は呼び出しごとに作る。
+        # 相乗りした側は自分の締め切りまでしか待たず、間に合わなければ記憶なしで続ける
+        remaining = deadline.remaining()
+        try:
+            items = self._retrievals.do(
+                (self._current_memuu_base_url(), agent_id, user_id, query),
+                lambda: self._memuu_post("/api/v3/memory/retrieve", payload).get("items") or [],
+                timeout=None if remaining is None else max(0.0, remaining),
+            )
+        except WaitTimeout:
+            deadline.mark_degraded("memuu_retrieve")
+            return []
         now = datetime.utcnow().isoformat() + "Z"
         mapped: List[Dict] = []
         for it in items:
+            text = it.get("content") or ""
+            digest = content_hash(text)
+            if skip_hashes and digest in skip_hashes:
+                continue
             mapped.append(
                 {
                     "id": f"memuu_{uuid.uuid4().hex[:12]}",
-                    "memory": it.get("content") or "",
+                    "memory": text,
                     "user_id": user_id,
                     "created_at": now,
                     "metadata": {"provider": "memuu", "memory_type": it.get("memory_type")},
                     "score": 1.0,
+                    "content_hash": digest,
                 }
             )
         return mapped
@@ -222,7 +389,9 @@ class MemUService:
             追加された記憶の情報
         """
         try:
-            if self._fallback_enabled:
+            memory = self._mem0()
+            if memory is None:
+                metrics.MEM0_FALLBACK_OPERATIONS.inc(operation="add")
                 memory_id = str(uuid.uuid4())
                 item = {
                     "id": memory_id,
@@ -231,18 +400,115 @@ class MemUService:
                     "created_at": datetime.utcnow().isoformat() + "Z",
                     "metadata": metadata or {}
                 }
-                self._fallback_store.setdefault(user_id, []).append(item)
+                self._store_fallback("add", user_id, [item])
                 return item
 
-            result = self.memory.add(
+            result = memory.add(
                 content,
                 user_id=user_id,
                 metadata=metadata or {}
             )
             return result
         except Exception as e:
+            metrics.MEMU_ERRORS.inc(operation="mem0_add")
             raise Exception(f"Failed to add memory: {str(e)}")
 
+    def _embed_batch(self, memory: Any, texts: List[str]) -> List[List[float]]:
+        """mem0 の埋め込みモデルで texts をまとめて 1 回で埋め込む"""
+        embedder = memory.embedding_model
+        client = getattr(embedder, "client", None)
+        if client is not None and hasattr(client, "embeddings"):
+            inputs = [t.replace("\n", " ") for t in texts]
+            data = client.embeddings.create(input=inputs, model=embedder.config.model).data
+            return [d.embedding for d in sorted(data, key=lambda d: d.index)]
+        return [embedder.embed(t) for t in texts]
+
+    def _new_facts(
+        self, memory: Any, user_id: str, facts: List[str], vectors: List[List[float]]
+    ) -> Tuple[List[str], List[List[float]]]:
+        """add() の更新判定の代わりに、同じ hash か近傍の類似度が高い既存の記憶がある事実を除く"""
+        threshold = _fact_dedupe_similarity()
+        kept_facts: List[str] = []
+        kept_vectors: List[List[float]] = []
+        for fact, vector in zip(facts, vectors):
+            digest = hashlib.md5(fact.encode()).hexdigest()
+            hits = memory.vector_store.search(query=vector, limit=1, filters={"user_id": user_id})
+            hit = hits[0] if hits else None
+            if hit is not None and ((hit.payload or {}).get("hash") == digest or (hit.score or 0.0) >= threshold):
+                metrics.FACTS_DEDUPED.inc()
+                continue
+            kept_facts.append(fact)
+            kept_vectors.append(vector)
+        return kept_facts, kept_vectors
+
+    @metrics.timed_stage("add_facts")
+    def add_facts(
+        self,
+        facts: List[str],
+        user_id: str,
+        metadata: Optional[Dict] = None
+    ) -> List[Dict]:
+        """抽出済みの事実を LLM を通さずに保存する
+
+        mem0 の add() は抽出・更新判定で LLM を 2 回呼ぶが、ここでは埋め込みだけをまとめて計算し、
+        mem0 と同じ payload 形式でベクトルストアに直接書き込む。
+
+        Args:
+            facts: 保存する事実（1 件 1 文）
+            user_id: ユーザーID
+            metadata: メタデータ
+
+        Returns:
+            追加された記憶のリスト
+        """
+        # 同じ呼び出し内の重複は先に落とす
+        facts = list(dict.fromkeys(f.strip() for f in facts if f and f.strip()))
+        if not facts:
+            return []
+        now = datetime.utcnow().isoformat() + "Z"
+        try:
+            memory = self._mem0()
+            if memory is None:
+                metrics.MEM0_FALLBACK_OPERATIONS.inc(operation="add_facts")
+                known = {item.get("memory") for item in self._fallback_store.get(user_id, [])}
+                facts = [f for f in facts if f not in known]
+                items = [
+                    {
+                        "id": str(uuid.uuid4()),
+                        "memory": fact,
+                        "user_id": user_id,
+                        "created_at": now,
+                        "metadata": dict(metadata or {}),
+                    }
+                    for fact in facts
+                ]
+                self._store_fallback("facts", user_id, items)
+                return items
+
+            vectors = self._embed_batch(memory, facts)
+            facts, vectors = self._new_facts(memory, user_id, facts, vectors)
+            if not facts:
+                return []
+            ids = [str(uuid.uuid4()) for _ in facts]
+            payloads = [
+                {
+                    **(metadata or {}),
+                    "user_id": user_id,
+                    "data": fact,
+                    "hash": hashlib.md5(fact.encode()).hexdigest(),
+                    "created_at": now,
+                }
+                for fact in facts
+            ]
+            memory.vector_store.insert(vectors=vectors, ids=ids, payloads=payloads)
+            for memory_id, fact in zip(ids, facts):
+                memory.db.add_history(memory_id, None, fact, "ADD", created_at=now)
+            return [{"id": i, "memory": f, "user_id": user_id, "created_at": now, "metadata": metadata or {}} for i, f in zip(ids, facts)]
+        except Exception as e:
+            metrics.MEMU_ERRORS.inc(operation="mem0_add_facts")
+            raise Exception(f"Failed to add facts: {str(e)}")
+
+    @metrics.timed_stage("search_memories")
     def search_memories(
         self,
         query: str,
@@ -262,7 +528,9 @@ class MemUService:
             検索結果のリスト
         """
         try:
-            if self._fallback_enabled:
+            memory = self._mem0()
+            if memory is None:
+                metrics.MEM0_FALLBACK_OPERATIONS.inc(operation="search")
                 results: List[Dict] = []
                 for item in self._fallback_store.get(user_id, []):
                     text = (item.get("memory") or "")
@@ -277,13 +545,14 @@ class MemUService:
 
             results: List[Dict] = []
             try:
-                results = self.memory.search(
+                results = memory.search(
                     query=query,
                     user_id=user_id,
                     limit=limit,
                     filters=filters
                 )
             except Exception:
+                metrics.MEMU_ERRORS.inc(operation="mem0_search")
                 results = []
 
             try:
@@ -306,10 +575,12 @@ class MemUService:
             全記憶のリスト
         """
         try:
-            if self._fallback_enabled:
+            memory = self._mem0()
+            if memory is None:
+                metrics.MEM0_FALLBACK_OPERATIONS.inc(operation="get_all")
                 return list(self._fallback_store.get(user_id, []))
 
-            memories = self.memory.get_all(user_id=user_id)
+            memories = memory.get_all(user_id=user_id)
             return memories
         except Exception as e:
             raise Exception(f"Failed to get memories: {str(e)}")
@@ -331,7 +602,10 @@ class MemUService:
             更新された記憶の情報
         """
         try:
-            result = self.memory.update(
+            memory = self._mem0()
+            if memory is None:
+                raise RuntimeError("mem0 is not available")
+            result = memory.update(
                 memory_id=memory_id,
                 data=content,
                 metadata=metadata
@@ -350,7 +624,8 @@ class MemUService:
             削除成功したかどうか
         """
         try:
-            if self._fallback_enabled:
+            memory = self._mem0()
+            if memory is None:
                 for user_id, items in self._fallback_store.items():
                     new_items = [m for m in items if m.get("id") != memory_id]
                     if len(new_items) != len(items):
@@ -358,9 +633,19 @@ class MemUService:
                         return True
                 return False
 
-            self.memory.delete(memory_id=memory_id)
+            memory.delete(memory_id=memory_id)
             return True
         except Exception as e:
             raise Exception(f"Failed to delete memory: {str(e)}")
 
 memu_service = MemUService()
+
+metrics.MEM0_FALLBACK_MODE.set_function(lambda: 1.0 if memu_service._fallback_enabled else 0.0)
+metrics.BUFFER_SIZE.set_function(
+    lambda: sum(len(v) for v in memu_service._conversation_buffer.values()),
+    buffer="memuu_conversation",
+)
+metrics.BUFFER_SIZE.set_function(
+    lambda: sum(len(v) for v in memu_service._fallback_store.values()),
+    buffer="mem0_fallback_store",
+)
@@ -0,0 +1,129 @@
+"""
+ターンごとのモデル振り分け（コスト・レイテンシ）
+
+「了解」「いつもの感じで」のような軽いターンまで大きいモデル・max_tokens=1024 で
+処理しないよう、LLM を使わずローカルで分類して small / large を選びます。
+
+- large: 計画・設計・比較・分析などの依頼、長いメッセージ、新しいプロジェクトの開始
+  （extract_memory_from_message が new_projects を返すもの）、「前回の続きで」のように
+  過去の会話・記憶を前提にした依頼（相づち「いつもの感じで」は除く）
+- small: それ以外（短い相づち・スタイル指定・ちょっとした質問）
+
+small のモデルは ANTHROPIC_MODEL_SMALL / OPENAI_MODEL_SMALL、max_tokens は
+LLM_SMALL_MAX_TOKENS（既定 256）。small のモデルが設定されていなければ振り分けは行いません
+（LLM_ROUTER=0 でも無効）。判定は LLM_ROUTER_LOG に JSON Lines で追記し、ロガー
+``pocketcoo.model_router`` にも出します（オフライン評価用）。
+"""
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import json
+import logging
+import os
+import threading
+
+from core import metrics
+from services.pocket_coo_service import extract_memory_from_message
+
+
+SMALL = "small"
+LARGE = "large"
+
+logger = logging.getLogger("pocketcoo.model_router")
+
+ROUTE_DECISIONS = metrics.REGISTRY.counter(
+    "pocketcoo_llm_route_decisions_total",
+    "Model routing decisions by tier.",
+)
+
+_PLANNING_KEYWORDS = (
+    "計画", "プラン", "戦略", "設計", "ロードマップ", "比較", "分析", "提案", "検討", "整理", "まとめ",
+    "叩き台", "たたき台", "prd", "okr", "kpi設計", "予算", "見積", "優先順位", "リスク", "なぜ", "どうすれば",
+    "plan", "strategy", "roadmap", "design", "compare", "analy", "propose", "draft", "outline", "trade-off",
+)
+_ACK_PHRASES = (
+    "了解", "りょうかい", "ありがとう", "ok", "おけ", "はい", "いいね", "よろしく", "いつもの感じで",
+    "thanks", "thank you", "got it", "sounds good", "sure", "👍",
+)
+_MEMORY_HINTS = ("いつもの", "前回", "この前", "覚えて", "さっきの", "last time", "as usual", "remember")
+_log_lock = threading.Lock()
+
+
+@dataclass
+class RouteDecision:
+    tier: str
+    reasons: List[str] = field(default_factory=list)
+    features: Dict[str, Any] = field(default_factory=dict)
+
+
+def router_enabled() -> bool:
+    if (os.getenv("LLM_ROUTER") or "1").strip().lower() in ("0", "false", "no", "off"):
+        return False
+    return bool(os.getenv("ANTHROPIC_MODEL_SMALL") or os.getenv("OPENAI_MODEL_SMALL"))
+
+
+def small_max_tokens() -> int:
+    return int(os.getenv("LLM_SMALL_MAX_TOKENS") or "256")
+
+
+def classify_turn(message: str, memory_used: Optional[List[str]] = None) -> RouteDecision:
+    text = (message or "").strip()
+    lower = text.lower()
+    long_chars = int(os.getenv("LLM_ROUTER_LONG_CHARS") or "160")
+    extracted = extract_memory_from_message(text)
+    features = {
+        "chars": len(text),
+        "lines": text.count("\n") + 1 if text else 0,
+        "planning": [k for k in _PLANNING_KEYWORDS if k in lower],
+        "ack": any(lower.rstrip("!！。.　 ").startswith(p) for p in _ACK_PHRASES) and len(text) <= 30,
+        "memory_hints": [h for h in _MEMORY_HINTS if h in lower],
+        "style_update": bool(extracted["identity_style"]),
+        "new_project": bool(extracted["new_projects"]),
+    }
+    features["needs_memory"] = bool(memory_used) or bool(features["memory_hints"])
+    reasons: List[str] = []
+    if features["planning"]:
+        reasons.append("planning_keywords")
+    if len(text) > long_chars or features["lines"] > 4:
+        reasons.append("long_message")
+    if features["new_project"]:
+        reasons.append("new_project")
+    # 注入した記憶があるだけ（memory_used）では large にしない。ほぼ毎ターン何かしら注入されるため
+    if features["memory_hints"] and not features["ack"]:
+        reasons.append("memory_reference")
+    if reasons:
+        return RouteDecision(LARGE, reasons, features)
+    if features["ack"]:
+        reasons.append("acknowledgement")
+    elif features["style_update"]:
+        reasons.append("style_update")
+    else:
+        reasons.append("short_message")
+    return RouteDecision(SMALL, reasons, features)
+
+
+def log_decision(
+    decision: RouteDecision,
+    *,
+    route: str,
+    user_id: Optional[str],
+    latency_ms: Optional[float],
+    ok: bool,
+) -> None:
+    """判定と結果を記録する。model / max_tokens は _chat_response_text が features に書き込む"""
+    ROUTE_DECISIONS.inc(tier=decision.tier, route=route)
+    record = {
+        "ts": datetime.utcnow().isoformat() + "Z",
+        "route": route,
+        "user_id": user_id,
+        "latency_ms": None if latency_ms is None else round(latency_ms, 1),
+        "ok": ok,
+        **asdict(decision),
+    }
+    line = json.dumps(record, ensure_ascii=False)
+    logger.info(line)
+    path = os.getenv("LLM_ROUTER_LOG")
+    if path:
+        with _log_lock:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
@@ -1,14 +1,57 @@
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, TypeVar
 from datetime import datetime, timedelta
-import json
 import uuid
 import hashlib
 import math
+import os
+import random
 import re
+import time
 
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from db.models import UserState
+from core import metrics, profiling, serialization
+from core.singleflight import SingleFlight
+from core.ttl_cache import TTLCache
+from db.models import UserAggregate, UserState
+from db.sharding import get_shards
+from db.state_compression import decode_state, encode_state
+from services import memory_aggregates
+from services.compact_state import CompactState
+from services.memu_service import content_hash
+from services.state_export import merge_imported
+from services.state_patch import PatchError, PatchResult, apply_json_patch, apply_merge_patch
+
+
+T = TypeVar("T")
+
+# compare-and-swap の再試行上限。競合は「他の書き込みが成功した」ことを意味するので
+# 全体としては必ず前進するが、特定リクエストが負け続けた場合の歯止め
+_CAS_MAX_RETRIES = 32
+
+# エピソード埋め込みの方式と次元。次元を変えるとモデル名も変わり、既存のエピソードは
+# tools/reembed.py で作り直すまで「古い埋め込み」として扱われる（グラフは同じモデル同士だけで作る）
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM") or "96")
+EMBEDDING_MODEL = "hashing_v1_int8" if EMBEDDING_DIM == 96 else f"hashing_v1_int8_d{EMBEDDING_DIM}"
+
+# 適用済みとして覚えておく memU の記憶の内容ハッシュ数（state["memuApplied"]、古いものから捨てる）
+MEMU_APPLIED_MAX = int(os.getenv("MEMU_APPLIED_MAX") or "512")
+
+# (DB の URL, user_id) -> 読み込み中の get_state。値はエンコード済み state と version
+_state_loads: SingleFlight[Tuple[bytes, int]] = SingleFlight()
+
+# (DB の URL, user_id) -> (version, CompactState)。読み取り API 用で、version が変わっていれば読み直す
+_compact_states: TTLCache[Tuple[int, CompactState]] = TTLCache(
+    maxsize=int(os.getenv("STATE_CACHE_MAX_USERS") or "256"),
+    ttl=float(os.getenv("STATE_CACHE_TTL") or "300"),
+)
+metrics.BUFFER_SIZE.set_function(lambda: len(_compact_states), buffer="compact_state_cache")
+
+
+class StateConflictError(RuntimeError):
+    """version 競合が再試行上限を超えて解消しなかった"""
 
 
 def _now_iso() -> str:
@@ -124,9 +167,6 @@ def _build_demo_episodes(total: int) -> List[Dict[str, Any]]:
         user_message = t["user"]
         assistant_message = t["assistant"]
         full_text = "\n".join([user_message, assistant_message, summary]).strip()
-        tokens_for_embed = _tokens_from_text(full_text, include_bigrams=True)
-        embedding_dim = 96
-        embedding = _hash_embedding_int8(tokens_for_embed, dim=embedding_dim)
         episode = {
             "id": f"ep_demo_{i:04d}",
             "date": dt.isoformat() + "Z",
@@ -139,10 +179,7 @@ def _build_demo_episodes(total: int) -> List[Dict[str, Any]]:
             "feedback": None,
             "tags": t.get("tags") or [],
             "topics": t.get("topics") or [],
-            "embedding": embedding,
-            "embedding_dim": embedding_dim,
-            "embedding_model": "hashing_v1_int8",
-            "embedding_at": _now_iso(),
+            **embedding_fields(full_text),
         }
         out.append(episode)
     return out
@@ -311,18 +348,38 @@ def _apply_feedback_comment_to_identity(identity: Dict[str, Any], comment: Optio
     return changes
 
 
+def applied_memu_hashes(state: Dict[str, Any]) -> Set[str]:
+    """identity に適用済みの memU の記憶の内容ハッシュ"""
+    return set(state.get("memuApplied") or [])
+
+
 def _apply_memuu_items_to_identity(
     identity: Dict[str, Any],
     memuu_items: Optional[List[Dict[str, Any]]],
+    applied: Optional[List[str]] = None,
 ) -> List[Dict[str, Any]]:
+    """memU の記憶を identity に反映する
+
+    applied（state["memuApplied"]）を渡すと、そこにある内容ハッシュの記憶は飛ばし、
+    新しく反映したものを追記する（同じ記憶で毎ターン同じ処理・updated_at の更新をしない）。
+    """
     if not memuu_items:
         return []
+    seen = set(applied) if applied is not None else set()
     changes: List[Dict[str, Any]] = []
     for it in memuu_items:
         text = it.get("memory") or it.get("content") or ""
         if not text:
             continue
+        if applied is not None:
+            digest = it.get("content_hash") or content_hash(str(text))
+            if digest in seen:
+                continue
+            seen.add(digest)
+            applied.append(digest)
         changes.extend(_apply_feedback_comment_to_identity(identity, str(text)))
+    if applied is not None and len(applied) > MEMU_APPLIED_MAX:
+        del applied[:-MEMU_APPLIED_MAX]
     return changes
 
 
@@ -380,14 +437,15 @@ def extract_memory_from_message(message: str) -> Dict[str, Any]:
     }
 
 
+@metrics.timed_stage("build_prompt_memories")
 def build_prompt_memories(state: Dict[str, Any]) -> Tuple[str, str, str, List[str]]:
     identity = state.get("identity") or {}
     projects = state.get("projects") or []
     episodes = state.get("episodes") or []
 
-    identity_memory = json.dumps(identity, ensure_ascii=False)
-    project_memory = json.dumps(projects, ensure_ascii=False)
-    episode_memory = json.dumps(episodes[-5:], ensure_ascii=False)
+    identity_memory = serialization.dumps(identity)
+    project_memory = serialization.dumps(projects)
+    episode_memory = serialization.dumps(episodes[-5:])
 
     used: List[str] = []
     style = identity.get("style") or {}
@@ -578,9 +636,9 @@ def _tags_from_text(text: str, topics: List[str]) -> List[str]:
     return tags[:6]
 
 
-def _hash_embedding_int8(tokens: List[str], dim: int = 96) -> List[int]:
+def _hash_embedding_int8(tokens: List[str], dim: int = EMBEDDING_DIM) -> List[int]:
     if dim <= 0:
-        dim = 96
+        dim = EMBEDDING_DIM
     if not tokens:
         return [0 for _ in range(dim)]
 
@@ -609,19 +667,288 @@ def _hash_embedding_int8(tokens: List[str], dim: int = 96) -> List[int]:
     return scaled
 
 
+def embedding_fields(text: str, tokens: Optional[List[str]] = None) -> Dict[str, Any]:
+    """エピソードに載せる embedding / embedding_dim / embedding_model / embedding_at"""
+    if tokens is None:
+        tokens = _tokens_from_text(text, include_bigrams=True)
+    return {
+        "embedding": _hash_embedding_int8(tokens, dim=EMBEDDING_DIM),
+        "embedding_dim": EMBEDDING_DIM,
+        "embedding_model": EMBEDDING_MODEL,
+        "embedding_at": _now_iso(),
+    }
+
+
+def episode_embedding_text(episode: Dict[str, Any]) -> str:
+    """エピソードを作った時と同じ埋め込み元のテキストを組み立て直す"""
+    user_message = episode.get("user_message") or ""
+    assistant_message = episode.get("assistant_message")
+    if episode.get("type") == "demo_log":
+        return "\n".join([user_message, assistant_message or "", episode.get("summary") or ""]).strip()
+    summary_seed = user_message if assistant_message is None else f"{user_message}\n{assistant_message}"
+    return "\n".join([user_message, assistant_message or "", summary_seed]).strip()
+
+
+def embedding_is_stale(episode: Dict[str, Any]) -> bool:
+    return episode.get("embedding_model") != EMBEDDING_MODEL or episode.get("embedding_dim") != EMBEDDING_DIM
+
+
+def reembed_stale_episodes(state: Dict[str, Any]) -> int:
+    """現在の EMBEDDING_MODEL でないエピソードの埋め込みを作り直し、作り直した件数を返す"""
+    changed = 0
+    for episode in state.get("episodes") or []:
+        if embedding_is_stale(episode):
+            episode.update(embedding_fields(episode_embedding_text(episode)))
+            changed += 1
+    return changed
+
+
+def _build_turn_episode(
+    user_message: str,
+    assistant_message: Optional[str],
+    memory_used: Optional[List[str]],
+) -> Dict[str, Any]:
+    episode_id = f"ep_{uuid.uuid4().hex[:10]}"
+    summary_seed = user_message if assistant_message is None else f"{user_message}\n{assistant_message}"
+    full_text = "\n".join([user_message or "", assistant_message or "", summary_seed or ""]).strip()
+    # 段階ごとに 1 回だけ計測する（_tokens_from_text などは 1 ターンに何度も呼ばれるので関数には付けない）
+    with metrics.stage("tokenize"):
+        tokens_for_embed = _tokens_from_text(full_text, include_bigrams=True)
+        tokens_for_topics = _tokens_from_text(full_text, include_bigrams=False)
+    topics = _keyword_topics(full_text, limit=6)
+    if len(topics) < 6:
+        rest = _topics_from_tokens(tokens_for_topics, limit=12)
+        for t in rest:
+            if t not in topics:
+                topics.append(t)
+            if len(topics) >= 6:
+                break
+    tags = _tags_from_text(full_text, topics)
+    with metrics.stage("embed"):
+        embedding = embedding_fields(full_text, tokens=tokens_for_embed)
+    return {
+        "id": episode_id,
+        "date": _now_iso(),
+        "type": "chat_turn",
+        "user_message": user_message,
+        "assistant_message": assistant_message,
+        "memory_used": memory_used or [],
+        "summary": (summary_seed[:160] + "…") if len(summary_seed) > 160 else summary_seed,
+        "learnings": [],
+        "feedback": None,
+        "tags": tags,
+        "topics": topics,
+        **embedding,
+    }
+
+
+STATE_FIELDS = ("identity", "projects", "episodes", "score")
+_ALWAYS_EPISODE_FIELDS = ("id", "date")
+
+
+def parse_fields(fields: Optional[str]) -> Optional[Dict[str, Optional[List[str]]]]:
+    """``fields=identity,score,episodes.summary`` を {field: sub_fields or None} に変換する"""
+    if fields is None or not fields.strip():
+        return None
+    out: Dict[str, Optional[List[str]]] = {}
+    for raw in fields.split(","):
+        name = raw.strip()
+        if not name:
+            continue
+        top, _, sub = name.partition(".")
+        if top not in STATE_FIELDS:
+            raise ValueError(f"unknown field '{top}' (allowed: {', '.join(STATE_FIELDS)})")
+        if not sub:
+            out[top] = None
+            continue
+        if top != "episodes":
+            raise ValueError(f"sub-field projection is only supported for episodes: '{name}'")
+        if top in out and out[top] is None:
+            continue
+        subs = out.setdefault(top, list(_ALWAYS_EPISODE_FIELDS))
+        if sub not in subs:
+            subs.append(sub)
+    return out
+
+
+def slim_episode(episode: Dict[str, Any], keys: Optional[List[str]] = None, include_embedding: bool = False) -> Dict[str, Any]:
+    if keys is not None:
+        return {k: episode[k] for k in keys if k in episode}
+    if include_embedding or "embedding" not in episode:
+        return episode
+    return {k: v for k, v in episode.items() if k != "embedding"}
+
+
+def project_state(
+    state: Dict[str, Any],
+    fields: Optional[Dict[str, Optional[List[str]]]] = None,
+    limit: Optional[int] = None,
+    before: Optional[str] = None,
+    include_embeddings: bool = False,
+) -> Dict[str, Any]:
+    """読み取り API 用に state を絞り込む
+
+    - fields: parse_fields の結果。None なら全フィールド（userId は常に含む）
+    - limit / before: 指定時はエピソードを新しい順に並べ、before の id より古いものを limit 件返す
+    - include_embeddings: False なら各エピソードの embedding 配列を落とす
+    """
+    if fields is None:
+        wanted: Dict[str, Optional[List[str]]] = {"episodes": None}
+        out: Dict[str, Any] = {k: v for k, v in state.items() if k != "episodes"}
+    else:
+        wanted = fields
+        out = {"userId": state.get("userId")}
+        for key in ("identity", "projects", "score"):
+            if key in wanted and key in state:
+                out[key] = state[key]
+
+    if "episodes" in wanted:
+        episodes: List[Dict[str, Any]] = state.get("episodes") or []
+        out["episodeCount"] = len(episodes)
+        keys = wanted.get("episodes")
+        if limit is None and before is None:
+            page = episodes
+        else:
+            end = len(episodes)
+            if before is not None:
+                end = next((i for i in range(len(episodes) - 1, -1, -1) if episodes[i].get("id") == before), None)
+                if end is None:
+                    raise ValueError(f"unknown cursor '{before}'")
+            start = 0 if limit is None else max(0, end - limit)
+            page = episodes[start:end][::-1]
+            out["nextCursor"] = page[-1].get("id") if start > 0 and page else None
+        out["episodes"] = [slim_episode(e, keys, include_embeddings) for e in page]
+    return out
+
+
+def _validate_patched(state: Dict[str, Any], result: PatchResult) -> None:
+    """パッチで触れた部分だけを API モデルで検証する（全エピソードの再検証はしない）"""
+    from pydantic import ValidationError
+    from models.user_state import UserEpisode, UserIdentity, UserProject
+
+    try:
+        if "identity" in result.sections:
+            UserIdentity.model_validate(state.get("identity") or {})
+        if "projects" in result.sections:
+            for p in state.get("projects") or []:
+                UserProject.model_validate(p)
+        if "episodes" in result.sections:
+            episodes = state.get("episodes") or []
+            if result.episodes_replaced:
+                targets = episodes
+            else:
+                targets = [e for e in episodes if e.get("id") in result.episode_ids]
+            for e in targets:
+                UserEpisode.model_validate(e)
+            ids = [e.get("id") for e in episodes]
+            if len(ids) != len(set(ids)):
+                raise PatchError("episode ids must be unique")
+    except ValidationError as e:
+        raise PatchError(str(e))
+
+
 class PocketCOOService:
     def __init__(self, db: Session):
         self.db = db
 
+    def _bind(self, user_id: str) -> Dict[str, Any]:
+        """シャーディング中（db/sharding.py）なら user_id のシャードのエンジンを bind_arguments で渡す"""
+        shards = get_shards()
+        return {} if shards is None else {"bind": shards.engine_for(user_id)}
+
+    def _engine_url(self, user_id: str) -> str:
+        shards = get_shards()
+        return str(shards.engine_for(user_id).url if shards is not None else self.db.get_bind().url)
+
     def get_state(self, user_id: str) -> Dict[str, Any]:
-        row = self.db.get(UserState, user_id)
+        state, _ = self.get_state_with_version(user_id)
+        return state
+
+    @metrics.timed_stage("get_state")
+    def get_state_with_version(self, user_id: str) -> Tuple[Dict[str, Any], int]:
+        """同じユーザーの同時読み込みは 1 回にまとめる（初回のデモ seed を各リクエストが作って書くのを防ぐ）
+
+        state は呼び出し側が書き換えるので、待っていた側にはエンコード済みのバイト列を渡し、
+        それぞれがデコードした別のコピーを返す。
+        """
+        key = (self._engine_url(user_id), user_id)
+        call, leader = _state_loads.acquire(key)
+        if not leader:
+            call.wait()
+            raw, version = call.get()
+            return serialization.loads(raw), version
+        try:
+            state, version = self._get_or_seed_state(user_id)
+        except BaseException as e:
+            _state_loads.finish(key, call, error=e)
+            raise
+        try:
+            shared = (serialization.dumps_bytes(state), version) if _state_loads.detach(key, call) else None
+        except BaseException as e:
+            _state_loads.resolve(call, error=e)
+            raise
+        _state_loads.resolve(call, result=shared)
+        return state, version
+
+    def get_compact_state(self, user_id: str, version: Optional[int] = None) -> Tuple[CompactState, int]:
+        """読み取り専用の CompactState と version。version が同じ間はキャッシュを返す
+
+        version は直前に get_state_version で読んだ値があれば渡す（無ければここで読む）。
+        """
+        key = (self._engine_url(user_id), user_id)
+        if version is None:
+            version = self.get_state_version(user_id)
+        cached = _compact_states.get(key)
+        if version is not None and cached is not None and cached[0] == version:
+            compact = cached[1]
+            if profiling.is_profiling():
+                profiling.annotate(user_id=user_id, episode_count=len(compact), state_bytes=compact.packed_bytes(), state_cache="hit")
+            return compact, version
+        state, version = self.get_state_with_version(user_id)
+        compact = CompactState.from_state(state)
+        _compact_states.set(key, (version, compact))
+        return compact, version
+
+    def _get_or_seed_state(self, user_id: str) -> Tuple[Dict[str, Any], int]:
+        for _ in range(_CAS_MAX_RETRIES):
+            state, version, needs_save = self._load_state(user_id)
+            if not needs_save:
+                return state, int(version or 0)
+            saved_version = self._write_state(user_id, state, expected_version=version)
+            if saved_version is not None:
+                return state, saved_version
+        raise StateConflictError(f"state for {user_id} kept changing while loading")
+
+    def get_state_version(self, user_id: str) -> Optional[int]:
+        """state_json を読まずに version だけ返す（行が無ければ None）"""
+        return self.db.execute(
+            select(UserState.version).where(UserState.user_id == user_id), bind_arguments=self._bind(user_id)
+        ).scalar()
+
+    @metrics.timed_stage("load_state")
+    def _load_state(self, user_id: str) -> Tuple[Dict[str, Any], Optional[int], bool]:
+        """(state, version, needs_save) を返す。行が無い場合 version は None"""
+        row = self.db.execute(
+            select(UserState.state_json, UserState.state_blob, UserState.state_format, UserState.version)
+            .where(UserState.user_id == user_id),
+            bind_arguments=self._bind(user_id),
+        ).first()
         if not row:
             state = default_user_memory(user_id)
             state = ensure_demo_seeded(state, user_id=user_id)
             state["score"] = calculate_score(state)
-            self._save_state(user_id, state)
-            return state
-        state = json.loads(row.state_json)
+            profiling.annotate(user_id=user_id, episode_count=len(state.get("episodes") or []), state_bytes=0)
+            return state, None, True
+        raw = decode_state(row.state_json, row.state_blob, row.state_format)
+        state = serialization.loads(raw)
+        if profiling.is_profiling():
+            profiling.annotate(
+                user_id=user_id,
+                episode_count=len(state.get("episodes") or []),
+                state_bytes=len(raw.encode("utf-8") if isinstance(raw, str) else raw),
+                stored_bytes=len(row.state_blob) if row.state_blob is not None else None,
+                state_format=row.state_format,
+            )
         next_state = ensure_demo_seeded(state, user_id=user_id)
         needs_save = next_state is not state
         state = next_state
@@ -629,26 +956,94 @@ class PocketCOOService:
         if int(state.get("score") or 0) != int(next_score):
             state["score"] = next_score
             needs_save = True
-        if needs_save:
-            self._save_state(user_id, state)
-        return state
+        return state, int(row.version or 0), needs_save
+
+    @metrics.timed_stage("save_state")
+    def _write_state(self, user_id: str, state: Dict[str, Any], expected_version: Optional[int]) -> Optional[int]:
+        """version が expected_version のままなら書き込む（compare-and-swap）
+
+        成功時は新しい version、競合時は None を返す。
+        expected_version が None の場合は新規行として INSERT する。
+        """
+        state_json, state_blob, state_format = encode_state(serialization.dumps_bytes(state))
+        columns = {"state_json": state_json, "state_blob": state_blob, "state_format": state_format}
+        now = datetime.utcnow()
+        try:
+            if expected_version is None:
+                self.db.execute(
+                    insert(UserState).values(user_id=user_id, updated_at=now, version=1, **columns),
+                    bind_arguments=self._bind(user_id),
+                )
+                self.db.commit()
+                return 1
+            result = self.db.execute(
+                update(UserState)
+                .where(UserState.user_id == user_id, UserState.version == expected_version)
+                .values(updated_at=now, version=expected_version + 1, **columns)
+                .execution_options(synchronize_session=False),
+                bind_arguments=self._bind(user_id),
+            )
+            if result.rowcount != 1:
+                self.db.rollback()
+                return None
+            self.db.commit()
+            return expected_version + 1
+        except IntegrityError:
+            # 同じ user_id の行が並行して INSERT された
+            self.db.rollback()
+            return None
 
-    def _save_state(self, user_id: str, state: Dict[str, Any]) -> None:
-        row = self.db.get(UserState, user_id)
-        payload = json.dumps(state, ensure_ascii=False)
-        if row:
-            row.state_json = payload
-            row.updated_at = datetime.utcnow()
-        else:
-            row = UserState(user_id=user_id, state_json=payload, updated_at=datetime.utcnow())
-            self.db.add(row)
-        self.db.commit()
+    def _update_state(self, user_id: str, mutate: Callable[[Dict[str, Any]], T]) -> Tuple[Dict[str, Any], T, int]:
+        """最新の state に mutate を適用して書き込む。競合したら読み直して再適用する
+
+        mutate は state をその場で書き換え、呼び出し側に返したい値を返す。
+        再試行のたびに新しく読み込んだ state で呼ばれるため、副作用は state 内に閉じること。
+        """
+        for attempt in range(_CAS_MAX_RETRIES):
+            state, version, _ = self._load_state(user_id)
+            result = mutate(state)
+            state["score"] = calculate_score(state)
+            new_version = self._write_state(user_id, state, expected_version=version)
+            if new_version is not None:
+                return state, result, new_version
+            time.sleep(random.uniform(0, 0.002 * (attempt + 1)))
+        raise StateConflictError(f"too many concurrent updates for {user_id}")
 
     def upsert_state(self, user_id: str, state: Dict[str, Any]) -> Dict[str, Any]:
         state["userId"] = user_id
         state["score"] = calculate_score(state)
-        self._save_state(user_id, state)
-        return state
+
+        def replace(current: Dict[str, Any]) -> None:
+            current.clear()
+            current.update(state)
+
+        saved, _, _ = self._update_state(user_id, replace)
+        return saved
+
+    def import_state(self, user_id: str, imported: Dict[str, Any], mode: str = "replace") -> Dict[str, Any]:
+        """NDJSON から組み立てた state を保存する（services/state_export.py）
+
+        mode=replace は丸ごと置き換え、mode=merge は既存の state に未知のエピソードなどを追加する。
+        """
+        if mode == "replace":
+            return self.upsert_state(user_id, imported)
+        if mode != "merge":
+            raise ValueError("mode must be replace or merge")
+        saved, _, _ = self._update_state(user_id, lambda current: merge_imported(current, imported))
+        return saved
+
+    def patch_state(self, user_id: str, patch: Any, json_patch: bool = False) -> Tuple[Dict[str, Any], PatchResult]:
+        """JSON Merge Patch（既定）または JSON Patch を最新の state に当てて保存する"""
+
+        def apply(state: Dict[str, Any]) -> PatchResult:
+            result = apply_json_patch(state, patch) if json_patch else apply_merge_patch(state, patch)
+            _validate_patched(state, result)
+            if "identity" in result.sections:
+                state.setdefault("identity", {})["updated_at"] = _now_iso()
+            return result
+
+        state, result, _ = self._update_state(user_id, apply)
+        return state, result
 
     def apply_message(self, user_id: str, message: str) -> Dict[str, Any]:
         return self.apply_turn(
@@ -659,6 +1054,7 @@ class PocketCOOService:
             memuu_items=None,
         )
 
+    @metrics.timed_stage("apply_turn")
     def apply_turn(
         self,
         user_id: str,
@@ -667,80 +1063,51 @@ class PocketCOOService:
         memory_used: Optional[List[str]],
         memuu_items: Optional[List[Dict[str, Any]]],
     ) -> Dict[str, Any]:
-        state = self.get_state(user_id)
-        before_score = int(state.get("score") or 0)
-
-        identity = state.setdefault("identity", {})
-        identity_style = identity.setdefault("style", {})
-        new_memory: Dict[str, Any] = {"identity": {}, "projects": [], "episodes": []}
-
-        memuu_changes = _apply_memuu_items_to_identity(identity, memuu_items)
-        for ch in memuu_changes:
-            if ch.get("type") == "style":
-                new_memory["identity"].setdefault("style", {})[ch.get("key")] = ch.get("value")
-            if ch.get("type") == "preference":
-                pref = {"key": ch.get("key"), "value": ch.get("value"), "confidence": ch.get("confidence")}
-                new_memory["identity"].setdefault("preferences", []).append(pref)
-
+        # 競合時に再計算しないよう、state に依存しない部分は先に作っておく
         extracted = extract_memory_from_message(user_message)
-        for k, v in extracted.get("identity_style", {}).items():
-            if identity_style.get(k) != v:
-                identity_style[k] = v
-                new_memory["identity"].setdefault("style", {})[k] = v
-
-        for p in extracted.get("new_preferences", []):
-            added = _add_preference(identity, p["key"], p["value"], float(p["confidence"]))
-            if added:
-                new_memory["identity"].setdefault("preferences", []).append(added)
-
-        projects: List[Dict[str, Any]] = state.setdefault("projects", [])
-        for proj in extracted.get("new_projects", []):
-            exists = any((p.get("name") == proj.get("name") and p.get("status") == "in_progress") for p in projects)
-            if not exists:
-                projects.append(proj)
-                new_memory["projects"].append(proj)
-
-        episodes: List[Dict[str, Any]] = state.setdefault("episodes", [])
-        episode_id = f"ep_{uuid.uuid4().hex[:10]}"
-        summary_seed = user_message if assistant_message is None else f"{user_message}\n{assistant_message}"
-        full_text = "\n".join([user_message or "", assistant_message or "", summary_seed or ""]).strip()
-        tokens_for_embed = _tokens_from_text(full_text, include_bigrams=True)
-        tokens_for_topics = _tokens_from_text(full_text, include_bigrams=False)
-        topics = _keyword_topics(full_text, limit=6)
-        if len(topics) < 6:
-            rest = _topics_from_tokens(tokens_for_topics, limit=12)
-            for t in rest:
-                if t not in topics:
-                    topics.append(t)
-                if len(topics) >= 6:
-                    break
-        tags = _tags_from_text(full_text, topics)
-        embedding_dim = 96
-        embedding = _hash_embedding_int8(tokens_for_embed, dim=embedding_dim)
-        episode = {
-            "id": episode_id,
-            "date": _now_iso(),
-            "type": "chat_turn",
-            "user_message": user_message,
-            "assistant_message": assistant_message,
-            "memory_used": memory_used or [],
-            "summary": (summary_seed[:160] + "…") if len(summary_seed) > 160 else summary_seed,
-            "learnings": [],
-            "feedback": None,
-            "tags": tags,
-            "topics": topics,
-            "embedding": embedding,
-            "embedding_dim": embedding_dim,
-            "embedding_model": "hashing_v1_int8",
-            "embedding_at": _now_iso(),
-        }
-        episodes.append(episode)
-        new_memory["episodes"].append(episode)
-
-        state["score"] = calculate_score(state)
+        episode = _build_turn_episode(user_message, assistant_message, memory_used)
+
+        def apply(state: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+            before_score = int(state.get("score") or 0)
+
+            identity = state.setdefault("identity", {})
+            identity_style = identity.setdefault("style", {})
+            new_memory: Dict[str, Any] = {"identity": {}, "projects": [], "episodes": []}
+
+            applied = state.setdefault("memuApplied", []) if memuu_items else None
+            memuu_changes = _apply_memuu_items_to_identity(identity, memuu_items, applied)
+            for ch in memuu_changes:
+                if ch.get("type") == "style":
+                    new_memory["identity"].setdefault("style", {})[ch.get("key")] = ch.get("value")
+                if ch.get("type") == "preference":
+                    pref = {"key": ch.get("key"), "value": ch.get("value"), "confidence": ch.get("confidence")}
+                    new_memory["identity"].setdefault("preferences", []).append(pref)
+
+            for k, v in extracted.get("identity_style", {}).items():
+                if identity_style.get(k) != v:
+                    identity_style[k] = v
+                    new_memory["identity"].setdefault("style", {})[k] = v
+
+            for p in extracted.get("new_preferences", []):
+                added = _add_preference(identity, p["key"], p["value"], float(p["confidence"]))
+                if added:
+                    new_memory["identity"].setdefault("preferences", []).append(added)
+
+            projects: List[Dict[str, Any]] = state.setdefault("projects", [])
+            for proj in extracted.get("new_projects", []):
+                exists = any((p.get("name") == proj.get("name") and p.get("status") == "in_progress") for p in projects)
+                if not exists:
+                    projects.append(dict(proj))
+                    new_memory["projects"].append(proj)
+
+            episodes: List[Dict[str, Any]] = state.setdefault("episodes", [])
+            episodes.append(dict(episode))
+            new_memory["episodes"].append(episode)
+            return before_score, new_memory
+
+        state, (before_score, new_memory), version = self._update_state(user_id, apply)
         score_delta = int(state["score"]) - before_score
-
-        self._save_state(user_id, state)
+        self._refresh_aggregates(user_id, state, version, new_episode=episode)
 
         return {
             "state": state,
@@ -749,6 +1116,7 @@ class PocketCOOService:
             "new_memory": new_memory,
         }
 
+    @metrics.timed_stage("record_feedback")
     def record_feedback(
         self,
         user_id: str,
@@ -756,50 +1124,140 @@ class PocketCOOService:
         rating: str,
         comment: Optional[str] = None,
     ) -> Dict[str, Any]:
-        state = self.get_state(user_id)
-        episodes: List[Dict[str, Any]] = state.setdefault("episodes", [])
-        target = next((e for e in episodes if e.get("id") == episode_id), None)
-        if not target:
-            raise ValueError("episode not found")
-
-        identity = state.setdefault("identity", {})
-        memory_used = target.get("memory_used") or []
-        deltas: List[Dict[str, Any]] = []
-        if rating == "like":
-            if "preferences.format" in memory_used:
-                updated = _adjust_preference_confidence(identity, "フォーマット", 0.05)
-                if updated:
-                    deltas.append({"type": "preference_confidence", **updated})
-            if "preferences.detail_level" in memory_used:
-                updated = _adjust_preference_confidence(identity, "重視", 0.05)
-                if updated:
-                    deltas.append({"type": "preference_confidence", **updated})
-            if "preferences.communication" in memory_used:
-                updated = _adjust_preference_confidence(identity, "文体", 0.05)
-                if updated:
-                    deltas.append({"type": "preference_confidence", **updated})
-        elif rating == "dislike":
-            if "preferences.format" in memory_used:
-                updated = _adjust_preference_confidence(identity, "フォーマット", -0.1)
-                if updated:
-                    deltas.append({"type": "preference_confidence", **updated})
-            if "preferences.detail_level" in memory_used:
-                updated = _adjust_preference_confidence(identity, "重視", -0.1)
-                if updated:
-                    deltas.append({"type": "preference_confidence", **updated})
-            if "preferences.communication" in memory_used:
-                updated = _adjust_preference_confidence(identity, "文体", -0.1)
-                if updated:
-                    deltas.append({"type": "preference_confidence", **updated})
-
-        deltas.extend(_apply_feedback_comment_to_identity(identity, comment))
-
-        target["feedback"] = {
-            "rating": rating,
-            "comment": comment,
-            "updated_at": _now_iso(),
-            "identity_updates": deltas,
-        }
-        state["score"] = calculate_score(state)
-        self._save_state(user_id, state)
+        def apply(state: Dict[str, Any]) -> Dict[str, Any]:
+            episodes: List[Dict[str, Any]] = state.setdefault("episodes", [])
+            target = next((e for e in episodes if e.get("id") == episode_id), None)
+            if not target:
+                raise ValueError("episode not found")
+
+            identity = state.setdefault("identity", {})
+            memory_used = target.get("memory_used") or []
+            deltas: List[Dict[str, Any]] = []
+            if rating == "like":
+                if "preferences.format" in memory_used:
+                    updated = _adjust_preference_confidence(identity, "フォーマット", 0.05)
+                    if updated:
+                        deltas.append({"type": "preference_confidence", **updated})
+                if "preferences.detail_level" in memory_used:
+                    updated = _adjust_preference_confidence(identity, "重視", 0.05)
+                    if updated:
+                        deltas.append({"type": "preference_confidence", **updated})
+                if "preferences.communication" in memory_used:
+                    updated = _adjust_preference_confidence(identity, "文体", 0.05)
+                    if updated:
+                        deltas.append({"type": "preference_confidence", **updated})
+            elif rating == "dislike":
+                if "preferences.format" in memory_used:
+                    updated = _adjust_preference_confidence(identity, "フォーマット", -0.1)
+                    if updated:
+                        deltas.append({"type": "preference_confidence", **updated})
+                if "preferences.detail_level" in memory_used:
+                    updated = _adjust_preference_confidence(identity, "重視", -0.1)
+                    if updated:
+                        deltas.append({"type": "preference_confidence", **updated})
+                if "preferences.communication" in memory_used:
+                    updated = _adjust_preference_confidence(identity, "文体", -0.1)
+                    if updated:
+                        deltas.append({"type": "preference_confidence", **updated})
+
+            deltas.extend(_apply_feedback_comment_to_identity(identity, comment))
+
+            target["feedback"] = {
+                "rating": rating,
+                "comment": comment,
+                "updated_at": _now_iso(),
+                "identity_updates": deltas,
+            }
+            return target
+
+        _, target, version = self._update_state(user_id, apply)
+        # フィードバックはトピック/タグ/埋め込みを変えないので、集計はそのまま新しい version に進める
+        self._advance_aggregates(user_id, from_version=version - 1, to_version=version)
         return target
+
+    def _load_aggregates(self, user_id: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        row = self.db.execute(
+            select(UserAggregate.aggregates_json, UserAggregate.state_version).where(UserAggregate.user_id == user_id),
+            bind_arguments=self._bind(user_id),
+        ).first()
+        if not row:
+            return None
+        return serialization.loads(row.aggregates_json), int(row.state_version or 0)
+
+    def _store_aggregates(self, user_id: str, aggregates: Dict[str, Any], state_version: int) -> None:
+        """より新しい state_version の集計が既にあれば上書きしない"""
+        payload = serialization.dumps(aggregates)
+        now = datetime.utcnow()
+        try:
+            bind = self._bind(user_id)
+            result = self.db.execute(
+                update(UserAggregate)
+                .where(UserAggregate.user_id == user_id, UserAggregate.state_version < state_version)
+                .values(aggregates_json=payload, state_version=state_version, updated_at=now)
+                .execution_options(synchronize_session=False),
+                bind_arguments=bind,
+            )
+            if result.rowcount == 0:
+                exists = self.db.execute(
+                    select(UserAggregate.user_id).where(UserAggregate.user_id == user_id), bind_arguments=bind
+                ).first()
+                if not exists:
+                    self.db.execute(
+                        insert(UserAggregate).values(
+                            user_id=user_id,
+                            aggregates_json=payload,
+                            state_version=state_version,
+                            updated_at=now,
+                        ),
+                        bind_arguments=bind,
+                    )
+            self.db.commit()
+        except IntegrityError:
+            self.db.rollback()
+
+    def _advance_aggregates(self, user_id: str, from_version: int, to_version: int) -> None:
+        try:
+            self.db.execute(
+                update(UserAggregate)
+                .where(UserAggregate.user_id == user_id, UserAggregate.state_version == from_version)
+                .values(state_version=to_version)
+                .execution_options(synchronize_session=False),
+                bind_arguments=self._bind(user_id),
+            )
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+
+    def _refresh_aggregates(
+        self,
+        user_id: str,
+        state: Dict[str, Any],
+        version: int,
+        new_episode: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """version の state に対応する集計を作って保存する
+
+        直前の version の集計があれば new_episode の差分だけ反映し、なければ作り直す。
+        集計は派生データなので、失敗してもターン自体は失敗させない。
+        """
+        try:
+            cached = self._load_aggregates(user_id)
+            if cached and new_episode is not None and cached[1] == version - 1:
+                aggregates = memory_aggregates.add_episode(cached[0], state, new_episode)
+            else:
+                aggregates = memory_aggregates.build_aggregates(state)
+            self._store_aggregates(user_id, aggregates, version)
+            return aggregates
+        except Exception:
+            self.db.rollback()
+            return memory_aggregates.build_aggregates(state)
+
+    def get_aggregates(self, user_id: str) -> Dict[str, Any]:
+        """集計を返す。state が集計より新しければ state を読んで作り直す"""
+        version = self.get_state_version(user_id)
+        if version is not None:
+            cached = self._load_aggregates(user_id)
+            if cached and cached[1] == version:
+                return cached[0]
+        state, version = self.get_state_with_version(user_id)
+        return self._refresh_aggregates(user_id, state, version)
@@ -0,0 +1,179 @@
+"""
+ユーザーの記憶（identity / projects / episodes）の NDJSON エクスポート・インポート
+
+1 行 1 レコードで、先頭に header、最後に end を置きます（end が無ければ途中で切れたとみなす）。
+
+    {"type": "header", "format": "pocketcoo-memory", "version": 1, "userId": "...", "exportedAt": "...", "counts": {...}}
+    {"type": "meta", "data": {"demoSeeded": "v1", ...}}      # identity / projects / episodes 以外のキー
+    {"type": "identity", "data": {...}}
+    {"type": "project", "data": {...}}                       # プロジェクトごとに 1 行
+    {"type": "episode", "data": {...}}                       # エピソードごとに 1 行（古い順）
+    {"type": "end", "counts": {"projects": 3, "episodes": 1200}}
+
+state は user_states に 1 つの blob として保存されているため、エクスポートは一度だけデコードして
+行に分けながら送り出し（送った分から手放す）、インポートは行ごとに検証しながら組み立てて
+最後に 1 回の compare-and-swap で書き込みます。レスポンス全体の JSON や pydantic の
+モデル全体を作らないので、GET /api/user/{id} より大きな履歴を扱えます。
+"""
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from core import serialization
+
+
+FORMAT = "pocketcoo-memory"
+VERSION = 1
+CHUNK_BYTES = 64 * 1024
+
+_SECTIONS = ("identity", "projects", "episodes")
+
+
+class StateImportError(ValueError):
+    """NDJSON として読めない・検証に通らない（行番号付き）"""
+
+
+def _line(record: Dict[str, Any]) -> bytes:
+    return serialization.dumps_bytes(record) + b"\n"
+
+
+def iter_export(state: Dict[str, Any], version: Optional[int] = None) -> Iterator[bytes]:
+    """state を NDJSON の行にして CHUNK_BYTES 前後のまとまりで返す
+
+    state（get_state で得た呼び出し側専用のコピー）は送り出しながら空にしていく。
+    """
+    projects: List[Dict[str, Any]] = state.get("projects") or []
+    episodes: List[Dict[str, Any]] = state.get("episodes") or []
+    counts = {"projects": len(projects), "episodes": len(episodes)}
+
+    def records() -> Iterator[Dict[str, Any]]:
+        yield {
+            "type": "header",
+            "format": FORMAT,
+            "version": VERSION,
+            "userId": state.get("userId"),
+            "stateVersion": version,
+            "exportedAt": datetime.utcnow().isoformat() + "Z",
+            "counts": counts,
+        }
+        meta = {k: v for k, v in state.items() if k not in _SECTIONS and k != "userId"}
+        if meta:
+            yield {"type": "meta", "data": meta}
+        yield {"type": "identity", "data": state.get("identity") or {}}
+        for project in projects:
+            yield {"type": "project", "data": project}
+        # 古い順に送りつつ、送ったエピソードは参照を外す
+        episodes.reverse()
+        while episodes:
+            yield {"type": "episode", "data": episodes.pop()}
+        yield {"type": "end", "counts": counts}
+
+    buffer = bytearray()
+    for record in records():
+        buffer += _line(record)
+        if len(buffer) >= CHUNK_BYTES:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+class NDJSONImporter:
+    """NDJSON のバイト列を少しずつ受け取り、検証しながら state を組み立てる
+
+        importer = NDJSONImporter(user_id)
+        for chunk in chunks:
+            importer.feed(chunk)
+        state = importer.finish()
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.state: Dict[str, Any] = {"userId": user_id, "identity": {}, "projects": [], "episodes": []}
+        self.lineno = 0
+        self._pending = b""
+        self._header = False
+        self._ended = False
+        self._episode_ids: Set[str] = set()
+
+    def feed(self, chunk: bytes) -> None:
+        data = self._pending + chunk
+        *lines, self._pending = data.split(b"\n")
+        for line in lines:
+            self._feed_line(line)
+
+    def finish(self) -> Dict[str, Any]:
+        if self._pending.strip():
+            self._feed_line(self._pending)
+        self._pending = b""
+        if not self._header:
+            raise StateImportError("missing header record")
+        if not self._ended:
+            raise StateImportError(f"missing end record (truncated after line {self.lineno})")
+        return self.state
+
+    def _fail(self, message: str) -> StateImportError:
+        return StateImportError(f"line {self.lineno}: {message}")
+
+    def _feed_line(self, line: bytes) -> None:
+        from pydantic import ValidationError
+        from models.user_state import UserEpisode, UserIdentity, UserProject
+
+        self.lineno += 1
+        if not line.strip():
+            return
+        if self._ended:
+            raise self._fail("record after end")
+        try:
+            record = serialization.loads(line)
+        except Exception as e:  # codec ごとに例外の型が違う
+            raise self._fail(f"invalid JSON ({e})")
+        if not isinstance(record, dict):
+            raise self._fail("record must be an object")
+        kind = record.get("type")
+        if not self._header:
+            if kind != "header" or record.get("format") != FORMAT:
+                raise self._fail(f"first record must be a {FORMAT} header")
+            if int(record.get("version") or 0) > VERSION:
+                raise self._fail(f"unsupported version {record.get('version')}")
+            self._header = True
+            return
+        data = record.get("data")
+        try:
+            if kind == "meta" and isinstance(data, dict):
+                self.state.update({k: v for k, v in data.items() if k not in _SECTIONS and k != "userId"})
+            elif kind == "identity" and isinstance(data, dict):
+                UserIdentity.model_validate(data)
+                self.state["identity"] = data
+            elif kind == "project" and isinstance(data, dict):
+                UserProject.model_validate(data)
+                self.state["projects"].append(data)
+            elif kind == "episode" and isinstance(data, dict):
+                UserEpisode.model_validate(data)
+                if data["id"] in self._episode_ids:
+                    raise self._fail(f"duplicate episode id {data['id']}")
+                self._episode_ids.add(data["id"])
+                self.state["episodes"].append(data)
+            elif kind == "end":
+                counts = record.get("counts") or {}
+                got = {"projects": len(self.state["projects"]), "episodes": len(self.state["episodes"])}
+                if any(k in counts and int(counts[k]) != got[k] for k in got):
+                    raise self._fail(f"record counts do not match end record ({got} != {counts})")
+                self._ended = True
+            else:
+                raise self._fail(f"unknown record type {kind!r}")
+        except ValidationError as e:
+            raise self._fail(str(e))
+
+
+def merge_imported(current: Dict[str, Any], imported: Dict[str, Any]) -> None:
+    """mode=merge: 既存の state に取り込む。identity は上書き、projects は id で置き換え、
+    episodes は未知の id だけ追加する"""
+    if imported.get("identity"):
+        current["identity"] = imported["identity"]
+    projects = {p.get("id"): p for p in current.get("projects") or []}
+    for p in imported.get("projects") or []:
+        projects[p.get("id")] = p
+    current["projects"] = list(projects.values())
+    episodes = current.setdefault("episodes", [])
+    known = {e.get("id") for e in episodes}
+    episodes.extend(e for e in imported.get("episodes") or [] if e.get("id") not in known)
@@ -0,0 +1,234 @@
+"""
+UserState への部分更新（JSON Merge Patch / JSON Patch）
+
+クライアントが全エピソードを送り直さなくて済むよう、サーバー側で state に
+パッチを当てます。
+
+- JSON Merge Patch (RFC 7386): ``{"identity": {"style": {"format": "paragraph"}}}``
+  ``projects`` / ``episodes`` に id をキーにしたオブジェクトを渡すと、配列を丸ごと
+  置き換えず該当要素だけをマージします（``null`` で削除、未知の id は追加）。
+- JSON Patch (RFC 6902): ``[{"op": "replace", "path": "/episodes/ep_xxx/summary", "value": "..."}]``
+  ``/projects/<seg>`` と ``/episodes/<seg>`` の ``<seg>`` には配列インデックス・``-``・要素の id が使えます。
+"""
+from typing import Any, Dict, List, Optional, Set, Tuple
+import copy
+
+
+PATCHABLE_FIELDS = ("identity", "projects", "episodes")
+_ID_LISTS = ("projects", "episodes")
+
+
+class PatchError(ValueError):
+    """パッチの形式や適用先が不正"""
+
+
+class PatchTestFailed(PatchError):
+    """JSON Patch の test 操作が一致しなかった"""
+
+
+class PatchResult:
+    """適用結果。検証やレスポンスで「どこが変わったか」を使う"""
+
+    def __init__(self) -> None:
+        self.sections: Set[str] = set()
+        self.episode_ids: Set[str] = set()
+        self.episodes_replaced = False
+
+    def touch(self, section: str, item_id: Optional[str] = None) -> None:
+        self.sections.add(section)
+        if section == "episodes":
+            if item_id is None:
+                self.episodes_replaced = True
+            else:
+                self.episode_ids.add(item_id)
+
+
+def _merge(target: Any, patch: Any) -> Any:
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    if not isinstance(target, dict):
+        target = {}
+    for k, v in patch.items():
+        if v is None:
+            target.pop(k, None)
+        else:
+            target[k] = _merge(target.get(k), v)
+    return target
+
+
+def _check_field(name: str) -> None:
+    if name not in PATCHABLE_FIELDS:
+        raise PatchError(f"field '{name}' cannot be patched (allowed: {', '.join(PATCHABLE_FIELDS)})")
+
+
+def apply_merge_patch(state: Dict[str, Any], patch: Any) -> PatchResult:
+    if not isinstance(patch, dict):
+        raise PatchError("merge patch must be a JSON object")
+    result = PatchResult()
+    for field, value in patch.items():
+        _check_field(field)
+        if field in _ID_LISTS and isinstance(value, dict):
+            items: List[Dict[str, Any]] = state.setdefault(field, [])
+            index = {it.get("id"): i for i, it in enumerate(items)}
+            removed: Set[int] = set()
+            for item_id, item_patch in value.items():
+                i = index.get(item_id)
+                if item_patch is None:
+                    if i is not None:
+                        removed.add(i)
+                    result.touch(field, item_id)
+                    continue
+                if not isinstance(item_patch, dict):
+                    raise PatchError(f"{field}.{item_id} must be an object or null")
+                if i is None:
+                    items.append(_merge({"id": item_id}, item_patch))
+                    index[item_id] = len(items) - 1
+                else:
+                    items[i] = _merge(items[i], item_patch)
+                    items[i]["id"] = item_id
+                result.touch(field, item_id)
+            if removed:
+                state[field] = [it for i, it in enumerate(items) if i not in removed]
+            continue
+        if value is None:
+            raise PatchError(f"field '{field}' cannot be removed")
+        if field in _ID_LISTS and not isinstance(value, list):
+            raise PatchError(f"{field} must be an array or an object keyed by id")
+        state[field] = _merge(state.get(field), value)
+        result.touch(field)
+    return result
+
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def _split_pointer(path: Any) -> List[str]:
+    if not isinstance(path, str) or not path.startswith("/"):
+        raise PatchError(f"invalid JSON pointer: {path!r}")
+    tokens = [_unescape(t) for t in path[1:].split("/")]
+    _check_field(tokens[0])
+    return tokens
+
+
+def _list_index(container: List[Any], token: str, *, for_insert: bool, by_id: bool) -> int:
+    if for_insert and token == "-":
+        return len(container)
+    if token.isdigit() and (token == "0" or not token.startswith("0")):
+        i = int(token)
+        limit = len(container) + (1 if for_insert else 0)
+        if i >= limit:
+            raise PatchError(f"index {i} out of range")
+        return i
+    if by_id:
+        for i, it in enumerate(container):
+            if isinstance(it, dict) and it.get("id") == token:
+                return i
+    raise PatchError(f"no element '{token}'")
+
+
+def _resolve_parent(state: Dict[str, Any], tokens: List[str], *, for_insert: bool) -> Tuple[Any, Any]:
+    """(親コンテナ, キー or インデックス) を返す"""
+    node: Any = state
+    for depth, token in enumerate(tokens[:-1]):
+        if isinstance(node, list):
+            node = node[_list_index(node, token, for_insert=False, by_id=depth == 1)]
+        elif isinstance(node, dict):
+            if token not in node:
+                raise PatchError(f"path not found: /{'/'.join(tokens[: depth + 1])}")
+            node = node[token]
+        else:
+            raise PatchError(f"cannot traverse into /{'/'.join(tokens[:depth])}")
+    last = tokens[-1]
+    if isinstance(node, list):
+        return node, _list_index(node, last, for_insert=for_insert, by_id=len(tokens) == 2)
+    if isinstance(node, dict):
+        return node, last
+    raise PatchError(f"cannot traverse into /{'/'.join(tokens[:-1])}")
+
+
+def _get(state: Dict[str, Any], tokens: List[str]) -> Any:
+    parent, key = _resolve_parent(state, tokens, for_insert=False)
+    if isinstance(parent, dict) and key not in parent:
+        raise PatchError(f"path not found: /{'/'.join(tokens)}")
+    return parent[key]
+
+
+def _add(state: Dict[str, Any], tokens: List[str], value: Any) -> None:
+    parent, key = _resolve_parent(state, tokens, for_insert=True)
+    if isinstance(parent, list):
+        parent.insert(key, value)
+    else:
+        parent[key] = value
+
+
+def _remove(state: Dict[str, Any], tokens: List[str]) -> Any:
+    if len(tokens) == 1:
+        raise PatchError(f"field '{tokens[0]}' cannot be removed")
+    parent, key = _resolve_parent(state, tokens, for_insert=False)
+    if isinstance(parent, dict) and key not in parent:
+        raise PatchError(f"path not found: /{'/'.join(tokens)}")
+    return parent.pop(key)
+
+
+def _touch_path(state: Dict[str, Any], tokens: List[str], result: PatchResult) -> None:
+    section = tokens[0]
+    if len(tokens) == 1:
+        result.touch(section)
+        return
+    if section == "episodes":
+        items = state.get("episodes") or []
+        try:
+            i = _list_index(items, tokens[1], for_insert=False, by_id=True)
+        except PatchError:
+            # 削除済み、または末尾追加（"-"）
+            result.touch(section, tokens[1] if tokens[1] != "-" else (items[-1].get("id") if items else None))
+            return
+        result.touch(section, items[i].get("id"))
+        return
+    result.sections.add(section)
+
+
+def apply_json_patch(state: Dict[str, Any], operations: Any) -> PatchResult:
+    if not isinstance(operations, list):
+        raise PatchError("JSON Patch must be an array of operations")
+    result = PatchResult()
+    for op in operations:
+        if not isinstance(op, dict) or "op" not in op or "path" not in op:
+            raise PatchError("each operation needs 'op' and 'path'")
+        kind = op["op"]
+        tokens = _split_pointer(op["path"])
+        if kind == "test":
+            if _get(state, tokens) != op.get("value"):
+                raise PatchTestFailed(f"test failed at {op['path']}")
+            continue
+        if kind in ("add", "replace") and "value" not in op:
+            raise PatchError(f"'{kind}' needs 'value'")
+        if kind == "add":
+            if len(tokens) == 1:
+                state[tokens[0]] = copy.deepcopy(op["value"])
+            else:
+                _add(state, tokens, copy.deepcopy(op["value"]))
+        elif kind == "remove":
+            _touch_path(state, tokens, result)
+            _remove(state, tokens)
+            continue
+        elif kind == "replace":
+            if len(tokens) == 1:
+                state[tokens[0]] = copy.deepcopy(op["value"])
+            else:
+                _get(state, tokens)
+                parent, key = _resolve_parent(state, tokens, for_insert=False)
+                parent[key] = copy.deepcopy(op["value"])
+        elif kind in ("move", "copy"):
+            from_tokens = _split_pointer(op.get("from"))
+            if kind == "move":
+                _touch_path(state, from_tokens, result)
+                value = _remove(state, from_tokens)
+            else:
+                value = copy.deepcopy(_get(state, from_tokens))
+            _add(state, tokens, value)
+        else:
+            raise PatchError(f"unsupported op '{kind}'")
+        _touch_path(state, tokens, result)
+    return result
@@ -0,0 +1,62 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient
+from api import chat as chat_api
+from core import admission
+from main import app
+
+
+client = TestClient(app)
+
+
+def _fake_llm(monkeypatch, delay: float = 0.0):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-admission-test")
+    monkeypatch.setenv("CHAT_LLM_PROVIDER", "openai")
+    monkeypatch.setattr(chat_api, "_chat_response_text", lambda **kwargs: time.sleep(delay) or "ok")
+
+
+def test_token_bucket_refills():
+    bucket = admission.TokenBucket(per_minute=60, burst=2)
+    assert bucket.take()[0] and bucket.take()[0]
+    ok, retry_after = bucket.take()
+    assert not ok and 0 < retry_after <= 1.0
+
+
+def test_per_user_limit_returns_429_with_retry_after(monkeypatch):
+    admission.reset()
+    _fake_llm(monkeypatch)
+    monkeypatch.setenv("RATE_LIMIT_USER_PER_MIN", "6")
+    monkeypatch.setenv("RATE_LIMIT_USER_BURST", "2")
+    body = {"message": "了解", "userId": "admission_user", "use_memory": False}
+    statuses = [client.post("/api/chat/message", json=body).status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+    res = client.post("/api/chat/message", json=body)
+    assert res.status_code == 429 and int(res.headers["retry-after"]) >= 1
+    # 別ユーザーには影響しない
+    assert client.post("/api/chat/message", json={**body, "userId": "admission_other"}).status_code == 200
+
+
+def test_global_concurrency_sheds_load(monkeypatch):
+    admission.reset()
+    _fake_llm(monkeypatch, delay=0.4)
+    monkeypatch.setenv("LLM_MAX_CONCURRENCY", "1")
+    monkeypatch.setenv("LLM_QUEUE_SIZE", "0")
+    statuses = []
+
+    def send(i):
+        with TestClient(app) as c:
+            res = c.post("/api/chat/message", json={"message": "ありがとう", "userId": f"admission_load_{i}", "use_memory": False})
+            statuses.append(res.status_code)
+
+    threads = [threading.Thread(target=send, args=(i,)) for i in range(3)]
+    for t in threads:
+        t.start()
+        time.sleep(0.05)
+    for t in threads:
+        t.join()
+    assert sorted(statuses) == [200, 429, 429]
@@ -0,0 +1,39 @@
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks import bench_service
+from benchmarks.synthetic import synthetic_episodes
+
+
+def test_synthetic_history_is_deterministic_and_mixed_language():
+    a = synthetic_episodes(50, seed=3)
+    b = synthetic_episodes(50, seed=3)
+    assert [e["id"] for e in a] == [e["id"] for e in b]
+    assert [e["user_message"] for e in a] == [e["user_message"] for e in b]
+    assert all(len(e["embedding"]) == 96 for e in a)
+    messages = " ".join(e["user_message"] for e in a)
+    assert any("぀" <= ch <= "ヿ" for ch in messages)
+    assert any("a" <= ch <= "z" for ch in messages)
+
+
+def test_service_benchmark_runs_and_compares(tmp_path):
+    results = bench_service.run([10], repeat=1, only=["get_state", "apply_turn", "record_feedback"])
+    assert set(results) == {"get_state[10]", "apply_turn[10]", "record_feedback[10]"}
+    assert all(r["median_ms"] > 0 and r["peak_kib"] > 0 for r in results.values())
+
+    baseline = tmp_path / "service.json"
+    bench_service.save_baseline(results, baseline)
+    slower = {k: {**v, "median_ms": v["median_ms"] * 10} for k, v in results.items()}
+    assert set(bench_service.compare(slower, threshold=1.25, path=baseline)) == set(results)
+    assert bench_service.compare(results, threshold=1.25, path=baseline) == []
+    assert bench_service.compare({**results, "get_state[99]": results["get_state[10]"]}, threshold=1.25, path=baseline) == ["get_state[99]"]
+
+
+def test_stored_baseline_covers_every_case():
+    stored = set(json.loads(bench_service.BASELINE_PATH.read_text(encoding="utf-8"))["results"])
+    sizes = [int(s) for s in bench_service.DEFAULT_SIZES.split(",")]
+    expected = {name if not per_size else f"{name}[{size}]" for name, per_size in bench_service.CASES for size in sizes}
+    assert expected <= stored
@@ -0,0 +1,67 @@
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core import circuit_breaker
+from core.circuit_breaker import Endpoint, call_with_fallback
+
+
+@pytest.fixture(autouse=True)
+def _fresh_breakers(monkeypatch):
+    monkeypatch.setenv("LLM_BREAKER_FAILURES", "3")
+    monkeypatch.setenv("LLM_BREAKER_COOLDOWN", "0.2")
+    monkeypatch.delenv("LLM_HEDGE", raising=False)
+    circuit_breaker.reset()
+    yield
+    circuit_breaker.reset()
+
+
+def _failing(calls):
+    def call():
+        calls.append(1)
+        raise RuntimeError("provider down")
+
+    return call
+
+
+def test_open_circuit_skips_bad_endpoint_until_cooldown():
+    calls = []
+    endpoints = [Endpoint("bad", _failing(calls)), Endpoint("good", lambda: "ok")]
+    for _ in range(5):
+        assert call_with_fallback(endpoints) == "ok"
+    # 3 回失敗した時点で開き、以降は呼ばれない
+    assert len(calls) == 3
+    assert circuit_breaker.breaker("bad").state == circuit_breaker.OPEN
+
+    time.sleep(0.25)
+    assert call_with_fallback([Endpoint("bad", lambda: "recovered"), Endpoint("good", lambda: "ok")]) == "recovered"
+    assert circuit_breaker.breaker("bad").state == circuit_breaker.CLOSED
+
+
+def test_all_circuits_open_fails_fast():
+    calls = []
+    endpoints = [Endpoint("only", _failing(calls))]
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            call_with_fallback(endpoints)
+    with pytest.raises(circuit_breaker.CircuitOpenError):
+        call_with_fallback(endpoints)
+    assert len(calls) == 3
+
+
+def test_hedged_request_takes_the_faster_backup(monkeypatch):
+    monkeypatch.setenv("LLM_HEDGE", "1")
+    monkeypatch.setenv("LLM_HEDGE_DELAY", "0.05")
+
+    def slow():
+        time.sleep(1.0)
+        return "slow"
+
+    start = time.perf_counter()
+    assert call_with_fallback([Endpoint("slow_primary", slow), Endpoint("fast_backup", lambda: "fast")]) == "fast"
+    assert time.perf_counter() - start < 0.5
+    assert circuit_breaker.HEDGED_REQUESTS.value(endpoint="fast_backup", winner="hedge") >= 1
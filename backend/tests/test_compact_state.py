@@ -0,0 +1,69 @@
+import copy
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient
+from benchmarks.bench_service import owned_bytes
+from benchmarks.synthetic import synthetic_state
+from core import serialization
+from main import app
+from services.compact_state import CompactState
+from services.pocket_coo_service import project_state, seeded_demo_state
+
+
+client = TestClient(app)
+
+
+def _odd_state() -> dict:
+    state = seeded_demo_state("demo_compact")
+    episodes = state["episodes"]
+    del episodes[0]["feedback"]
+    episodes[1]["custom"] = {"nested": [1, 2]}
+    episodes[2]["embedding"] = [300] + episodes[2]["embedding"][1:]
+    episodes[3]["embedding"] = None
+    episodes[4]["feedback"] = {"rating": "like", "comment": "ok"}
+    return state
+
+
+def test_roundtrip_and_projection_match_dict_state():
+    state = _odd_state()
+    compact = CompactState.from_state(copy.deepcopy(state))
+    assert compact.to_state() == state
+
+    cases = [
+        {},
+        {"include_embeddings": True},
+        {"limit": 5},
+        {"limit": 3, "before": state["episodes"][10]["id"]},
+        {"fields": {"score": None, "episodes": ["id", "summary", "custom", "embedding"]}, "limit": 4, "before": state["episodes"][5]["id"]},
+        {"fields": {"identity": None}},
+    ]
+    for kwargs in cases:
+        assert compact.project(**kwargs) == project_state(state, **kwargs), kwargs
+
+    # 返した dict を書き換えてもキャッシュ側は変わらない
+    view = compact.to_state()
+    view["identity"]["profile"]["name"] = "changed"
+    view["episodes"][4]["feedback"]["rating"] = "dislike"
+    view["episodes"][5]["tags"].append("x")
+    assert compact.to_state() == state
+
+
+def test_compact_state_uses_much_less_memory():
+    state = serialization.loads(serialization.dumps_bytes(synthetic_state("mem_user", episodes=2000, seed=3)))
+    compact = CompactState.from_state(state)
+    assert len(compact) == 2000
+    assert owned_bytes(compact) < owned_bytes(state) / 2
+
+
+def test_read_api_serves_cached_state_until_version_changes():
+    assert client.post("/api/chat", json={"message": "箇条書きで 1", "userId": "compact_api"}).status_code == 200
+    first = client.get("/api/user/compact_api?limit=1").json()
+    assert client.get("/api/user/compact_api?limit=1").json() == first
+
+    assert client.post("/api/chat", json={"message": "箇条書きで 2", "userId": "compact_api"}).status_code == 200
+    second = client.get("/api/memory?userId=compact_api&limit=1").json()
+    assert second["episodeCount"] == first["episodeCount"] + 1
+    assert second["episodes"][0]["id"] != first["episodes"][0]["id"]
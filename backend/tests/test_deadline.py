@@ -0,0 +1,113 @@
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient
+from api import chat as chat_api
+from core import circuit_breaker, deadline
+from core.circuit_breaker import Endpoint
+from main import app
+
+
+client = TestClient(app)
+
+
+def _fake_llm(monkeypatch, delay: float = 0.0):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-deadline-test")
+    monkeypatch.setenv("CHAT_LLM_PROVIDER", "openai")
+    monkeypatch.setattr(chat_api, "_chat_response_text", lambda **kwargs: time.sleep(delay) or "ok")
+
+
+def test_timeouts_are_clipped_to_remaining_budget():
+    assert deadline.timeout(10.0) == 10.0
+    with deadline.scope(1.0):
+        assert deadline.timeout(10.0) <= 1.0
+        assert deadline.allow_optional("memu_retrieval", need=5.0) is False
+        assert deadline.degraded() == ["memu_retrieval"]
+    assert deadline.degraded() == []
+
+
+def test_low_budget_skips_optional_stages(monkeypatch):
+    _fake_llm(monkeypatch)
+    res = client.post(
+        "/api/chat/message",
+        json={"message": "前回の続き", "userId": "deadline_user"},
+        headers={"X-Request-Timeout": "3"},
+    )
+    assert res.status_code == 200
+    assert res.json()["degraded"] == ["mem0_search"]
+
+    _fake_llm(monkeypatch, delay=0.3)
+    res = client.post("/api/chat", json={"message": "了解", "userId": "deadline_user"}, headers={"X-Request-Timeout": "2"})
+    assert res.status_code == 200
+    assert res.json()["degraded"] == ["identity_enrichment"]
+
+    res = client.post("/api/chat", json={"message": "了解", "userId": "deadline_user"})
+    assert res.json()["degraded"] == []
+
+
+def test_deadline_timeout_does_not_trip_breaker():
+    circuit_breaker.reset()
+
+    def slow():
+        time.sleep(deadline.timeout(5.0))
+        raise TimeoutError("read timeout")
+
+    with deadline.scope(0.2):
+        with pytest.raises(deadline.DeadlineExceeded):
+            circuit_breaker.call_with_fallback([Endpoint("slow", slow), Endpoint("next", lambda: "never")])
+    assert circuit_breaker.breaker("slow").failures == 0
+
+
+def test_hedged_calls_see_the_request_deadline(monkeypatch):
+    circuit_breaker.reset()
+    monkeypatch.setenv("LLM_HEDGE", "1")
+    monkeypatch.setenv("LLM_HEDGE_DELAY", "5")
+    seen = []
+
+    def slow():
+        seen.append(deadline.timeout(30.0))
+        time.sleep(seen[-1])
+        raise TimeoutError("read timeout")
+
+    start = time.perf_counter()
+    with deadline.scope(0.3):
+        with pytest.raises(deadline.DeadlineExceeded):
+            circuit_breaker.call_with_fallback([Endpoint("hedge_slow", slow), Endpoint("hedge_next", slow)])
+    # ヘッジの待ち（5 秒）も締め切りで打ち切られ、ワーカー側のタイムアウトも切り詰められる
+    assert time.perf_counter() - start < 1.0
+    assert seen and seen[0] <= 0.3
+    time.sleep(0.4)
+    assert circuit_breaker.breaker("hedge_slow").failures == 0
+
+
+def test_memuu_retrieve_followers_wait_only_until_their_deadline(monkeypatch):
+    import threading
+    from services.memu_service import MemUService
+
+    monkeypatch.setenv("MEMUU_API_KEY", "memuu-deadline-test")
+    svc = MemUService()
+    started = threading.Event()
+
+    def slow_post(path, payload):
+        started.set()
+        time.sleep(0.6)
+        return {"items": [{"content": "朝型", "memory_type": "profile"}]}
+
+    monkeypatch.setattr(svc, "_memuu_post", slow_post)
+    leader_result = []
+    leader = threading.Thread(target=lambda: leader_result.append(svc.retrieve_memories(query="q", user_id="u_dl")))
+    leader.start()
+    assert started.wait(1.0)
+
+    start = time.perf_counter()
+    with deadline.scope(0.1):
+        assert svc.retrieve_memories(query="q", user_id="u_dl") == []
+        assert deadline.degraded() == ["memuu_retrieve"]
+    assert time.perf_counter() - start < 0.4
+    leader.join()
+    assert [m["memory"] for m in leader_result[0]] == ["朝型"]
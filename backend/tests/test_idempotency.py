@@ -0,0 +1,87 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient
+from api import chat as chat_api
+from core import idempotency
+from core.singleflight import SingleFlight
+from main import app
+
+
+client = TestClient(app)
+
+
+def _fake_llm(monkeypatch, delay: float = 0.0):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-idempotency-test")
+    monkeypatch.setenv("CHAT_LLM_PROVIDER", "openai")
+    calls = []
+
+    def fake_chat_response_text(**kwargs):
+        calls.append(kwargs["user_message"])
+        time.sleep(delay)
+        return f"reply #{len(calls)}"
+
+    monkeypatch.setattr(chat_api, "_chat_response_text", fake_chat_response_text)
+    return calls
+
+
+def test_single_flight_shares_result():
+    flight = SingleFlight()
+    started, results = threading.Event(), []
+
+    def slow():
+        started.set()
+        time.sleep(0.2)
+        return object()
+
+    leader = threading.Thread(target=lambda: results.append(flight.do("k", slow)))
+    leader.start()
+    started.wait()
+    results.append(flight.do("k", lambda: "should not run"))
+    leader.join()
+    assert results[0] is results[1]
+    assert len(flight) == 0
+
+
+def test_retry_replays_without_second_llm_call_or_episode(monkeypatch):
+    idempotency.reset()
+    calls = _fake_llm(monkeypatch)
+    body = {"message": "了解、いつもの感じで", "userId": "idem_user"}
+    headers = {"Idempotency-Key": "retry-1", "Cache-Control": "no-cache"}
+
+    first = client.post("/api/chat", json=body, headers=headers)
+    second = client.post("/api/chat", json=body, headers=headers)
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json()
+    assert second.headers.get("idempotent-replayed") == "true"
+    assert len(calls) == 1
+    state = client.get("/api/user/idem_user").json()
+    assert len(state["episodes"]) == 1
+
+    conflict = client.post("/api/chat", json={**body, "message": "別の内容"}, headers=headers)
+    assert conflict.status_code == 422
+
+
+def test_concurrent_duplicates_wait_for_in_flight(monkeypatch):
+    idempotency.reset()
+    calls = _fake_llm(monkeypatch, delay=0.3)
+    body = {"message": "ありがとう", "userId": "idem_concurrent", "use_memory": False}
+    headers = {"Idempotency-Key": "concurrent-1", "Cache-Control": "no-cache"}
+    responses = []
+
+    def send():
+        with TestClient(app) as c:
+            responses.append(c.post("/api/chat/message", json=body, headers=headers))
+
+    threads = [threading.Thread(target=send) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert [r.status_code for r in responses] == [200, 200, 200]
+    assert len({r.json()["response"] for r in responses}) == 1
+    assert len(calls) == 1
@@ -0,0 +1,94 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient
+from api import chat as chat_api
+from core.dependencies import get_memu_service
+from main import app
+from services.memory_extraction import parse_reply_with_facts
+
+
+client = TestClient(app)
+
+
+def test_parse_reply_with_facts():
+    reply, facts = parse_reply_with_facts('```json\n{"reply": "了解です", "facts": ["箇条書きが好き", "箇条書きが好き", ""]}\n```')
+    assert reply == "了解です"
+    assert facts == ["箇条書きが好き"]
+    assert parse_reply_with_facts("ただのテキスト") == ("ただのテキスト", None)
+
+
+def test_message_stores_inline_facts_without_extraction_call(monkeypatch):
+    monkeypatch.setenv("CHAT_INLINE_EXTRACTION", "1")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-inline-test")
+    calls = []
+
+    def fake_chat_response_text(*, system_prompt, user_message, temperature, use_cache=True):
+        calls.append(system_prompt)
+        return '{"reply": "OK、毎朝7時に送ります", "facts": ["毎朝7時にレポートが欲しい"]}'
+
+    monkeypatch.setattr(chat_api, "_chat_response_text", fake_chat_response_text)
+    memu = get_memu_service()
+
+    def no_add_memory(*args, **kwargs):
+        raise AssertionError("add_memory should not be called in inline mode")
+
+    monkeypatch.setattr(memu, "add_memory", no_add_memory)
+    res = client.post("/api/chat/message", json={"message": "毎朝7時にレポートを送って", "userId": "inline_user", "use_memory": False})
+    assert res.status_code == 200
+    assert res.json()["response"] == "OK、毎朝7時に送ります"
+    assert len(calls) == 1 and '"facts"' in calls[0]
+    assert any(m["memory"] == "毎朝7時にレポートが欲しい" for m in memu.get_all_memories("inline_user"))
+
+
+def test_repeated_inline_facts_are_stored_once(monkeypatch):
+    monkeypatch.setenv("CHAT_INLINE_EXTRACTION", "1")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-inline-test")
+    cache_flags = []
+
+    def fake_chat_response_text(*, system_prompt, user_message, temperature, use_cache=True):
+        cache_flags.append(use_cache)
+        return '{"reply": "了解", "facts": ["週次レポートは金曜に欲しい"]}'
+
+    monkeypatch.setattr(chat_api, "_chat_response_text", fake_chat_response_text)
+    for _ in range(2):
+        res = client.post("/api/chat/message", json={"message": "了解", "userId": "inline_dedupe", "use_memory": False})
+        assert res.status_code == 200
+    assert cache_flags == [False, False]
+    stored = [m for m in get_memu_service().get_all_memories("inline_dedupe") if m["memory"] == "週次レポートは金曜に欲しい"]
+    assert len(stored) == 1
+
+
+def test_add_facts_skips_facts_already_in_the_vector_store(monkeypatch):
+    from types import SimpleNamespace
+    from services.memu_service import MemUService
+
+    class FakeStore:
+        def __init__(self):
+            self.rows = []
+
+        def search(self, query, limit=5, filters=None):
+            def cosine(a, b):
+                return sum(x * y for x, y in zip(a, b)) / ((sum(x * x for x in a) * sum(y * y for y in b)) ** 0.5)
+
+            hits = [SimpleNamespace(score=cosine(query, v), payload=p) for v, p in self.rows if p["user_id"] == filters["user_id"]]
+            return sorted(hits, key=lambda h: -h.score)[:limit]
+
+        def insert(self, vectors, ids, payloads):
+            self.rows.extend(zip(vectors, payloads))
+
+    vectors = {"朝型": [1.0, 0.0], "朝型です": [0.99, 0.05], "夜は会議不可": [0.0, 1.0]}
+    memory = SimpleNamespace(
+        embedding_model=SimpleNamespace(embed=lambda t: vectors[t]),
+        vector_store=FakeStore(),
+        db=SimpleNamespace(add_history=lambda *a, **k: None),
+    )
+    svc = MemUService()
+    monkeypatch.setattr(svc, "_mem0", lambda: memory)
+
+    assert [m["memory"] for m in svc.add_facts(["朝型", "朝型"], user_id="u1")] == ["朝型"]
+    assert [m["memory"] for m in svc.add_facts(["朝型", "朝型です", "夜は会議不可"], user_id="u1")] == ["夜は会議不可"]
+    assert [m["memory"] for m in svc.add_facts(["朝型"], user_id="u2")] == ["朝型"]
+    assert len(memory.vector_store.rows) == 3
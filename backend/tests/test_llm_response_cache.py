@@ -0,0 +1,84 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient
+from api import chat as chat_api
+from core import circuit_breaker, metrics
+from loadtest.stubs import LatencyProfile, StubBehavior, StubConfig, StubServer
+from main import app
+
+
+client = TestClient(app)
+
+
+def test_identical_prompt_is_served_from_cache_and_bypassable(monkeypatch):
+    config = StubConfig(
+        anthropic=StubBehavior(LatencyProfile.parse("fixed:0")),
+        openai=StubBehavior(LatencyProfile.parse("fixed:0")),
+        memu=StubBehavior(LatencyProfile.parse("fixed:0")),
+    )
+    stub = StubServer(config).start()
+    chat_api._response_cache.clear()
+    circuit_breaker.reset()
+    try:
+        for k, v in stub.backend_env().items():
+            monkeypatch.setenv(k, v)
+        monkeypatch.delenv("MEMUU_API_KEY")
+        hits = metrics.LLM_CACHE_REQUESTS.value(result="hit")
+
+        def ask(message, **headers):
+            res = client.post("/api/chat/message", json={"message": message, "userId": "cache_user", "use_memory": False}, headers=headers)
+            assert res.status_code == 200
+            return res.json()["response"]
+
+        first = ask("いつもの感じで")
+        assert ask("  いつもの感じで ") == first
+        assert metrics.LLM_CACHE_REQUESTS.value(result="hit") == hits + 1
+        assert config.counts[("anthropic", 200)] == 1
+
+        ask("いつもの感じで", **{"Cache-Control": "no-cache"})
+        assert config.counts[("anthropic", 200)] == 2
+    finally:
+        stub.stop()
+        chat_api._response_cache.clear()
+
+
+def test_cache_key_separates_max_tokens():
+    from functools import partial
+    from core.circuit_breaker import Endpoint
+
+    def endpoints(max_tokens):
+        return [Endpoint("openai_primary", partial(chat_api._openai_chat_completion, model="gpt-small", max_tokens=max_tokens))]
+
+    key = lambda max_tokens: chat_api._response_cache_key("openai", endpoints(max_tokens), 0.7, "system", "了解")
+    assert key(128) == key(128)
+    assert key(128) != key(None)
+
+
+def test_response_metrics_are_labelled_with_the_endpoint_that_answered(monkeypatch):
+    monkeypatch.setenv("CHAT_LLM_PROVIDER", "openai")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-primary-test")
+    monkeypatch.setenv("OPENAI_API_KEY_BACKUP", "sk-backup-test")
+    monkeypatch.setenv("LLM_ROUTER", "0")
+
+    def fake_completion(*, api_key, base_url, model, messages, temperature, max_tokens=None):
+        if api_key == "sk-primary-test":
+            raise RuntimeError("primary down")
+        return "from backup"
+
+    monkeypatch.setattr(chat_api, "_openai_chat_completion", fake_completion)
+    chat_api._response_cache.clear()
+    circuit_breaker.reset()
+    before = {c: metrics.LLM_RESPONSES.value(source="openai_backup", cache=c) for c in ("miss", "hit")}
+    try:
+        for _ in range(2):
+            res = client.post("/api/chat/message", json={"message": "了解", "userId": "source_user", "use_memory": False})
+            assert res.json()["response"] == "from backup"
+        assert metrics.LLM_RESPONSES.value(source="openai_backup", cache="miss") == before["miss"] + 1
+        assert metrics.LLM_RESPONSES.value(source="openai_backup", cache="hit") == before["hit"] + 1
+        assert metrics.LLM_RESPONSES.value(source="openai_primary", cache="miss") == 0
+    finally:
+        chat_api._response_cache.clear()
+        circuit_breaker.reset()
@@ -0,0 +1,57 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient
+from loadtest.run import percentile
+from loadtest.stubs import LatencyProfile, StubBehavior, StubConfig, StubServer
+from main import app
+
+
+client = TestClient(app)
+
+
+def test_backend_talks_to_stubs_through_base_url_env(monkeypatch):
+    config = StubConfig(
+        anthropic=StubBehavior(LatencyProfile.parse("fixed:0"), error_rate=1.0, error_status=529),
+        openai=StubBehavior(LatencyProfile.parse("uniform:0:1")),
+        memu=StubBehavior(LatencyProfile.parse("fixed:0")),
+        seed=1,
+    )
+    stub = StubServer(config).start()
+    try:
+        for k, v in stub.backend_env().items():
+            monkeypatch.setenv(k, v)
+        res = client.post("/api/chat", json={"message": "箇条書きで", "userId": "loadtest_stub_user"})
+        assert res.status_code == 200
+        assert res.json()["response"]
+    finally:
+        stub.stop()
+    # Anthropic は全部失敗させたので OpenAI にフォールバックしている
+    assert config.counts.get(("anthropic", 529), 0) >= 1
+    assert config.counts.get(("openai", 200), 0) == 1
+    assert config.counts.get(("memu", 200), 0) >= 1
+
+
+def test_latency_spec_and_percentile():
+    assert LatencyProfile.parse("lognormal:800:0.5").kind == "lognormal"
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 99) == 99.0
+
+
+def test_backend_env_points_every_provider_url_at_the_stub():
+    import re
+
+    stub = StubServer()
+    env = stub.backend_env()
+    backend = Path(__file__).resolve().parents[1]
+    source = "".join((backend / p).read_text(encoding="utf-8") for p in ("api/chat.py", "services/memu_service.py"))
+    url_vars = set(re.findall(r'"([A-Z_]+_BASE_URL(?:_BACKUP)?)"', source))
+    assert url_vars and url_vars <= set(env)
+    assert all(env[k].startswith(stub.url) for k in url_vars)
+    # キーがあるプロバイダーは必ずスタブの URL を持つ
+    for key in (k for k in env if "_API_KEY" in k):
+        assert env[key.replace("_API_KEY", "_BASE_URL")].startswith(stub.url)
+    stub.httpd.server_close()
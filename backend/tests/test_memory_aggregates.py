@@ -0,0 +1,56 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient
+from main import app
+from services.memory_aggregates import add_episode, build_aggregates
+from services.pocket_coo_service import seeded_demo_state, _build_turn_episode
+
+
+client = TestClient(app)
+
+
+def test_incremental_update_matches_full_rebuild():
+    state = seeded_demo_state("demo_aggregates")
+    aggregates = build_aggregates(state)
+    for text in ["SLOと監視の見直し", "価格テストの結果を整理", "北極星指標のダッシュボード"]:
+        episode = _build_turn_episode(text, "了解", [])
+        state["episodes"].append(episode)
+        aggregates = add_episode(aggregates, state, episode)
+
+    rebuilt = build_aggregates(state)
+    assert aggregates["episodeCount"] == rebuilt["episodeCount"] == 113
+    assert aggregates["topics"] == rebuilt["topics"]
+    assert aggregates["tags"] == rebuilt["tags"]
+    assert aggregates["graph"]["nodes"] == rebuilt["graph"]["nodes"]
+    assert aggregates["graph"]["neighbors"] == rebuilt["graph"]["neighbors"]
+
+
+def test_graph_endpoint_tracks_turns():
+    user_id = "graph_user"
+    for message in ["SLOと監視を整えたい", "監視のアラート閾値を決めたい", "価格の案を3つ"]:
+        assert client.post("/api/chat", json={"message": message, "userId": user_id}).status_code == 200
+
+    res = client.get(f"/api/memory/graph?userId={user_id}")
+    assert res.status_code == 200
+    body = res.json()
+    assert body["episodeCount"] == 3
+    assert len(body["graph"]["nodes"]) == 3
+    assert {"name": "監視", "count": 2} in body["topics"]
+    assert all(set(e.keys()) == {"source", "target", "similarity"} for e in body["graph"]["edges"])
+    assert "embedding" not in res.text
+
+    assert client.get(
+        f"/api/memory/graph?userId={user_id}", headers={"If-None-Match": res.headers["etag"]}
+    ).status_code == 304
+
+
+def test_graph_endpoint_for_demo_user():
+    res = client.get("/api/memory/graph?userId=demo_graph&top=5&maxNodes=50")
+    assert res.status_code == 200
+    body = res.json()
+    assert body["episodeCount"] == 110
+    assert len(body["topics"]) == 5
+    assert len(body["graph"]["nodes"]) == 50
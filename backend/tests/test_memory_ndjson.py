@@ -0,0 +1,64 @@
+import io
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient
+from main import app
+from services.state_export import NDJSONImporter, StateImportError
+from tools.memory_ndjson import export_user, import_user
+
+
+client = TestClient(app)
+
+
+def _seed(user_id: str, turns: int = 3) -> None:
+    for i in range(turns):
+        res = client.post("/api/chat", json={"message": f"箇条書きで ターン{i}", "userId": user_id})
+        assert res.status_code == 200
+
+
+def test_export_import_roundtrip_via_api():
+    _seed("ndjson_src")
+    res = client.get("/api/user/ndjson_src/export")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("application/x-ndjson")
+    records = [json.loads(line) for line in res.content.splitlines()]
+    assert records[0]["type"] == "header" and records[-1]["type"] == "end"
+    assert sum(r["type"] == "episode" for r in records) == 3
+
+    res = client.post("/api/user/ndjson_dst/import", content=res.content, headers={"Content-Type": "application/x-ndjson"})
+    assert res.status_code == 200 and res.json()["episodes"] == 3
+    src = client.get("/api/user/ndjson_src").json()
+    dst = client.get("/api/user/ndjson_dst").json()
+    assert [e["id"] for e in dst["episodes"]] == [e["id"] for e in src["episodes"]]
+    assert dst["identity"]["style"] == src["identity"]["style"]
+
+    # merge は未知のエピソードだけ足す
+    res = client.post("/api/user/ndjson_dst/import?mode=merge", content=client.get("/api/user/ndjson_src/export").content)
+    assert res.json()["episodes"] == 3
+
+
+def test_truncated_or_invalid_import_is_rejected():
+    _seed("ndjson_bad", turns=1)
+    body = client.get("/api/user/ndjson_bad/export").content
+    truncated = b"\n".join(body.splitlines()[:-1])
+    res = client.post("/api/user/ndjson_bad2/import", content=truncated)
+    assert res.status_code == 400 and "missing end record" in res.json()["detail"]
+
+    importer = NDJSONImporter("x")
+    with pytest.raises(StateImportError, match="line 2"):
+        importer.feed(body.splitlines()[0] + b'\n{"type": "episode", "data": {"id": "e1"}}\n')
+
+
+def test_cli_roundtrip_in_small_chunks(monkeypatch):
+    _seed("ndjson_cli", turns=2)
+    buf = io.BytesIO()
+    export_user("ndjson_cli", buf)
+    monkeypatch.setattr("tools.memory_ndjson.READ_BYTES", 7)
+    buf.seek(0)
+    assert import_user("ndjson_cli_copy", buf) == {"projects": 0, "episodes": 2}
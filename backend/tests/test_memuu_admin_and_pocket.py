@@ -121,3 +121,52 @@ def test_pocket_chat_applies_memuu_identity_hints(monkeypatch):
             os.environ.pop("API_KEY", None)
         else:
             os.environ["API_KEY"] = prev_api_key
+
+
+def _applied(user_id):
+    from db.session import SessionLocal
+    from services.pocket_coo_service import PocketCOOService
+
+    db = SessionLocal()
+    try:
+        return PocketCOOService(db).get_state(user_id).get("memuApplied")
+    finally:
+        db.close()
+
+
+def test_pocket_chat_skips_already_applied_memuu_items(monkeypatch):
+    monkeypatch.setenv("MEMUU_API_KEY", "dummy_key")
+    monkeypatch.setenv("MEMUU_BASE_URL", "https://api.memu.so")
+    monkeypatch.setenv("MEMUU_AGENT_ID", "personalos")
+
+    import services.memu_service as memu_mod
+
+    items = [{"memory_type": "preference", "content": "ユーザーは箇条書きを好む"}]
+
+    class _Client(_FakeClient):
+        def post(self, url, headers=None, json=None):
+            if url.endswith("/api/v3/memory/retrieve"):
+                return _FakeResponse({"items": list(items)})
+            return super().post(url, headers=headers, json=json)
+
+    monkeypatch.setattr(memu_mod.httpx, "Client", _Client)
+    user_id = "memuu_user_seen"
+
+    def chat(message):
+        res = client.post("/api/chat", json={"message": message, "userId": user_id})
+        assert res.status_code == 200
+        return res.json()["newMemory"]["identity"]
+
+    assert chat("これやっといて").get("style") == {"format": "bullet_points"}
+    updated_at = client.get(f"/api/user/{user_id}").json()["identity"]["updated_at"]
+
+    # 同じ記憶は 2 回目以降は反映しない（updated_at も動かない）
+    assert chat("次もお願い") == {}
+    state = client.get(f"/api/user/{user_id}").json()
+    assert state["identity"]["updated_at"] == updated_at
+    assert _applied(user_id) == [memu_mod.content_hash(items[0]["content"])]
+
+    # 新しく増えた記憶だけ反映する
+    items.append({"memory_type": "preference", "content": "丁寧な文体でお願い"})
+    assert chat("よろしく").get("style") == {"communication": "formal"}
+    assert len(_applied(user_id)) == 2
@@ -84,3 +84,35 @@ def test_memuu_disabled_when_no_key(monkeypatch):
 
     svc = MemUService()
     assert svc.retrieve_memories(query="x", user_id="u1") is None
+
+
+def test_writes_during_mem0_init_are_replayed_when_ready(monkeypatch):
+    import types
+    from types import SimpleNamespace
+    import services.memu_service as memu_mod
+
+    added = []
+    inserted = []
+    fake = SimpleNamespace(
+        add=lambda content, user_id, metadata: added.append((content, user_id)) or {"id": "m1"},
+        embedding_model=SimpleNamespace(embed=lambda t: [1.0, 0.0]),
+        vector_store=SimpleNamespace(search=lambda **kw: [], insert=lambda vectors, ids, payloads: inserted.extend(payloads)),
+        db=SimpleNamespace(add_history=lambda *a, **k: None),
+    )
+    monkeypatch.setitem(sys.modules, "mem0", types.SimpleNamespace(Memory=SimpleNamespace(from_config=lambda config: fake)))
+    monkeypatch.setenv("MEM0_INIT_WAIT", "0.01")
+
+    svc = MemUService()
+    svc._mem0_state = memu_mod.MEM0_INITIALIZING
+    svc.config["llm"]["config"]["api_key"] = "sk-test"
+    svc.add_memory("初期化中の記憶", user_id="u1")
+    svc.add_facts(["朝型"], user_id="u1")
+    dropped = svc.add_memory("消した記憶", user_id="u1")
+    assert svc.delete_memory(dropped["id"]) is True
+    assert len(svc.get_all_memories("u1")) == 2
+
+    svc._init_memory()
+    assert svc.readiness()["mem0"] == memu_mod.MEM0_READY
+    assert added == [("初期化中の記憶", "u1")]
+    assert [p["data"] for p in inserted] == ["朝型"]
+    assert svc._fallback_store["u1"] == []
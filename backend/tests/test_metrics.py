@@ -0,0 +1,40 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient
+from main import app
+from core.metrics import Histogram, Registry
+
+
+client = TestClient(app)
+
+
+def test_metrics_endpoint_exposes_stage_histograms_and_counters():
+    assert client.post("/api/chat", json={"message": "箇条書きで", "userId": "metrics_user"}).status_code == 200
+    assert client.get("/api/memory?userId=metrics_user").status_code == 200
+
+    res = client.get("/metrics")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = res.text
+    for stage in ("get_state", "load_state", "save_state", "apply_turn", "tokenize", "embed", "build_prompt_memories"):
+        assert f'pocketcoo_stage_duration_seconds_count{{stage="{stage}"}}' in text
+    assert "# TYPE pocketcoo_llm_provider_fallbacks_total counter" in text
+    assert "# TYPE pocketcoo_mem0_fallback_mode gauge" in text
+    assert 'pocketcoo_buffer_items{buffer="memuu_conversation"}' in text
+    assert 'route="/api/memory"' in text
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    h = registry.histogram("demo_seconds", "demo", buckets=(0.1, 1.0))
+    for v in (0.05, 0.5, 5.0):
+        h.observe(v, stage="x")
+    text = registry.render()
+    assert 'demo_seconds_bucket{stage="x",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{stage="x",le="1"} 2' in text
+    assert 'demo_seconds_bucket{stage="x",le="+Inf"} 3' in text
+    assert 'demo_seconds_count{stage="x"} 3' in text
+    assert isinstance(h, Histogram)
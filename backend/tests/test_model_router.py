@@ -0,0 +1,61 @@
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient
+from api import chat as chat_api
+from main import app
+from services.model_router import LARGE, SMALL, classify_turn, router_enabled
+
+
+client = TestClient(app)
+
+
+def test_classify_turn():
+    assert classify_turn("了解！").tier == SMALL
+    assert classify_turn("箇条書きで").reasons == ["style_update"]
+    assert classify_turn("来月のローンチ計画を立てて").tier == LARGE
+    assert classify_turn("Please draft a roadmap for Q3").tier == LARGE
+    assert "long_message" in classify_turn("あ" * 400).reasons
+    assert classify_turn("いつもの感じで", ["identity.style"]).features["needs_memory"] is True
+    assert classify_turn("いつもの感じで", ["identity.style"]).tier == SMALL
+    assert classify_turn("前回の続きでお願い").reasons == ["memory_reference"]
+    assert classify_turn("Remember what I said last time?").tier == LARGE
+    assert classify_turn("短めに", ["identity.style"]).tier == SMALL
+
+
+def test_router_needs_small_model(monkeypatch):
+    monkeypatch.delenv("ANTHROPIC_MODEL_SMALL", raising=False)
+    monkeypatch.delenv("OPENAI_MODEL_SMALL", raising=False)
+    assert router_enabled() is False
+    monkeypatch.setenv("OPENAI_MODEL_SMALL", "gpt-small")
+    assert router_enabled() is True
+    monkeypatch.setenv("LLM_ROUTER", "0")
+    assert router_enabled() is False
+
+
+def test_chat_routes_by_tier_and_logs(monkeypatch, tmp_path):
+    log_path = tmp_path / "routes.jsonl"
+    monkeypatch.setenv("CHAT_LLM_PROVIDER", "openai")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-router-test")
+    monkeypatch.setenv("OPENAI_MODEL", "gpt-large")
+    monkeypatch.setenv("OPENAI_MODEL_SMALL", "gpt-small")
+    monkeypatch.setenv("LLM_SMALL_MAX_TOKENS", "128")
+    monkeypatch.setenv("LLM_ROUTER_LOG", str(log_path))
+
+    def fake_completion(*, api_key, base_url, model, messages, temperature, max_tokens=None):
+        return f"{model}:{max_tokens}"
+
+    monkeypatch.setattr(chat_api, "_openai_chat_completion", fake_completion)
+    headers = {"Cache-Control": "no-cache"}
+    small = client.post("/api/chat", json={"message": "ありがとう", "userId": "router_user"}, headers=headers)
+    large = client.post("/api/chat", json={"message": "新規事業の戦略を比較して", "userId": "router_user"}, headers=headers)
+    assert small.json()["response"] == "gpt-small:128"
+    assert large.json()["response"] == "gpt-large:None"
+
+    records = [json.loads(line) for line in log_path.read_text(encoding="utf-8").splitlines()]
+    assert [r["tier"] for r in records] == [SMALL, LARGE]
+    assert records[0]["features"]["model"] == "gpt-small"
+    assert records[1]["route"] == "/api/chat" and records[1]["ok"] is True
@@ -0,0 +1,69 @@
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient
+from main import app
+
+
+client = TestClient(app)
+
+
+def test_profile_written_only_with_admin_header(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROFILE_DIR", str(tmp_path))
+    monkeypatch.setenv("PROFILE_ADMIN_KEY", "secret")
+    monkeypatch.setenv("PROFILE_INTERVAL_MS", "1")
+    monkeypatch.delenv("PROFILE_SAMPLE_RATE", raising=False)
+    assert client.post("/api/chat", json={"message": "箇条書きで", "userId": "profile_user"}).status_code == 200
+
+    assert client.get("/api/memory?userId=profile_user", headers={"X-Profile": "wrong"}).status_code == 200
+    assert list(tmp_path.iterdir()) == []
+
+    res = client.get("/api/memory?userId=profile_user", headers={"X-Profile": "secret"})
+    assert res.status_code == 200
+    profile_id = res.headers["x-profile-id"]
+
+    meta_path = next(tmp_path.glob(f"{profile_id}_*.json"))
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    assert meta["path"] == "/api/memory"
+    assert meta["status"] == 200
+    assert meta["user_id"] == "profile_user"
+    assert meta["episode_count"] > 0
+    assert meta["state_bytes"] > 0
+    folded = meta_path.with_suffix(".folded")
+    assert folded.exists()
+    for line in folded.read_text(encoding="utf-8").splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert stack and int(count) > 0
+
+
+def test_profile_covers_threadpool_work(tmp_path, monkeypatch):
+    import pstats
+    import time
+    from services import pocket_coo_service
+
+    monkeypatch.setenv("PROFILE_DIR", str(tmp_path))
+    monkeypatch.setenv("PROFILE_ADMIN_KEY", "secret")
+    monkeypatch.setenv("PROFILE_INTERVAL_MS", "1")
+    monkeypatch.delenv("PROFILE_SAMPLE_RATE", raising=False)
+    build = pocket_coo_service._build_turn_episode
+
+    def slow_build(*args, **kwargs):
+        # サンプラーが確実に apply_turn の中を拾えるように
+        time.sleep(0.05)
+        return build(*args, **kwargs)
+
+    monkeypatch.setattr(pocket_coo_service, "_build_turn_episode", slow_build)
+    for mode in ("sampler", "cprofile"):
+        monkeypatch.setenv("PROFILE_MODE", mode)
+        res = client.post("/api/chat", json={"message": "箇条書きで", "userId": "profile_thread_user"}, headers={"X-Profile": "secret"})
+        assert res.status_code == 200
+        stem = next(tmp_path.glob(f"{res.headers['x-profile-id']}_*.json")).with_suffix("")
+        if mode == "sampler":
+            folded = stem.with_suffix(".folded").read_text(encoding="utf-8")
+            assert "apply_turn (pocket_coo_service.py" in folded
+        else:
+            names = {func[2] for func in pstats.Stats(str(stem.with_suffix(".pstats"))).stats}
+            assert {"apply_turn", "_load_state", "_write_state", "build_prompt_memories"} <= names
@@ -0,0 +1,62 @@
+import sys
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from db.schema import ensure_schema
+from db.session import SessionLocal, engine
+from services.pocket_coo_service import EMBEDDING_MODEL, PocketCOOService, episode_embedding_text, embedding_fields
+from tools import reembed
+
+
+ensure_schema(engine)
+
+
+def _make_stale_user(user_id: str) -> list:
+    db = SessionLocal()
+    try:
+        service = PocketCOOService(db)
+        for i in range(3):
+            service.apply_turn(user_id=user_id, user_message=f"週次レポート {i}", assistant_message="了解", memory_used=[], memuu_items=None)
+
+        def downgrade(state):
+            for e in state["episodes"]:
+                e.update(embedding=[0] * 8, embedding_dim=8, embedding_model="hashing_v0")
+
+        service._update_state(user_id, downgrade)
+        return [e["id"] for e in service.get_state(user_id)["episodes"]]
+    finally:
+        db.close()
+
+
+def _episodes(user_id: str) -> list:
+    db = SessionLocal()
+    try:
+        return PocketCOOService(db).get_state(user_id)["episodes"]
+    finally:
+        db.close()
+
+
+def test_reembed_only_stale_and_resume_from_checkpoint(tmp_path):
+    prefix = f"reembed_{uuid.uuid4().hex[:6]}"
+    first, second = f"{prefix}_a", f"{prefix}_b"
+    _make_stale_user(first)
+    _make_stale_user(second)
+    checkpoint = tmp_path / "checkpoint.json"
+
+    # first まで終わった所で落ちた想定
+    reembed.save_checkpoint(checkpoint, {**reembed.load_checkpoint(checkpoint), "last_user_id": first})
+    result = reembed.run(checkpoint, workers=1, batch=50, rate=0, log=lambda _: None)
+    assert result["done"] is True
+    assert {e["embedding_model"] for e in _episodes(first)} == {"hashing_v0"}
+    second_eps = _episodes(second)
+    assert {e["embedding_model"] for e in second_eps} == {EMBEDDING_MODEL}
+    expected = embedding_fields(episode_embedding_text(second_eps[0]))["embedding"]
+    assert second_eps[0]["embedding"] == expected
+
+    # 完了済みのチェックポイントなら何もしない。--restart 相当で first も直る
+    assert reembed.run(checkpoint, workers=1, rate=0, log=lambda _: None)["episodes"] == result["episodes"]
+    checkpoint.unlink()
+    reembed.run(checkpoint, workers=1, rate=0, log=lambda _: None)
+    assert {e["embedding_model"] for e in _episodes(first)} == {EMBEDDING_MODEL}
@@ -0,0 +1,66 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core import serialization
+from services.pocket_coo_service import project_state, seeded_demo_state
+
+
+def test_codecs_round_trip_state_identically():
+    state = seeded_demo_state("demo_codec")
+    expected = None
+    try:
+        for name in serialization.CODECS:
+            if serialization.set_codec(name) != name:
+                continue
+            encoded = serialization.dumps(state)
+            assert "北極星指標" in encoded
+            decoded = serialization.loads(encoded)
+            assert decoded == state
+            assert serialization.loads(encoded.encode("utf-8")) == state
+            if expected is None:
+                expected = decoded
+            assert decoded == expected
+    finally:
+        serialization.set_codec(None)
+
+
+def test_unknown_codec_falls_back_to_an_available_one():
+    try:
+        assert serialization.set_codec("does-not-exist") in serialization.CODECS
+    finally:
+        serialization.set_codec(None)
+
+
+def test_encode_user_state_drops_unknown_keys_and_keeps_projection():
+    state = seeded_demo_state("demo_codec_view")
+    view = project_state(state, fields={"identity": None, "episodes": ["id", "date", "summary"]}, limit=2)
+    body = serialization.loads(serialization.encode_user_state(view))
+    assert set(body.keys()) == {"userId", "identity", "episodes", "episodeCount", "nextCursor"}
+    assert body["identity"]["profile"] == state["identity"]["profile"]
+    assert all(set(e.keys()) == {"id", "date", "summary"} for e in body["episodes"])
+
+
+def test_invalid_stored_state_is_a_server_error_not_a_bad_request(monkeypatch):
+    from fastapi.testclient import TestClient
+    from main import app
+    from services.pocket_coo_service import PocketCOOService
+
+    broken = {"userId": "demo_broken", "episodes": [{"id": "ep1"}]}  # date が無い
+    try:
+        serialization.encode_user_state(broken)
+        raise AssertionError("expected StateEncodingError")
+    except serialization.StateEncodingError:
+        pass
+
+    class Broken:
+        def project(self, **kwargs):
+            return broken
+
+    monkeypatch.setattr(PocketCOOService, "get_state_version", lambda self, user_id: None)
+    monkeypatch.setattr(PocketCOOService, "get_compact_state", lambda self, user_id, version=None: (Broken(), 1))
+    client = TestClient(app)
+    assert client.get("/api/user/demo_broken").status_code == 500
+    assert client.get("/api/memory?userId=demo_broken").status_code == 500
+    assert client.get("/api/user/demo_broken?fields=nope").status_code == 400
@@ -0,0 +1,86 @@
+import sys
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, select
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from db.models import UserState
+from db.session import SessionLocal
+from db.sharding import HashRing, get_shards, reset_shards
+from services.pocket_coo_service import PocketCOOService
+from tools.rebalance_shards import rebalance
+
+
+@pytest.fixture
+def shard_env(tmp_path, monkeypatch):
+    def configure(count: int) -> list:
+        urls = [f"sqlite:///{tmp_path}/shard{i}.db" for i in range(count)]
+        monkeypatch.setenv("DATABASE_SHARD_URLS", ",".join(urls))
+        reset_shards()
+        return urls
+
+    yield configure
+    monkeypatch.delenv("DATABASE_SHARD_URLS", raising=False)
+    reset_shards()
+
+
+def _user_ids_in(url: str) -> set:
+    engine = create_engine(url)
+    try:
+        with engine.connect() as conn:
+            return set(conn.execute(select(UserState.user_id)).scalars())
+    finally:
+        engine.dispose()
+
+
+def _apply_turns(user_ids) -> None:
+    db = SessionLocal()
+    try:
+        service = PocketCOOService(db)
+        for user_id in user_ids:
+            service.apply_turn(user_id=user_id, user_message="週次レポート", assistant_message="了解", memory_used=[], memuu_items=None)
+    finally:
+        db.close()
+
+
+def test_ring_is_balanced_and_stable_when_appending_a_shard():
+    users = [f"u{i}" for i in range(4000)]
+    four = HashRing(["s0", "s1", "s2", "s3"])
+    five = HashRing(["s0", "s1", "s2", "s3", "s4"])
+    counts = {}
+    for u in users:
+        counts[four.node_for(u)] = counts.get(four.node_for(u), 0) + 1
+    assert min(counts.values()) > 4000 / 4 * 0.75
+
+    moved = [u for u in users if four.node_for(u) != five.node_for(u)]
+    # 動くのは新しいシャードに入るユーザーだけ（約 1/5）
+    assert all(five.node_for(u) == "s4" for u in moved)
+    assert 0.1 < len(moved) / len(users) < 0.3
+
+
+def test_state_is_written_to_the_owning_shard_and_rebalanced(shard_env):
+    urls = shard_env(2)
+    users = [f"shard_user_{i}" for i in range(12)]
+    _apply_turns(users)
+    shards = get_shards()
+    for user_id in users:
+        assert user_id in _user_ids_in(shards.urls[shards.shard_for(user_id)])
+    assert _user_ids_in(urls[0]) | _user_ids_in(urls[1]) == set(users)
+
+    urls = shard_env(3)
+    summary = rebalance(urls[:2], log=lambda _: None)
+    assert summary["conflicts"] == [] and summary["moved"] == len(_user_ids_in(urls[2])) > 0
+    shards = get_shards()
+    for user_id in users:
+        assert [user_id in _user_ids_in(url) for url in urls].count(True) == 1
+        assert user_id in _user_ids_in(shards.urls[shards.shard_for(user_id)])
+
+    # 再実行しても何も動かない。移した state はそのまま読める
+    assert rebalance(urls[:2], log=lambda _: None)["moved"] == 0
+    db = SessionLocal()
+    try:
+        assert len(PocketCOOService(db).get_state(users[0])["episodes"]) == 1
+    finally:
+        db.close()
@@ -0,0 +1,116 @@
+import sys
+from pathlib import Path
+from datetime import datetime
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest
+from sqlalchemy import select
+
+from core import serialization
+from db import state_compression
+from db.models import UserState
+from db.schema import ensure_schema
+from db.session import SessionLocal, engine
+from services.pocket_coo_service import PocketCOOService
+
+
+ensure_schema(engine)
+
+pytestmark = pytest.mark.skipif(state_compression.zstandard is None, reason="zstandard is not installed")
+
+
+def _row(db, user_id):
+    return db.execute(
+        select(UserState.state_json, UserState.state_blob, UserState.state_format, UserState.version)
+        .where(UserState.user_id == user_id)
+    ).first()
+
+
+def test_states_are_written_compressed_with_dictionary():
+    db = SessionLocal()
+    try:
+        service = PocketCOOService(db)
+        state = service.get_state("demo_compressed")
+        row = _row(db, "demo_compressed")
+        assert row.state_format.startswith("zstd:")
+        assert row.state_json == ""
+        assert len(row.state_blob) * 10 < len(serialization.dumps_bytes(state))
+        assert PocketCOOService(db).get_state("demo_compressed") == state
+    finally:
+        db.close()
+
+
+def test_plain_rows_stay_readable_and_migrate_lazily():
+    user_id = "legacy_plain_user"
+    legacy = {"userId": user_id, "identity": {"style": {}, "preferences": []}, "projects": [], "episodes": [], "score": 0}
+    db = SessionLocal()
+    try:
+        db.add(UserState(user_id=user_id, state_json=serialization.dumps(legacy), updated_at=datetime.utcnow(), version=1))
+        db.commit()
+
+        service = PocketCOOService(db)
+        assert service.get_state(user_id)["userId"] == user_id
+        assert _row(db, user_id).state_format is None
+
+        service.apply_message(user_id, "箇条書きで")
+        row = _row(db, user_id)
+        assert row.state_format.startswith("zstd:")
+        assert len(service.get_state(user_id)["episodes"]) == 1
+    finally:
+        db.close()
+
+
+def test_bulk_migrate_keeps_version(monkeypatch):
+    user_id = "legacy_bulk_user"
+    db = SessionLocal()
+    try:
+        monkeypatch.setenv("STATE_COMPRESSION", "none")
+        PocketCOOService(db).apply_message(user_id, "文章で")
+        before = _row(db, user_id)
+        assert before.state_format == state_compression.FORMAT_JSON
+
+        monkeypatch.setenv("STATE_COMPRESSION", "zstd")
+        assert state_compression.migrate(batch_size=2) >= 1
+        db.expire_all()
+        after = _row(db, user_id)
+        assert after.state_format.startswith("zstd:")
+        assert after.version == before.version
+        assert PocketCOOService(db).get_state(user_id)["identity"]["style"]["format"] == "paragraph"
+    finally:
+        db.close()
+
+
+def test_migrate_and_dictionary_samples_cover_every_shard(tmp_path, monkeypatch):
+    from sqlalchemy import create_engine
+    from db.sharding import get_shards, reset_shards
+
+    urls = [f"sqlite:///{tmp_path}/shard{i}.db" for i in range(2)]
+    monkeypatch.setenv("DATABASE_SHARD_URLS", ",".join(urls))
+    reset_shards()
+    try:
+        shards = get_shards()
+        user_ids = [f"legacy_shard_{i}" for i in range(8)]
+        assert {shards.shard_for(u) for u in user_ids} == {"s0", "s1"}
+        monkeypatch.setenv("STATE_COMPRESSION", "none")
+        db = SessionLocal()
+        try:
+            for user_id in user_ids:
+                PocketCOOService(db).apply_message(user_id, "箇条書きで")
+        finally:
+            db.close()
+        assert len(state_compression._db_samples(100)) == len(user_ids)
+
+        monkeypatch.setenv("STATE_COMPRESSION", "zstd")
+        assert state_compression.migrate(batch_size=3) == len(user_ids)
+        for url in urls:
+            shard_engine = create_engine(url)
+            try:
+                with shard_engine.connect() as conn:
+                    formats = list(conn.execute(select(UserState.state_format)).scalars())
+            finally:
+                shard_engine.dispose()
+            assert formats and all(f.startswith("zstd:") for f in formats)
+    finally:
+        monkeypatch.delenv("DATABASE_SHARD_URLS")
+        reset_shards()
@@ -0,0 +1,227 @@
+import sys
+from pathlib import Path
+import threading
+import time
+import uuid
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from db.schema import ensure_schema
+from db.session import SessionLocal, engine
+from services.pocket_coo_service import PocketCOOService
+
+
+ensure_schema(engine)
+
+
+def _run_parallel(n_threads, fn):
+    errors = []
+    barrier = threading.Barrier(n_threads)
+
+    def worker(i):
+        db = SessionLocal()
+        try:
+            barrier.wait()
+            fn(PocketCOOService(db), i)
+        except Exception as e:  # pragma: no cover - 失敗時の診断用
+            errors.append(e)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+
+def test_parallel_turns_for_one_user_keep_every_episode():
+    user_id = f"stress_{uuid.uuid4().hex[:8]}"
+    n_threads = 8
+    turns_per_thread = 5
+
+    def turns(service, i):
+        for j in range(turns_per_thread):
+            service.apply_turn(
+                user_id=user_id,
+                user_message=f"スレッド{i} ターン{j} 箇条書きで",
+                assistant_message="了解",
+                memory_used=[],
+                memuu_items=None,
+            )
+
+    errors = _run_parallel(n_threads, turns)
+    assert errors == []
+
+    db = SessionLocal()
+    try:
+        state = PocketCOOService(db).get_state(user_id)
+    finally:
+        db.close()
+    episodes = state.get("episodes") or []
+    assert len(episodes) == n_threads * turns_per_thread
+    assert len({e["id"] for e in episodes}) == len(episodes)
+    assert (state.get("identity") or {}).get("style", {}).get("format") == "bullet_points"
+
+
+def test_parallel_feedback_and_turns_do_not_lose_writes():
+    user_id = f"stress_{uuid.uuid4().hex[:8]}"
+    db = SessionLocal()
+    try:
+        service = PocketCOOService(db)
+        seeded = [
+            service.apply_turn(
+                user_id=user_id,
+                user_message=f"準備 {i}",
+                assistant_message="了解",
+                memory_used=["preferences.format"],
+                memuu_items=None,
+            )["new_memory"]["episodes"][0]["id"]
+            for i in range(4)
+        ]
+    finally:
+        db.close()
+
+    def mixed(service, i):
+        if i % 2 == 0:
+            service.record_feedback(user_id=user_id, episode_id=seeded[i // 2], rating="like", comment=None)
+        else:
+            service.apply_turn(
+                user_id=user_id,
+                user_message=f"並行ターン {i}",
+                assistant_message="了解",
+                memory_used=[],
+                memuu_items=None,
+            )
+
+    errors = _run_parallel(8, mixed)
+    assert errors == []
+
+    db = SessionLocal()
+    try:
+        state = PocketCOOService(db).get_state(user_id)
+    finally:
+        db.close()
+    episodes = {e["id"]: e for e in state.get("episodes") or []}
+    assert len(episodes) == 4 + 4
+    for ep_id in seeded:
+        assert (episodes[ep_id].get("feedback") or {}).get("rating") == "like"
+
+
+def test_concurrent_first_loads_of_demo_user_seed_once(monkeypatch):
+    from services import pocket_coo_service
+
+    user_id = f"demo_{uuid.uuid4().hex[:8]}"
+    seeds = []
+    original = pocket_coo_service.seeded_demo_state
+
+    def slow_seed(uid):
+        seeds.append(uid)
+        time.sleep(0.2)
+        return original(uid)
+
+    monkeypatch.setattr(pocket_coo_service, "seeded_demo_state", slow_seed)
+    states = []
+    errors = _run_parallel(6, lambda service, i: states.append(service.get_state(user_id)))
+    assert errors == []
+    assert len(seeds) == 1
+    assert len({id(s) for s in states}) == len(states)
+    assert all(len(s["episodes"]) == len(states[0]["episodes"]) > 0 for s in states)
+
+
+def test_concurrent_http_reads_share_one_state_load(monkeypatch):
+    import asyncio
+
+    import httpx
+    from main import app
+    from services import pocket_coo_service
+
+    user_id = f"demo_{uuid.uuid4().hex[:8]}"
+    seeds = []
+    original = pocket_coo_service.seeded_demo_state
+
+    def slow_seed(uid):
+        seeds.append(uid)
+        time.sleep(0.3)
+        return original(uid)
+
+    monkeypatch.setattr(pocket_coo_service, "seeded_demo_state", slow_seed)
+    roles = []
+    acquire = pocket_coo_service._state_loads.acquire
+
+    def recording_acquire(key):
+        call, leader = acquire(key)
+        roles.append(leader)
+        return call, leader
+
+    monkeypatch.setattr(pocket_coo_service._state_loads, "acquire", recording_acquire)
+
+    async def burst():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            paths = [f"/api/user/{user_id}?limit=5", f"/api/memory?userId={user_id}&limit=5"] * 3
+            return await asyncio.gather(*(client.get(p) for p in paths))
+
+    responses = asyncio.run(burst())
+    assert [r.status_code for r in responses] == [200] * 6
+    # ルートがイベントループを塞がないので、同時に来た読み込みが先頭の 1 回を待って結果を共有する
+    assert len(seeds) == 1
+    assert roles.count(True) == 1 and roles.count(False) >= 1
+    assert len({r.json()["episodeCount"] for r in responses}) == 1
+
+
+def test_slow_writes_do_not_stall_other_requests(monkeypatch):
+    import asyncio
+
+    import httpx
+    from main import app
+
+    user_id = f"slow_{uuid.uuid4().hex[:8]}"
+    db = SessionLocal()
+    try:
+        service = PocketCOOService(db)
+        service.apply_turn(user_id=user_id, user_message="箇条書きで", assistant_message="了解", memory_used=[], memuu_items=None)
+        episode_id = service.get_state(user_id)["episodes"][-1]["id"]
+    finally:
+        db.close()
+
+    load, write = PocketCOOService._load_state, PocketCOOService._write_state
+
+    def slow_load(self, uid):
+        if uid == user_id:
+            time.sleep(0.4)
+        return load(self, uid)
+
+    def slow_write(self, uid, state, expected_version):
+        if uid == user_id:
+            time.sleep(0.4)
+        return write(self, uid, state, expected_version)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            exported = (await client.get(f"/api/user/{user_id}/export")).content
+            monkeypatch.setattr(PocketCOOService, "_load_state", slow_load)
+            monkeypatch.setattr(PocketCOOService, "_write_state", slow_write)
+            # feedback は PUT でエピソードが消える前に
+            slow_requests = [
+                lambda: client.post("/api/feedback", json={"userId": user_id, "episodeId": episode_id, "rating": "like"}),
+                lambda: client.put(f"/api/user/{user_id}", json={"userId": user_id, "score": 1, "episodes": []}),
+                lambda: client.patch(f"/api/user/{user_id}", json={"identity": {"style": {"format": "bullet_points"}}}),
+                lambda: client.get(f"/api/user/{user_id}/export"),
+                lambda: client.post(f"/api/user/{user_id}/import?mode=merge", content=exported),
+            ]
+            for request in slow_requests:
+                task = asyncio.ensure_future(request())
+                await asyncio.sleep(0.05)
+                start = time.perf_counter()
+                health = await client.get("/api/health")
+                elapsed = time.perf_counter() - start
+                assert health.status_code == 200
+                # 書き込みが終わる前に他のリクエストが返る
+                assert elapsed < 0.3 and not task.done(), elapsed
+                res = await task
+                assert res.status_code == 200, res.text
+
+    asyncio.run(run())
@@ -0,0 +1,90 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient
+from main import app
+
+
+client = TestClient(app)
+
+
+def test_memory_excludes_embeddings_by_default():
+    res = client.get("/api/memory?userId=demo_projection")
+    assert res.status_code == 200
+    body = res.json()
+    assert body["episodeCount"] == len(body["episodes"]) == 110
+    assert all("embedding" not in e for e in body["episodes"])
+    assert body["episodes"][0]["embedding_model"] == "hashing_v1_int8"
+
+    full = client.get("/api/memory?userId=demo_projection&includeEmbeddings=true").json()
+    assert len(full["episodes"][0]["embedding"]) == 96
+
+
+def test_cursor_pagination_is_newest_first():
+    user_id = "demo_pagination"
+    all_ids = [e["id"] for e in client.get(f"/api/memory?userId={user_id}&fields=episodes.id").json()["episodes"]]
+    newest_first = list(reversed(all_ids))
+
+    seen = []
+    cursor = None
+    for _ in range(20):
+        url = f"/api/user/{user_id}?fields=episodes.summary&limit=25"
+        if cursor:
+            url += f"&before={cursor}"
+        page = client.get(url)
+        assert page.status_code == 200
+        body = page.json()
+        assert set(body.keys()) == {"userId", "episodes", "episodeCount", "nextCursor"}
+        assert all(set(e.keys()) == {"id", "date", "summary"} for e in body["episodes"])
+        seen.extend(e["id"] for e in body["episodes"])
+        cursor = body["nextCursor"]
+        if not cursor:
+            break
+    assert seen == newest_first
+
+
+def test_field_projection_and_chat_response_are_slim():
+    user_id = "projection_user"
+    chat = client.post("/api/chat", json={"message": "箇条書きで", "userId": user_id})
+    assert chat.status_code == 200
+    episode = chat.json()["newMemory"]["episodes"][0]
+    assert "embedding" not in episode
+    assert episode["embedding_dim"] == 96
+
+    res = client.get(f"/api/user/{user_id}?fields=identity,score")
+    assert res.status_code == 200
+    body = res.json()
+    assert set(body.keys()) == {"userId", "identity", "score"}
+
+    bad = client.get(f"/api/memory?userId={user_id}&fields=secrets")
+    assert bad.status_code == 400
+    bad_cursor = client.get(f"/api/memory?userId={user_id}&before=ep_nope")
+    assert bad_cursor.status_code == 400
+
+
+def test_conditional_get_returns_304_until_state_changes():
+    user_id = "etag_user"
+    client.post("/api/chat", json={"message": "こんにちは", "userId": user_id})
+
+    first = client.get(f"/api/memory?userId={user_id}")
+    etag = first.headers.get("etag")
+    assert etag and etag.startswith('"v')
+
+    again = client.get(f"/api/memory?userId={user_id}", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers.get("etag") == etag
+
+    other_view = client.get(f"/api/memory?userId={user_id}&fields=score", headers={"If-None-Match": etag})
+    assert other_view.status_code == 200
+    assert other_view.headers.get("etag") != etag
+
+    user_view = client.get(f"/api/user/{user_id}")
+    assert user_view.status_code == 200
+    assert client.get(f"/api/user/{user_id}", headers={"If-None-Match": user_view.headers["etag"]}).status_code == 304
+
+    client.post("/api/chat", json={"message": "箇条書きで", "userId": user_id})
+    changed = client.get(f"/api/memory?userId={user_id}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers.get("etag") != etag
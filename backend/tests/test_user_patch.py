@@ -0,0 +1,98 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient
+from main import app
+
+
+client = TestClient(app)
+
+
+def _new_episode(user_id: str) -> str:
+    res = client.post("/api/chat", json={"message": "市場調査やっといて", "userId": user_id})
+    assert res.status_code == 200
+    return res.json()["newMemory"]["episodes"][0]["id"]
+
+
+def test_merge_patch_updates_style_and_single_episode():
+    user_id = "patch_user_1"
+    first = _new_episode(user_id)
+    second = _new_episode(user_id)
+
+    res = client.patch(
+        f"/api/user/{user_id}",
+        json={
+            "identity": {"style": {"format": "paragraph"}},
+            "episodes": {second: {"summary": "手で直した要約", "tags": ["pm"]}},
+        },
+        headers={"content-type": "application/merge-patch+json"},
+    )
+    assert res.status_code == 200
+    body = res.json()
+    assert body["identity"]["style"]["format"] == "paragraph"
+    assert body["episodeCount"] == 2
+    assert [e["id"] for e in body["episodes"]] == [second]
+
+    state = client.get(f"/api/memory?userId={user_id}").json()
+    by_id = {e["id"]: e for e in state["episodes"]}
+    assert by_id[second]["summary"] == "手で直した要約"
+    assert by_id[second]["tags"] == ["pm"]
+    assert by_id[second]["user_message"] == "市場調査やっといて"
+    assert by_id[first]["summary"] != "手で直した要約"
+
+    res_del = client.patch(
+        f"/api/user/{user_id}",
+        json={"episodes": {first: None}},
+        headers={"content-type": "application/merge-patch+json"},
+    )
+    assert res_del.status_code == 200
+    assert res_del.json()["episodeCount"] == 1
+
+
+def test_json_patch_addresses_episodes_by_id_and_supports_test():
+    user_id = "patch_user_2"
+    episode_id = _new_episode(user_id)
+
+    ops = [
+        {"op": "test", "path": f"/episodes/{episode_id}/type", "value": "chat_turn"},
+        {"op": "replace", "path": f"/episodes/{episode_id}/summary", "value": "JSON Patch"},
+        {"op": "add", "path": "/identity/style/communication", "value": "casual"},
+        {"op": "replace", "path": "/projects/0/status", "value": "done"},
+    ]
+    res = client.patch(f"/api/user/{user_id}", json=ops, headers={"content-type": "application/json-patch+json"})
+    assert res.status_code == 200
+    body = res.json()
+    assert body["identity"]["style"]["communication"] == "casual"
+    assert body["projects"][0]["status"] == "done"
+    assert body["episodes"][0]["summary"] == "JSON Patch"
+
+    failed = client.patch(
+        f"/api/user/{user_id}",
+        json=[{"op": "test", "path": f"/episodes/{episode_id}/summary", "value": "別物"}],
+        headers={"content-type": "application/json-patch+json"},
+    )
+    assert failed.status_code == 409
+
+
+def test_patch_rejects_unknown_fields_and_invalid_values():
+    user_id = "patch_user_3"
+    _new_episode(user_id)
+
+    res = client.patch(f"/api/user/{user_id}", json={"score": 100})
+    assert res.status_code == 422
+
+    res2 = client.patch(
+        f"/api/user/{user_id}",
+        json=[{"op": "replace", "path": "/episodes/0/tags", "value": "not-a-list"}],
+        headers={"content-type": "application/json-patch+json"},
+    )
+    assert res2.status_code == 422
+
+    res3 = client.patch(
+        f"/api/user/{user_id}",
+        json=[{"op": "remove", "path": "/episodes/ep_missing"}],
+        headers={"content-type": "application/json-patch+json"},
+    )
+    assert res3.status_code == 422
@@ -0,0 +1,94 @@
+"""
+ユーザーの記憶を NDJSON でバックアップ・移行する CLI（DATABASE_URL の DB を直接読み書き）
+
+    cd backend && python -m tools.memory_ndjson export USER_ID -o USER_ID.ndjson
+    cd backend && python -m tools.memory_ndjson import USER_ID USER_ID.ndjson            # 置き換え
+    cd backend && python -m tools.memory_ndjson import NEW_USER_ID USER_ID.ndjson --mode merge
+
+形式は services/state_export.py。稼働中の API 経由なら同じ形式で
+``GET /api/user/{id}/export`` / ``POST /api/user/{id}/import?mode=...`` も使えます
+（``curl --data-binary @USER_ID.ndjson -H 'Content-Type: application/x-ndjson' ...``）。
+"""
+from pathlib import Path
+from typing import BinaryIO, Optional
+import argparse
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from db.schema import ensure_schema
+from db.session import SessionLocal, engine
+from services.pocket_coo_service import PocketCOOService
+from services.state_export import NDJSONImporter, StateImportError, iter_export
+
+
+READ_BYTES = 1024 * 1024
+
+
+def export_user(user_id: str, out: BinaryIO) -> int:
+    """書き出したバイト数を返す"""
+    db = SessionLocal()
+    try:
+        state, version = PocketCOOService(db).get_state_with_version(user_id)
+    finally:
+        db.close()
+    written = 0
+    for chunk in iter_export(state, version):
+        out.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def import_user(user_id: str, source: BinaryIO, mode: str = "replace") -> dict:
+    importer = NDJSONImporter(user_id)
+    while True:
+        chunk = source.read(READ_BYTES)
+        if not chunk:
+            break
+        importer.feed(chunk)
+    imported = importer.finish()
+    db = SessionLocal()
+    try:
+        state = PocketCOOService(db).import_state(user_id, imported, mode=mode)
+    finally:
+        db.close()
+    return {"projects": len(state.get("projects") or []), "episodes": len(state.get("episodes") or [])}
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_export = sub.add_parser("export", help="NDJSON に書き出す")
+    p_export.add_argument("user_id")
+    p_export.add_argument("-o", "--output", help="出力ファイル（省略時は標準出力）")
+    p_import = sub.add_parser("import", help="NDJSON から読み込む")
+    p_import.add_argument("user_id")
+    p_import.add_argument("input", help="入力ファイル（- で標準入力）")
+    p_import.add_argument("--mode", choices=["replace", "merge"], default="replace")
+    args = parser.parse_args(argv)
+
+    ensure_schema(engine)
+    if args.command == "export":
+        if args.output:
+            with open(args.output, "wb") as f:
+                written = export_user(args.user_id, f)
+            print(f"{args.user_id}: {written} bytes -> {args.output}", file=sys.stderr)
+        else:
+            export_user(args.user_id, sys.stdout.buffer)
+        return 0
+
+    try:
+        if args.input == "-":
+            result = import_user(args.user_id, sys.stdin.buffer, mode=args.mode)
+        else:
+            with open(args.input, "rb") as f:
+                result = import_user(args.user_id, f, mode=args.mode)
+    except StateImportError as e:
+        print(f"import failed: {e}", file=sys.stderr)
+        return 1
+    print(f"{args.user_id}: {result['projects']} projects, {result['episodes']} episodes ({args.mode})", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+シャード構成を変えた後に user_states を新しいシャードへ移す（db/sharding.py）
+
+    # 1 つの DB から 4 シャードへ
+    cd backend && DATABASE_SHARDS=4 python -m tools.rebalance_shards --from sqlite:///./data/personalos.db
+    # 4 シャードから 6 シャードへ（--from は変更前の DATABASE_SHARD_URLS と同じ並び）
+    cd backend && DATABASE_SHARD_URLS=u0,u1,u2,u3,u4,u5 python -m tools.rebalance_shards --from u0,u1,u2,u3
+    cd backend && ... python -m tools.rebalance_shards --from ... --dry-run   # 移動件数だけ数える
+
+移動先は現在の環境変数（DATABASE_SHARD_URLS / DATABASE_SHARDS）の構成です。
+変更前の各シャードを user_id 順に読み、新しいリングで別の DB に割り当たる行だけを
+
+1. 移動先に書き（既に同じ version・同じ内容があればそのまま）
+2. 移動元から version が読んだ時のままなら削除する（変わっていれば読み直してやり直す）
+
+の順で移します。途中で止まっても再実行すれば続きから進みます。user_aggregates は派生データ
+なので移さず移動元から消します（移動先で初回アクセス時に作り直される）。
+移動先に別内容の行が既にある user_id は上書きせず conflicts として報告します。
+移動中に API が古い構成・新しい構成のどちらで書き込んでも行が分かれるため、書き込みを止めて実行してください。
+"""
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import argparse
+import json
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.engine import Engine
+
+from db.models import UserAggregate, UserState
+from db.schema import ensure_schema_once
+from db.sharding import HashRing, create_shard_engine, get_shards
+
+
+_MOVE_RETRIES = 5
+_COLUMNS = (UserState.user_id, UserState.state_json, UserState.state_blob, UserState.state_format, UserState.version, UserState.updated_at)
+
+
+def _user_ids(engine: Engine, batch: int) -> Iterator[List[str]]:
+    after: Optional[str] = None
+    while True:
+        query = select(UserState.user_id).order_by(UserState.user_id).limit(batch)
+        if after is not None:
+            query = query.where(UserState.user_id > after)
+        with engine.connect() as conn:
+            user_ids = list(conn.execute(query).scalars())
+        if not user_ids:
+            return
+        yield user_ids
+        after = user_ids[-1]
+
+
+def _same(a: Any, b: Any) -> bool:
+    return (a.version, a.state_format, a.state_json, a.state_blob) == (b.version, b.state_format, b.state_json, b.state_blob)
+
+
+def move_user(user_id: str, source: Engine, target: Engine) -> str:
+    """"moved" / "gone"（移動元に無い）/ "conflict" のいずれかを返す"""
+    for _ in range(_MOVE_RETRIES):
+        with source.connect() as conn:
+            row = conn.execute(select(*_COLUMNS).where(UserState.user_id == user_id)).first()
+        if row is None:
+            return "gone"
+        with target.begin() as conn:
+            existing = conn.execute(select(*_COLUMNS).where(UserState.user_id == user_id)).first()
+            if existing is None:
+                conn.execute(insert(UserState).values(**row._mapping))
+            elif not _same(existing, row):
+                return "conflict"
+        with source.begin() as conn:
+            deleted = conn.execute(
+                delete(UserState).where(UserState.user_id == user_id, UserState.version == row.version)
+            ).rowcount
+            if deleted == 1:
+                conn.execute(delete(UserAggregate).where(UserAggregate.user_id == user_id))
+                return "moved"
+        # 読んだ後に移動元が更新された。移動先に書いた古い版を消してやり直す
+        with target.begin() as conn:
+            conn.execute(delete(UserState).where(UserState.user_id == user_id, UserState.version == row.version))
+    return "conflict"
+
+
+def rebalance(
+    from_urls: List[str],
+    batch: int = 500,
+    dry_run: bool = False,
+    log: Callable[[str], Any] = print,
+) -> Dict[str, Any]:
+    shards = get_shards()
+    if shards is None:
+        raise SystemExit("set DATABASE_SHARD_URLS or DATABASE_SHARDS to the new layout")
+    old_names = [f"s{i}" for i in range(len(from_urls))]
+    old_ring = HashRing(old_names)
+    sources = {name: create_shard_engine(url) for name, url in zip(old_names, from_urls)}
+    summary: Dict[str, Any] = {"scanned": 0, "moved": 0, "conflicts": [], "misplaced": 0, "plan": {}}
+
+    for (old_name, source), source_url in zip(sources.items(), from_urls):
+        ensure_schema_once(source)
+        for user_ids in _user_ids(source, batch):
+            for user_id in user_ids:
+                summary["scanned"] += 1
+                new_name = shards.shard_for(user_id)
+                if shards.urls[new_name] == source_url:
+                    continue
+                if len(from_urls) > 1 and old_ring.node_for(user_id) != old_name:
+                    summary["misplaced"] += 1  # 古い構成でも別シャードのはずだった行（過去の移動の残りなど）
+                key = f"{old_name}->{new_name}"
+                summary["plan"][key] = summary["plan"].get(key, 0) + 1
+                if dry_run:
+                    continue
+                result = move_user(user_id, source, shards.engine(new_name))
+                if result == "moved":
+                    summary["moved"] += 1
+                elif result == "conflict":
+                    summary["conflicts"].append(user_id)
+            log(f"{old_name}: scanned {summary['scanned']}, moved {summary['moved']}, conflicts {len(summary['conflicts'])}")
+    for engine in sources.values():
+        engine.dispose()
+    return summary
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--from", dest="from_urls", required=True, help="変更前の DB URL（カンマ区切り、シャードの並び順）")
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+    from_urls = [u.strip() for u in args.from_urls.split(",") if u.strip()]
+    summary = rebalance(from_urls, batch=args.batch, dry_run=args.dry_run)
+    print(json.dumps(summary, ensure_ascii=False))
+    return 1 if summary["conflicts"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""
+エピソード埋め込みの作り直し（埋め込みモデル・次元を変えた後に流すバックグラウンドジョブ）
+
+    cd backend && EMBEDDING_DIM=128 python -m tools.reembed                       # 全ユーザー
+    cd backend && python -m tools.reembed --workers 4 --rate 20 --batch 200
+    cd backend && python -m tools.reembed --dry-run                               # 対象件数だけ数える
+
+user_states を user_id 順に --batch 件ずつ読み、プロセスプールで各ユーザーの state のうち
+embedding_model が現在の EMBEDDING_MODEL と違うエピソードだけを再トークナイズ・再埋め込みします。
+書き込みは通常の更新と同じ compare-and-swap なので、稼働中のチャットと競合しても取りこぼしません。
+
+- 進捗はバッチごとに --checkpoint（既定 data/reembed_checkpoint.json）へ書き、再実行すると続きから
+  再開する（モデルが変わっていれば最初から）
+- --rate（ユーザー/秒、既定 20）を超えないようバッチ間で待ち、ライブのトラフィックを圧迫しない
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from sqlalchemy import select
+
+from db.models import UserState
+from db.schema import ensure_schema
+from db.session import SessionLocal, engine
+from db.sharding import get_shards
+from services.pocket_coo_service import (
+    EMBEDDING_MODEL,
+    PocketCOOService,
+    embedding_is_stale,
+    reembed_stale_episodes,
+)
+
+
+DEFAULT_CHECKPOINT = Path("data") / "reembed_checkpoint.json"
+
+
+def _fresh_checkpoint() -> Dict[str, Any]:
+    return {"model": EMBEDDING_MODEL, "shard": None, "last_user_id": None, "users": 0, "episodes": 0, "done": False}
+
+
+def load_checkpoint(path: Path) -> Dict[str, Any]:
+    """同じモデル向けの途中経過があれば返す。無ければ空の進捗"""
+    fresh = _fresh_checkpoint()
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return fresh
+    if data.get("model") != EMBEDDING_MODEL:
+        return fresh
+    return {**fresh, **data}
+
+
+def save_checkpoint(path: Path, checkpoint: Dict[str, Any]) -> None:
+    """途中で落ちても壊れたファイルが残らないよう、一時ファイルに書いてから置き換える"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps({**checkpoint, "updated_at": datetime.utcnow().isoformat() + "Z"}), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _sources() -> List[Tuple[Optional[str], Any]]:
+    """(シャード名, エンジン) の並び。シャーディングしていなければ既定のエンジンだけ"""
+    shards = get_shards()
+    if shards is None:
+        return [(None, engine)]
+    return list(shards.engines())
+
+
+def iter_user_batches(after: Optional[str], batch: int, bind: Any = None) -> Iterator[List[str]]:
+    """user_id の昇順に batch 件ずつ（キーセットページング）"""
+    while True:
+        db = SessionLocal()
+        try:
+            query = select(UserState.user_id).order_by(UserState.user_id).limit(batch)
+            if after is not None:
+                query = query.where(UserState.user_id > after)
+            user_ids = list(db.execute(query, bind_arguments={"bind": bind} if bind is not None else {}).scalars())
+        finally:
+            db.close()
+        if not user_ids:
+            return
+        yield user_ids
+        after = user_ids[-1]
+
+
+def _init_worker() -> None:
+    # fork した親の接続プールは使わない
+    engine.dispose(close=False)
+    shards = get_shards()
+    if shards is not None:
+        for _, shard_engine in shards.engines():
+            shard_engine.dispose(close=False)
+
+
+def reembed_user(user_id: str, dry_run: bool = False) -> Tuple[str, int]:
+    """(user_id, 作り直した件数) を返す。古い埋め込みが無ければ書き込まない"""
+    db = SessionLocal()
+    try:
+        service = PocketCOOService(db)
+        state, _, _ = service._load_state(user_id)
+        stale = sum(1 for e in state.get("episodes") or [] if embedding_is_stale(e))
+        if stale == 0 or dry_run:
+            return user_id, stale
+        _, changed, _ = service._update_state(user_id, reembed_stale_episodes)
+        return user_id, changed
+    finally:
+        db.close()
+
+
+def run(
+    checkpoint_path: Path = DEFAULT_CHECKPOINT,
+    workers: int = 2,
+    batch: int = 100,
+    rate: float = 20.0,
+    dry_run: bool = False,
+    log: Callable[[str], Any] = print,
+) -> Dict[str, Any]:
+    checkpoint = _fresh_checkpoint() if dry_run else load_checkpoint(checkpoint_path)
+    if checkpoint.get("done"):
+        log(f"already done for {EMBEDDING_MODEL} ({checkpoint['users']} users, {checkpoint['episodes']} episodes)")
+        return checkpoint
+    sources = _sources()
+    names = [name for name, _ in sources]
+    start = names.index(checkpoint["shard"]) if checkpoint["shard"] in names else 0
+    log(f"re-embedding to {EMBEDDING_MODEL}, resuming after {checkpoint['shard'] or ''}{checkpoint['last_user_id']!r}")
+    with ProcessPoolExecutor(max_workers=max(1, workers), initializer=_init_worker) as pool:
+        # シャードは 1 つずつ順に流す。チェックポイントは (シャード, 最後の user_id)
+        for name, bind in sources[start:]:
+            if checkpoint["shard"] != name:
+                checkpoint["shard"], checkpoint["last_user_id"] = name, None
+            for user_ids in iter_user_batches(checkpoint["last_user_id"], batch, bind=bind):
+                started = time.monotonic()
+                results = list(pool.map(reembed_user, user_ids, [dry_run] * len(user_ids)))
+                checkpoint["users"] += len(results)
+                checkpoint["episodes"] += sum(n for _, n in results)
+                checkpoint["last_user_id"] = user_ids[-1]
+                if not dry_run:
+                    save_checkpoint(checkpoint_path, checkpoint)
+                log(f"{checkpoint['users']} users, {checkpoint['episodes']} episodes {'stale' if dry_run else 're-embedded'} (last {user_ids[-1]})")
+                # rate ユーザー/秒を超えないよう待つ
+                if rate > 0:
+                    wait = len(user_ids) / rate - (time.monotonic() - started)
+                    if wait > 0:
+                        time.sleep(wait)
+    checkpoint["done"] = True
+    if not dry_run:
+        save_checkpoint(checkpoint_path, checkpoint)
+    return checkpoint
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", type=Path, default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=20.0, help="ユーザー/秒の上限（0 で無制限）")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--restart", action="store_true", help="チェックポイントを無視して最初から")
+    args = parser.parse_args(argv)
+
+    ensure_schema(engine)
+    if args.restart and args.checkpoint.exists():
+        args.checkpoint.unlink()
+    result = run(args.checkpoint, workers=args.workers, batch=args.batch, rate=args.rate, dry_run=args.dry_run)
+    print(json.dumps(result, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())